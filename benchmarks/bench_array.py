@@ -0,0 +1,71 @@
+"""Compare the memory and time taken to parse long numeric lists into lists and arrays.
+
+    python benchmarks/bench_array.py [--sizes N ...]
+"""
+
+import time
+import tracemalloc
+from dataclasses import dataclass
+from typing import List
+
+from dataclass_opt import DataClassParser, opt
+
+
+@dataclass
+class AsList:
+    ids: List[int] = opt()
+    weights: List[float] = opt()
+
+
+@dataclass
+class AsArray:
+    ids: List[int] = opt(container="array")
+    weights: List[float] = opt(container="array")
+
+
+@dataclass
+class Benchmark:
+    sizes: List[int] = opt(default_factory=lambda: [10**5, 10**6], help="elements per list")
+
+
+def main():
+    args = DataClassParser(Benchmark).parse_args()
+
+    engines = [("list", AsList), ("array", AsArray)]
+    try:
+        import numpy  # noqa: F401
+    except ImportError:
+        pass
+    else:
+
+        @dataclass
+        class AsNumpy:
+            ids: List[int] = opt(container="numpy")
+            weights: List[float] = opt(container="numpy")
+
+        engines.append(("numpy", AsNumpy))
+
+    for size in args.sizes:
+        argv = ["--ids"] + [str(i) for i in range(size)]
+        argv += ["--weights"] + [str(i / 7) for i in range(size)]
+        print("{} elements per list".format(size))
+
+        for name, cls in engines:
+            parser = DataClassParser(cls)
+
+            start = time.perf_counter()
+            parser.parse_args(argv)
+            elapsed = time.perf_counter() - start
+
+            # Measure memory separately, as tracing slows parsing down
+            tracemalloc.start()
+            result = parser.parse_args(argv)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            del result
+
+            print("{:>9}: {:8.1f} MiB peak {:8.3f} s".format(name, peak / 2**20, elapsed))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+"""Compare the fast parse path with full argparse parsing.
+
+    python benchmarks/bench_fast_parse.py [--number N]
+"""
+
+import timeit
+from dataclasses import dataclass
+from typing import List
+
+from dataclass_opt import DataClassParser, opt
+
+
+@dataclass
+class Options:
+    name: str = opt()
+    count: int = opt(default=1)
+    ratio: float = opt(default=0.5, short=None)
+    verbose: bool = opt(default=False)
+    dry_run: bool = opt(default=False)
+    items: List[int] = opt(default_factory=list, short=None)
+    tags: List[str] = opt(default_factory=list)
+
+
+ARGV = "--name job -c 10 --ratio 0.25 -v --items 1 2 3 4 5 6 7 8 --tags a b c".split()
+
+
+@dataclass
+class Benchmark:
+    number: int = opt(default=20000, help="parses per measurement")
+    repeat: int = opt(default=5, help="measurements per engine; the best is reported")
+
+
+def main():
+    args = DataClassParser(Benchmark).parse_args()
+
+    fast = DataClassParser(Options)
+    slow = DataClassParser(Options, fast_parse=False)
+    assert fast.parse_args(ARGV) == slow.parse_args(ARGV)
+
+    results = {}
+    for name, parser in [("argparse", slow), ("fast path", fast)]:
+        best = min(
+            timeit.repeat(lambda: parser.parse_args(ARGV), number=args.number, repeat=args.repeat)
+        )
+        results[name] = best / args.number * 1e6
+        print("{:>10}: {:8.2f} us/parse".format(name, results[name]))
+
+    print("   speedup: {:8.1f}x".format(results["argparse"] / results["fast path"]))
+
+
+if __name__ == "__main__":
+    main()
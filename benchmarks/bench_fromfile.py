@@ -0,0 +1,67 @@
+"""Compare the memory used to read a long list of paths from an @file.
+
+    python benchmarks/bench_fromfile.py [--lines N]
+"""
+
+import os
+import tempfile
+import time
+import tracemalloc
+from argparse import ArgumentParser
+from dataclasses import dataclass
+from typing import List
+
+from dataclass_opt import DataClassParser, opt
+
+
+@dataclass
+class AsList:
+    paths: List[str] = opt()
+
+
+@dataclass
+class AsView:
+    paths: List[str] = opt(file_view=True)
+
+
+@dataclass
+class Benchmark:
+    lines: int = opt(default=1000000, help="paths in the file")
+
+
+def measure(parse):
+    tracemalloc.start()
+    start = time.perf_counter()
+    args = parse()
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return args, elapsed, peak
+
+
+def main():
+    args = DataClassParser(Benchmark).parse_args()
+
+    stock = ArgumentParser(fromfile_prefix_chars="@")
+    stock.add_argument("--paths", nargs="+")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "paths.txt")
+        with open(path, "w") as f:
+            for i in range(args.lines):
+                f.write("/data/shard-{:08d}/part.parquet\n".format(i))
+        argv = ["--paths", "@" + path]
+
+        for name, parser in [
+            ("argparse", stock),
+            ("list", DataClassParser(AsList, fromfile_prefix_chars="@")),
+            ("view", DataClassParser(AsView, fromfile_prefix_chars="@")),
+        ]:
+            result, elapsed, peak = measure(lambda: parser.parse_args(argv))
+            assert len(result.paths) == args.lines
+            del result
+            print("{:>9}: {:8.1f} MiB peak {:8.3f} s".format(name, peak / 2**20, elapsed))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""Compare the memory held by a million parse results, as plain dataclasses and compact variants.
+
+    python benchmarks/bench_records.py [--count N] [--fields N ...]
+
+Each result is kept, as when collecting configs.  The memory still allocated afterwards (traced
+with `tracemalloc`, which slows parsing down) is scaled to a million results, and the time per
+parse is measured separately, without tracing.
+"""
+
+import gc
+import time
+import tracemalloc
+from dataclasses import dataclass, make_dataclass
+from typing import List
+
+from dataclass_opt import DataClassParser, opt
+
+KINDS = [None, "slots", "frozen", "tuple"]
+
+
+@dataclass
+class Benchmark:
+    count: int = opt(default=10**5, help="parse results to keep")
+    fields: List[int] = opt(default_factory=lambda: [4, 16], help="fields per dataclass")
+
+
+def config_dataclass(count):
+    fields = [("field_{}".format(i), int, opt(default=0, short=None)) for i in range(count)]
+    return make_dataclass("Config{}".format(count), fields)
+
+
+def main():
+    args = DataClassParser(Benchmark).parse_args()
+
+    for field_count in args.fields:
+        cls = config_dataclass(field_count)
+        # Distinct values for a few fields, so that results do not share all their values
+        argvs = [
+            ["--field-0", str(i), "--field-{}".format(field_count - 1), str(i % 1000)]
+            for i in range(1000)
+        ]
+        print("{} fields, {} results".format(field_count, args.count))
+
+        for kind in KINDS:
+            parser = DataClassParser(cls, compact=kind)
+            parse = parser.parse_args
+            parse(argvs[0])
+
+            start = time.perf_counter()
+            results = [parse(argvs[i % 1000]) for i in range(args.count)]
+            elapsed = time.perf_counter() - start
+            del results
+
+            gc.collect()
+            tracemalloc.start()
+            before = tracemalloc.get_traced_memory()[0]
+            results = [parse(argvs[i % 1000]) for i in range(args.count)]
+            gc.collect()
+            held = tracemalloc.get_traced_memory()[0] - before
+            tracemalloc.stop()
+            del results
+
+            per_million = held / 2**20 * 10**6 / args.count
+            print(
+                "{:>9}: {:8.1f} MiB per million {:8.2f} us per parse".format(
+                    kind or "dataclass", per_million, elapsed / args.count * 1e6
+                )
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,266 @@
+"""Benchmark parser construction, parsing, import time and memory, and save the results as JSON.
+
+    python benchmarks/run.py [-o results.json] [--compare baseline.json] [--quick] [--filter TEXT]
+
+Each benchmark reports the best time per call over several repeats.  Construction is measured
+both cold (with the plan cache cleared before each parser) and warm.  Results can be compared
+with an earlier run using --compare.
+"""
+
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import timeit
+import tracemalloc
+from dataclasses import dataclass, make_dataclass
+from typing import List, Optional
+
+import dataclass_opt
+from dataclass_opt import DataClassParser, clear_plan_cache, opt
+
+FIELD_COUNTS = [10, 100, 1000]
+COMMAND_COUNTS = [1, 10, 100, 500]
+LIST_SIZES = [10, 1000, 100000]
+NESTING_DEPTHS = [1, 4, 16]
+
+
+@dataclass
+class Benchmark:
+    output: Optional[str] = opt(default=None, help="file to write the JSON results to")
+    compare: Optional[str] = opt(default=None, help="earlier results to compare with", short=None)
+    quick: bool = opt(default=False, help="fewer repeats and smaller sizes", short=None)
+    filter: Optional[str] = opt(
+        default=None, help="only run benchmarks whose name contains this text"
+    )
+
+
+# Dataclasses to benchmark
+
+
+def fields_dataclass(count, name="Fields"):
+    """Return a dataclass with `count` fields of assorted types."""
+    kinds = [
+        (int, lambda i: opt(default=i, short=None)),
+        (str, lambda i: opt(default="x", short=None)),
+        (float, lambda i: opt(default=0.5, short=None)),
+        (bool, lambda i: opt(default=False, short=None)),
+        (List[int], lambda i: opt(default_factory=list, short=None)),
+    ]
+    fields = []
+    for i in range(count):
+        field_type, make_field = kinds[i % len(kinds)]
+        fields.append(("field_{}".format(i), field_type, make_field(i)))
+    return make_dataclass("{}{}".format(name, count), fields)
+
+
+def fields_argv(count):
+    argv = []
+    for i in range(0, count, 5):
+        argv += ["--field-{}".format(i), str(i), "--field-{}".format(i + 3)]
+    return argv
+
+
+@dataclass
+class Lists:
+    items: List[int] = opt()
+
+
+def command_dataclasses(count, name):
+    return [fields_dataclass(10, "{}{}_".format(name, i)) for i in range(count)]
+
+
+def commands_parser(classes, lazy=False):
+    parser = DataClassParser(lazy_commands=lazy)
+    for i, cls in enumerate(classes):
+        parser.add_command("command-{}".format(i), cls)
+    return parser
+
+
+def nested_parser(classes):
+    parser = top = DataClassParser()
+    for i, cls in enumerate(classes):
+        parser = parser.add_command("level-{}".format(i), cls)
+    return top
+
+
+# Measurements
+
+
+def best_time(func, repeat, number=None):
+    """Return the best time for one call of `func`, in seconds."""
+    timer = timeit.Timer(func)
+    if number is None:
+        number, _ = timer.autorange()
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+
+def cold(build):
+    def run():
+        clear_plan_cache()
+        return build()
+
+    return run
+
+
+def peak_memory(func):
+    """Return the peak memory allocated while calling `func`, in bytes."""
+    clear_plan_cache()
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def import_time(repeat):
+    """Return the best time to import dataclass_opt in a fresh interpreter, in seconds."""
+    code = (
+        "import time; start = time.perf_counter(); import dataclass_opt; "
+        "print(time.perf_counter() - start)"
+    )
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, sys.path)))
+    times = []
+    for _ in range(repeat):
+        output = subprocess.check_output([sys.executable, "-c", code], env=env)
+        times.append(float(output))
+    return min(times)
+
+
+def benchmarks(quick):
+    """Yield (name, parameters, measure) for every benchmark; `measure()` returns the results."""
+    repeat = 3 if quick else 5
+    field_counts = FIELD_COUNTS[:2] if quick else FIELD_COUNTS
+    command_counts = COMMAND_COUNTS[:3] if quick else COMMAND_COUNTS
+    list_sizes = LIST_SIZES[:2] if quick else LIST_SIZES
+    nesting_depths = NESTING_DEPTHS[:2] if quick else NESTING_DEPTHS
+
+    yield "import", {}, lambda: {"seconds": import_time(repeat)}
+
+    for count in field_counts:
+        cls = fields_dataclass(count)
+        argv = fields_argv(count)
+
+        def measure(cls=cls, argv=argv):
+            parser = DataClassParser(cls)
+            obj = parser.parse_args(argv)
+            return {
+                "construct_cold": best_time(cold(lambda: DataClassParser(cls)), repeat),
+                "construct_warm": best_time(lambda: DataClassParser(cls), repeat),
+                "parse_args": best_time(lambda: parser.parse_args(argv), repeat),
+                "parse_known_args": best_time(
+                    lambda: parser.parse_known_args(argv + ["--unknown"]), repeat
+                ),
+                "to_argv": best_time(lambda: dataclass_opt.to_argv(obj), repeat),
+                "peak_bytes": peak_memory(lambda: DataClassParser(cls)),
+            }
+
+        yield "fields", {"fields": count}, measure
+
+    for count in command_counts:
+
+        def measure(count=count):
+            classes = command_dataclasses(count, "Command")
+            parser = commands_parser(classes)
+            argv = ["command-{}".format(count - 1)] + fields_argv(10)
+            return {
+                "construct_cold": best_time(cold(lambda: commands_parser(classes)), repeat),
+                "construct_warm": best_time(lambda: commands_parser(classes), repeat),
+                "construct_lazy": best_time(lambda: commands_parser(classes, lazy=True), repeat),
+                "parse_args": best_time(lambda: parser.parse_args(argv), repeat),
+                "peak_bytes": peak_memory(lambda: commands_parser(classes)),
+            }
+
+        yield "commands", {"commands": count}, measure
+
+    for size in list_sizes:
+
+        def measure(size=size):
+            parser = DataClassParser(Lists)
+            argv = ["--items"] + [str(i) for i in range(size)]
+            return {
+                "parse_args": best_time(lambda: parser.parse_args(argv), repeat),
+                "peak_bytes": peak_memory(lambda: parser.parse_args(argv)),
+            }
+
+        yield "lists", {"items": size}, measure
+
+    for depth in nesting_depths:
+
+        def measure(depth=depth):
+            classes = command_dataclasses(depth, "Level")
+            parser = nested_parser(classes)
+            argv = []
+            for i in range(depth):
+                argv += ["level-{}".format(i)] + fields_argv(10)
+            return {
+                "construct_cold": best_time(cold(lambda: nested_parser(classes)), repeat),
+                "construct_warm": best_time(lambda: nested_parser(classes), repeat),
+                "parse_args": best_time(lambda: parser.parse_args(argv), repeat),
+                "peak_bytes": peak_memory(lambda: nested_parser(classes)),
+            }
+
+        yield "nesting", {"depth": depth}, measure
+
+
+def result_key(result):
+    return "{}[{}]".format(
+        result["name"], ",".join("{}={}".format(k, v) for k, v in sorted(result["params"].items()))
+    )
+
+
+def format_value(metric, value):
+    if metric.endswith("bytes"):
+        return "{:10.1f} KiB".format(value / 1024)
+    return "{:10.1f} us ".format(value * 1e6)
+
+
+def report(results, baseline):
+    previous = {result_key(result): result for result in baseline}
+    for result in results:
+        key = result_key(result)
+        for metric, value in result["metrics"].items():
+            line = "{:<32} {:<18} {}".format(key, metric, format_value(metric, value))
+            old = previous.get(key, {}).get("metrics", {}).get(metric)
+            if old:
+                line += "  {:6.2f}x".format(value / old)
+            print(line)
+
+
+def main():
+    args = DataClassParser(Benchmark).parse_args()
+
+    results = []
+    for name, params, measure in benchmarks(args.quick):
+        result = {"name": name, "params": params}
+        if args.filter and args.filter not in result_key(result):
+            continue
+        result["metrics"] = measure()
+        results.append(result)
+
+    baseline = []
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+    report(results, baseline)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(
+                {
+                    "version": dataclass_opt.__version__,
+                    "python": platform.python_version(),
+                    "platform": platform.platform(),
+                    "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+                    "results": results,
+                },
+                f,
+                indent=2,
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,22 +1,77 @@
 """A library for building ArgumentParsers from dataclasses.
+
+Only what is needed to build a parser is imported up front.  The public names of `argparse`, and
+the `inflection` name conversions, are re-exported, but only loaded when first used.
 """
 
 import argparse
+import functools
+import itertools
+import os
 import re
 import sys
-import typing
-from argparse import *  # noqa: F401, F403
-from argparse import ArgumentParser, Namespace
+import threading
+import types
+from argparse import ArgumentError, ArgumentParser, ArgumentTypeError, Namespace
+from array import array
+from collections import OrderedDict, namedtuple
 from collections.abc import Mapping
-from dataclasses import MISSING, field, fields, is_dataclass, make_dataclass
+from contextvars import ContextVar
+from dataclasses import MISSING, field, fields, is_dataclass
+from time import perf_counter
 
-from inflection import dasherize, underscore
+__version__ = "0.1.0"
 
-if sys.version_info >= (3, 9, 0):
-    from argparse import BooleanOptionalAction
+__all__ = [
+    "ConfigFileError",
+    "DataClassParser",
+    "MappedTokens",
+    "MustBeADataclass",
+    "NoDefaultFunction",
+    "ParseError",
+    "ParserStats",
+    "UnsupportedException",
+    "amap",
+    "arg",
+    "clear_plan_cache",
+    "concurrency_limit",
+    "dasherize",
+    "opt",
+    "to_argv",
+    "underscore",
+] + argparse.__all__
 
+_LAZY_INFLECTION = ("dasherize", "underscore")
+_LAZY_AIO = ("amap", "concurrency_limit")
 
-__version__ = "0.1.0"
+# types.GenericAlias (e.g., list[int]) only exists in Python 3.9+
+_GenericAlias = getattr(types, "GenericAlias", ())
+
+
+def __getattr__(name):
+    if name in _LAZY_INFLECTION:
+        import inflection
+
+        return getattr(inflection, name)
+
+    if name == "MappedTokens":
+        from ._fromfile import MappedTokens
+
+        return MappedTokens
+
+    if name in _LAZY_AIO:
+        from . import _aio
+
+        return getattr(_aio, name)
+
+    if name in argparse.__all__:
+        return getattr(argparse, name)
+
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
 
 
 class MustBeADataclass(Exception):
@@ -31,6 +86,168 @@ class UnsupportedException(Exception):
     pass
 
 
+class ConfigFileError(Exception):
+    pass
+
+
+class ParseError(Exception):
+    """An argument error, raised instead of exiting while parsing in batch mode.
+
+    `argv` is the argument list which failed to parse, and `line` its line number in a stream
+    given to `iter_parse`.
+    """
+
+    def __init__(self, message, status=2, argv=None, line=None):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+        self.argv = argv
+        self.line = line
+
+
+class ParserStats:
+    """Timings and counts for the phases of building parsers and parsing arguments.
+
+    Pass an instance as `DataClassParser(..., stats=stats)`; it is shared with the parser's
+    commands.  Each phase is recorded with `record(phase, name, seconds)`, where `name` is a
+    dataclass (`"Cls"`) or a field (`"Cls.field"`):
+
+    - building: "plan" (looking up or computing the arguments for a dataclass), "introspect"
+      (`dataclasses.fields`), "get_names", "get_type", "default_factory" and "add_argument";
+    - parsing: "argparse" (a full argparse parse, including type conversion), "fast_parse",
+      "convert" (the type conversion of one field) and "construct" (creating a dataclass).
+
+    Override `record` to forward the measurements elsewhere, e.g. to a metrics library.  Parsers
+    without stats only pay for an `is None` check per phase.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.totals = {}
+
+    def record(self, phase, name, seconds):
+        with self._lock:
+            count, total = self.totals.get((phase, name), (0, 0.0))
+            self.totals[(phase, name)] = (count + 1, total + seconds)
+
+    def summary(self, phase=None):
+        """Return (phase, name, count, seconds) tuples, slowest first."""
+        with self._lock:
+            rows = [
+                (key[0], key[1], count, seconds)
+                for key, (count, seconds) in self.totals.items()
+                if phase is None or key[0] == phase
+            ]
+        return sorted(rows, key=lambda row: row[3], reverse=True)
+
+    def clear(self):
+        with self._lock:
+            self.totals.clear()
+
+
+# The stats of the parser whose arguments are being added, for _compile_plan
+_build_stats = ContextVar("_build_stats", default=None)
+
+
+def _timed(stats, phase, name, func, *args, **kwargs):
+    if stats is None:
+        return func(*args, **kwargs)
+    start = perf_counter()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        stats.record(phase, name, perf_counter() - start)
+
+
+def _field_type(cls, dc_field):
+    """Return the annotation of a field of `cls`, with string annotations resolved."""
+    return _get_type_hints(cls).get(dc_field.name, dc_field.type)
+
+
+def _nested_class(cls, dc_field):
+    """Return the dataclass of a field whose options are flattened into the parent, or None."""
+    field_type = _field_type(cls, dc_field)
+    if is_dataclass(field_type) and isinstance(field_type, type):
+        if "type" not in dc_field.metadata:
+            return field_type
+    return None
+
+
+def _identity(value):
+    return value
+
+
+def _nested_default(factory, name):
+    value = factory()
+    for attr in name.split("."):
+        value = getattr(value, attr)
+    return value
+
+
+# Actions which do not take a value, and so have no metavar
+_NO_VALUE_ACTIONS = ("store_true", "store_false", "store_const", "count", "help", "version")
+
+
+def _nested_metavar(option_string):
+    return option_string[2:].upper().replace("-", "_")
+
+
+def _nested_specs(dc_field, nested_cls):
+    """Return the specs for the fields of `nested_cls`, as options of the parent dataclass.
+
+    The field `db` of type `Db`, whose own field `pool` has a field `max_size`, gives the option
+    `--db-pool-max-size` stored as `db.pool.max_size`.  Nested positionals become options.  If the
+    parent field has a default, the nested options default to its attribute values.
+    """
+    dest_prefix = dc_field.name + "."
+    option_prefix = "--" + dc_field.name.replace("_", "-") + "-"
+
+    outer_factory = None
+    if dc_field.default_factory is not MISSING:
+        outer_factory = dc_field.default_factory
+    elif dc_field.default is not MISSING:
+        outer_factory = functools.partial(_identity, dc_field.default)
+
+    specs = []
+    for spec in _get_plan(nested_cls):
+        kwargs = dict(spec.kwargs, dest=dest_prefix + spec.name)
+        default_factory = spec.default_factory
+
+        long_names = [name for name in spec.names if name.startswith("--")]
+        if "dest" not in spec.kwargs:
+            # A positional
+            long_names = ["--" + spec.name.replace("_", "-")]
+            nargs = kwargs.get("nargs")
+            if nargs == "?":
+                del kwargs["nargs"]
+            kwargs["required"] = "default" not in kwargs and nargs not in ("?", "*")
+        elif not long_names:
+            long_names = ["--" + spec.name.replace("_", "-")]
+
+        if outer_factory is not None:
+            default_factory = functools.partial(_nested_default, outer_factory, spec.name)
+            kwargs["default"] = default_factory()
+            kwargs["required"] = False
+
+        names = tuple(option_prefix + name[2:] for name in long_names)
+        metavar = kwargs.get("metavar")
+        if kwargs.get("action") not in _NO_VALUE_ACTIONS and (
+            metavar is None or metavar == _nested_metavar(long_names[0])
+        ):
+            # Rather than the default, DB.POOL.MAX_SIZE
+            kwargs["metavar"] = _nested_metavar(names[0])
+        specs.append(
+            spec._replace(
+                name=dest_prefix + spec.name,
+                names=names,
+                kwargs=kwargs,
+                default_factory=default_factory,
+            )
+        )
+
+    return specs
+
+
 def _is_arg(dc_field):
     return "_names" not in dc_field.metadata
 
@@ -68,27 +285,38 @@ def _get_names(dc_field):
             if short != MISSING and short:
                 yield short
             elif short == MISSING:
-                for match in re.finditer(r"\w", dc_field.name):
-                    yield "-" + match.group(0)
-                    break
+                # Field names are identifiers, so the first character is always a word character
+                yield "-" + dc_field.name[0]
 
 
 def _get_type(arg_type):
+    """Return (base type, is optional, is list) for an annotation, memoized per annotation."""
+    try:
+        return _get_cached_type(arg_type)
+    except TypeError:
+        # An unhashable annotation
+        return _compute_type(arg_type)
+
+
+def _compute_type(arg_type):
     base_type = None
     is_optional = False
     is_list = False
 
+    # typing is expensive to import, but if an annotation uses it, it has already been imported
+    typing = sys.modules.get("typing")
+
     if (
-        isinstance(arg_type, typing._GenericAlias)
-        or sys.version_info >= (3, 9, 0)
-        and isinstance(arg_type, typing.GenericAlias)
+        typing is not None
+        and isinstance(arg_type, typing._GenericAlias)
+        or isinstance(arg_type, _GenericAlias)
     ):
         origin = arg_type.__origin__
         args = arg_type.__args__
 
         # Check if type is Optional, and unwrap if needed
         # Note: Optional is an alias for Union[type, None]
-        if origin == typing.Union:
+        if typing is not None and origin == typing.Union:
             if type(None) in args:
                 is_optional = True
                 if len(args) == 2:
@@ -115,7 +343,7 @@ def _get_type(arg_type):
     else:
         base_type = arg_type
 
-    if isinstance(base_type, typing._Final):
+    if typing is not None and isinstance(base_type, typing._Final):
         base_type = None
 
     return base_type, is_optional, is_list
@@ -128,17 +356,125 @@ def _get_action(is_arg, arg_type):
     return None
 
 
+# Element types of the containers given with opt(..., container=...), and their array typecodes
+_ARRAY_TYPECODES = {int: "q", float: "d"}
+_CONTAINERS = ("array", "numpy")
+
+
+def _to_container(container, type_func, values):
+    """Convert the strings (or numbers) `values` with `type_func` into a compact array.
+
+    Raises ValueError or OverflowError for bad values, like `type_func`.
+    """
+    if container == "numpy":
+        import numpy
+
+        dtype = numpy.int64 if type_func is int else numpy.float64
+        return numpy.fromiter(map(type_func, values), dtype=dtype)
+
+    return array(_ARRAY_TYPECODES[type_func], map(type_func, values))
+
+
+def _container_default(container, type_func, default):
+    """Convert a default, or the result of a default factory, like parsed values."""
+    if callable(default):
+        default = default()
+    return _to_container(container, type_func, default)
+
+
+class _ArrayStoreAction(argparse._StoreAction):
+    """Store a list of numbers as an `array.array`, or a NumPy array, converted in bulk.
+
+    DataClassParser hands this action the strings it consumed, rather than converting them one at
+    a time, and the values are only boxed as Python numbers one at a time on their way into the
+    array.
+    """
+
+    def __init__(self, option_strings, dest, array_type="array", **kwargs):
+        super().__init__(option_strings, dest, **kwargs)
+        # Not `container`, which argparse uses for the parser or group holding the action
+        self.array_type = array_type
+
+    def convert_many(self, arg_strings):
+        return _to_container(self.array_type, self.type, arg_strings)
+
+    def __call__(self, parser, namespace, values, option_string=None):
+        if isinstance(values, list):
+            # Converted one at a time, by a parser other than DataClassParser
+            values = self.convert_many(values)
+        setattr(namespace, self.dest, values)
+
+
+_BOOLEAN_STATES = {
+    "1": True,
+    "yes": True,
+    "true": True,
+    "on": True,
+    "0": False,
+    "no": False,
+    "false": False,
+    "off": False,
+}
+
+
+def _to_bool(value):
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, str) and value.lower() in _BOOLEAN_STATES:
+        return _BOOLEAN_STATES[value.lower()]
+    raise ValueError("{!r} is not a boolean".format(value))
+
+
+def _command_name(cls):
+    """Return the command name for a dataclass, or for a "module:ClassName" string."""
+    from inflection import dasherize, underscore
+
+    if isinstance(cls, str):
+        return dasherize(underscore(cls.rpartition(":")[2].rpartition(".")[2]))
+    return dasherize(underscore(cls.__name__))
+
+
 def _to_name_command_dict(commands):
     if is_dataclass(commands):
         command = commands
-        name = command.__name__
-        return {dasherize(underscore(name)): command}
+        return {_command_name(command): command}
 
     if isinstance(commands, Mapping):
         return commands
 
+    if isinstance(commands, str):
+        return {_command_name(commands): commands}
+
     if isinstance(commands, list):
-        return {dasherize(underscore(command.__name__)): command for command in commands}
+        return {_command_name(command): command for command in commands}
+
+
+def _with_func(cls, func):
+    """Derive a dataclass from `cls` with a `func` field defaulting to `func`."""
+    import typing
+    from dataclasses import make_dataclass
+
+    class_name = cls.__name__ + "_"
+    return make_dataclass(
+        class_name, fields=[("func", typing.Callable, field(default=func))], bases=(cls,)
+    )
+
+
+def _command_call(result):
+    """Return (func, args) to run the command `func` of a parse result, or (None, ()).
+
+    `func` is called with the command dataclass, preceded by the top-level dataclass (or
+    namespace) if the parse result has one.
+    """
+    if type(result) is tuple:
+        top, command = result
+    else:
+        top, command = None, result
+
+    func = getattr(command, "func", None)
+    if func is None:
+        return None, ()
+    return func, (command,) if top is None else (top, command)
 
 
 def opt(*names, **kwargs):
@@ -158,7 +494,829 @@ def arg(**kwargs):
     return field(default=default, default_factory=default_factory, metadata=kwargs)
 
 
-_parsing_args = False
+_ArgumentSpec = namedtuple(
+    "_ArgumentSpec", ["name", "names", "kwargs", "default_factory", "env", "file_view"]
+)
+_ArgumentSpec.__doc__ = """The precomputed `add_argument` call for a single dataclass field.
+
+If `default_factory` is not None, it is called on every replay, and its result is passed as the
+`default` keyword argument.  `env` is the environment variable given with `opt(..., env=...)`, and
+`file_view` is true if the field should be given a `MappedTokens` view of an @file.
+"""
+
+_CACHE_MAXSIZE = 1024
+
+
+class _LRUCache:
+    """A bounded, thread-safe cache of values compiled once per dataclass."""
+
+    def __init__(self, compile, maxsize=_CACHE_MAXSIZE):
+        self.compile = compile
+        self.maxsize = maxsize
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __call__(self, cls):
+        with self.lock:
+            value = self.data.get(cls)
+            if value is not None:
+                self.data.move_to_end(cls)
+                return value
+
+        # Compile outside of the lock; if two threads race, both values are equivalent
+        value = self.compile(cls)
+
+        with self.lock:
+            self.data[cls] = value
+            if len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+
+        return value
+
+    def pop(self, cls):
+        with self.lock:
+            self.data.pop(cls, None)
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+
+
+def _compile_plan(cls):
+    """Compute the `add_argument` calls for the fields of a dataclass."""
+    plan = []
+    stats = _build_stats.get()
+
+    for dc_field in _timed(stats, "introspect", cls.__qualname__, fields, cls):
+        metadata = dc_field.metadata
+        if metadata.get("suppress"):
+            continue
+
+        nested_cls = _nested_class(cls, dc_field)
+        if nested_cls is not None:
+            plan.extend(_nested_specs(dc_field, nested_cls))
+            continue
+
+        field_name = cls.__qualname__ + "." + dc_field.name
+        names = _timed(stats, "get_names", field_name, lambda: tuple(_get_names(dc_field)))
+        is_arg = _is_arg(dc_field)
+
+        # type
+        default_arg_type, is_optional, is_list = _timed(
+            stats, "get_type", field_name, _get_type, _field_type(cls, dc_field)
+        )
+        arg_type = metadata.get("type", default_arg_type)
+
+        # action
+        default_action = _get_action(is_arg, arg_type)
+        action = metadata.get("action", default_action)
+
+        if action == "append_const":
+            raise UnsupportedException("append_const is not yet supported")
+
+        # const
+        const = metadata.get("const")
+
+        # default value
+        default_factory = None
+        if dc_field.default == MISSING and dc_field.default_factory == MISSING:
+            default = None
+        elif dc_field.default != MISSING:
+            default = dc_field.default
+        else:
+            # The factory is called here to make decisions based on the default value, and again
+            # each time the plan is replayed, so that every parser gets a fresh default.
+            default_factory = dc_field.default_factory
+            default = _timed(stats, "default_factory", field_name, default_factory)
+
+        use_default = arg_type != bool and action not in [
+            "store_true",
+            "store_false",
+        ]
+        pass_null_default = is_optional
+
+        # nargs
+        if is_list and action is None:
+            # Assume at least one argument; user can override with
+            # arg(..., nargs=...) or opt(..., nargs=...)
+            default_nargs = "+"
+        elif is_arg and default:
+            # argument with a default value
+            default_nargs = "?"
+        elif is_arg and default is None and is_optional:
+            # explicitly marked as optional (default value will be None)
+            default_nargs = "?"
+        else:
+            default_nargs = None
+
+        nargs = metadata.get("nargs", default_nargs)
+
+        container = metadata.get("container")
+        if container is not None:
+            if container not in _CONTAINERS:
+                raise UnsupportedException(
+                    "container must be one of {}, not {!r}".format(_CONTAINERS, container)
+                )
+            if not is_list or action is not None or arg_type not in _ARRAY_TYPECODES:
+                raise UnsupportedException(
+                    "container={!r} requires a List[int] or List[float] field".format(container)
+                )
+            if container == "numpy":
+                import importlib.util
+
+                if importlib.util.find_spec("numpy") is None:
+                    raise UnsupportedException("container='numpy' requires NumPy")
+            action = _ArrayStoreAction
+
+        # choices
+        choices = metadata.get("choices")
+        metavar = metadata.get("metavar")
+        version = metadata.get("version")
+        help = metadata.get("help")
+
+        # required
+        required = (
+            dc_field.default == MISSING
+            and dc_field.default_factory == MISSING
+            and not is_optional
+            and default_arg_type != bool
+        )
+
+        # all arguments
+        kwargs = {}
+
+        if action is not None:
+            kwargs["action"] = action
+
+        if nargs is not None:
+            kwargs["nargs"] = nargs
+
+        if const is not None:
+            kwargs["const"] = const
+
+        if (default is not None and use_default) or (default is None and pass_null_default):
+            kwargs["default"] = default
+        else:
+            default_factory = None
+
+        if arg_type is not None and action not in [
+            "store_const",
+            "append_const",
+            "store_true",
+            "store_false",
+            "count",
+        ]:
+            kwargs["type"] = arg_type
+
+        if choices is not None:
+            kwargs["choices"] = choices
+
+        if container is not None:
+            kwargs["array_type"] = container
+            if kwargs.get("default") is not None:
+                # Left out options get an array too, made afresh on every replay
+                default_factory = functools.partial(
+                    _container_default, container, arg_type, default_factory or default
+                )
+                kwargs["default"] = default_factory()
+
+        if metavar is not None:
+            kwargs["metavar"] = metavar
+
+        if version is not None:
+            kwargs["version"] = version
+
+        if help is not None:
+            kwargs["help"] = help
+
+        if not is_arg and required is not None:
+            kwargs["required"] = required
+
+        if not is_arg:
+            kwargs["dest"] = dc_field.name
+
+        plan.append(
+            _ArgumentSpec(
+                dc_field.name,
+                names,
+                kwargs,
+                default_factory,
+                metadata.get("env"),
+                bool(metadata.get("file_view")),
+            )
+        )
+
+    return tuple(plan)
+
+
+_Converter = namedtuple("_Converter", ["build", "names"])
+_Converter.__doc__ = """A compiled constructor for a dataclass.
+
+`build(data)` creates an instance from the attributes of a parsed namespace (`vars(namespace)`),
+and `names` holds the field names, plus the `cls` and `cmd_cls` bookkeeping attributes, so that
+the rest of the namespace can be separated out.
+"""
+
+_CONVERTER_TEMPLATE = """\
+def build{suffix}(data):
+    if {condition}:
+        return cls{suffix}({kwargs})
+    kwargs = {{
+        name: data[prefix{suffix} + name]
+        for name in field_names{suffix}
+        if prefix{suffix} + name in data
+    }}
+    {nested}
+    return cls{suffix}(**kwargs)
+"""
+
+
+def _compile_converter(cls, compact=None):
+    """Generate a function which creates an instance of `cls` from a namespace dict.
+
+    Nested dataclass fields get a function of their own, which reads the prefixed attributes.
+    With `compact`, instances of the compact variants of `cls` and its nested dataclasses are
+    created instead.
+    """
+    added = {spec.name for spec in _get_plan(cls)}
+    namespace = {}
+    sources = []
+    names = {"cls", "cmd_cls"}
+
+    def compile_class(cls, prefix):
+        suffix = "_{}".format(len(sources)) if sources or prefix else ""
+        sources.append(None)
+        index = len(sources) - 1
+
+        field_names = []
+        nested = []
+        for dc_field in fields(cls):
+            nested_cls = _nested_class(cls, dc_field)
+            if nested_cls is None:
+                field_names.append(dc_field.name)
+            else:
+                nested_prefix = prefix + dc_field.name + "."
+                if any(name.startswith(nested_prefix) for name in added):
+                    nested.append((dc_field.name, compile_class(nested_cls, nested_prefix)))
+                else:
+                    field_names.append(dc_field.name)
+
+        dests = [prefix + name for name in field_names]
+        names.update(dests)
+        present = frozenset(
+            dest for dest in dests if dest in added and dest.split(".")[-1].isidentifier()
+        )
+        others = frozenset(dests) - present
+
+        # Fields added to the parser are always in the namespace, so they can be read directly
+        condition = "data.keys() >= present{}".format(suffix)
+        if others:
+            condition += " and others{}.isdisjoint(data)".format(suffix)
+        kwargs = [
+            "{}=data[{!r}]".format(name, prefix + name)
+            for name in field_names
+            if prefix + name in present
+        ]
+        kwargs += ["{}=build{}(data)".format(name, nested_suffix) for name, nested_suffix in nested]
+        nested_kwargs = "; ".join(
+            "kwargs[{!r}] = build{}(data)".format(name, nested_suffix)
+            for name, nested_suffix in nested
+        )
+
+        namespace.update(
+            {
+                "cls" + suffix: cls if compact is None else _get_compact_class[compact](cls),
+                "field_names" + suffix: tuple(field_names),
+                "present" + suffix: present,
+                "others" + suffix: others,
+                "prefix" + suffix: prefix,
+            }
+        )
+        sources[index] = _CONVERTER_TEMPLATE.format(
+            suffix=suffix,
+            condition=condition,
+            kwargs=", ".join(kwargs),
+            nested=nested_kwargs or "pass",
+        )
+        return suffix
+
+    compile_class(cls, "")
+    exec("\n".join(sources), namespace)
+
+    return _Converter(namespace["build"], frozenset(names))
+
+
+def _compile_type_hints(cls):
+    """Return {field name: annotation} for a dataclass, resolving string annotations.
+
+    Annotations are strings with `from __future__ import annotations` (PEP 563), or when quoted
+    as forward references.  They are resolved with `typing.get_type_hints`, once per class;
+    `typing` is only imported if a dataclass has such annotations.  An annotation which cannot
+    be resolved, e.g. a name only imported under `typing.TYPE_CHECKING`, is given as None, so
+    that its values are left as strings.
+    """
+    annotations = {dc_field.name: dc_field.type for dc_field in fields(cls)}
+    names = [name for name, annotation in annotations.items() if isinstance(annotation, str)]
+    if not names:
+        return annotations
+
+    import typing
+
+    try:
+        hints = typing.get_type_hints(cls)
+    except Exception:
+        hints = {name: _resolve_annotation(cls, name) for name in names}
+    for name in names:
+        annotations[name] = hints.get(name)
+    return annotations
+
+
+def _resolve_annotation(cls, name):
+    """Resolve the string annotation of one field, or return None if it cannot be resolved."""
+    for klass in cls.__mro__:
+        annotation = klass.__dict__.get("__annotations__", {}).get(name)
+        if annotation is None:
+            continue
+        if not isinstance(annotation, str):
+            return annotation
+        module = sys.modules.get(klass.__module__)
+        try:
+            return eval(annotation, getattr(module, "__dict__", {}), dict(vars(klass)))
+        except Exception:
+            return None
+    return None
+
+
+_get_type_hints = _LRUCache(_compile_type_hints)
+_get_type_hints.__doc__ = """Return the cached resolved annotations of a dataclass's fields."""
+
+_get_cached_type = functools.lru_cache(maxsize=_CACHE_MAXSIZE)(_compute_type)
+
+_get_plan = _LRUCache(_compile_plan)
+_get_plan.__doc__ = """Return the cached argument plan for a dataclass, compiling it if needed."""
+
+_get_converter = _LRUCache(_compile_converter)
+
+# The kinds of compact result types, for DataClassParser(..., compact=...)
+_COMPACT_KINDS = ("slots", "frozen", "tuple")
+
+# The class attribute of a compact variant holding the dataclass it was generated from
+_SOURCE_ATTRIBUTE = "__dataclass_opt_source__"
+
+
+def _compile_compact_class(cls, kind):
+    from ._compact import compact_class
+
+    return compact_class(cls, kind)
+
+
+_get_compact_class = {
+    kind: _LRUCache(functools.partial(_compile_compact_class, kind=kind)) for kind in _COMPACT_KINDS
+}
+_get_compact_converter = {
+    kind: _LRUCache(functools.partial(_compile_converter, compact=kind)) for kind in _COMPACT_KINDS
+}
+
+
+def _source_class(cls):
+    """Return the dataclass of which `cls` is a compact variant, or `cls` itself."""
+    return vars(cls).get(_SOURCE_ATTRIBUTE, cls)
+
+
+def clear_plan_cache(cls=None):
+    """Invalidate cached argument plans.
+
+    Plans are compiled once per dataclass and reused for every parser built from it. Call this
+    after modifying a dataclass (or its field metadata) in place. If `cls` is None, all cached
+    plans are dropped.
+    """
+    caches = [_get_type_hints, _get_plan, _get_converter]
+    caches += _get_compact_class.values()
+    caches += _get_compact_converter.values()
+    argv_module = sys.modules.get(__name__ + "._argv")
+    if argv_module is not None:
+        caches.append(argv_module._get_argv_plan)
+    for cache in caches:
+        if cls is None:
+            cache.clear()
+        else:
+            cache.pop(cls)
+
+
+def to_argv(obj, *, skip_defaults=False):
+    """Return the arguments which a `DataClassParser` for `type(obj)` parses back into `obj`.
+
+    Options are written with their first long name, and positionals in order, after the options.
+    With `skip_defaults`, options whose values equal their defaults are left out; otherwise they
+    are written too, so that environment variables and config files of the parsing process do
+    not change the result.  Raises ValueError for values which no arguments parse into, such as
+    None for a required option.  Use `DataClassParser.to_argv` for parsers with commands.
+    """
+    from ._argv import to_argv
+
+    return to_argv(obj, skip_defaults=skip_defaults)
+
+
+_FLAG_ACTIONS = tuple(
+    cls
+    for cls in (
+        argparse._StoreTrueAction,
+        argparse._StoreFalseAction,
+        getattr(argparse, "BooleanOptionalAction", None),
+    )
+    if cls is not None
+)
+
+# An environment variable which could not be converted, with the error message
+_EnvError = namedtuple("_EnvError", ["message"])
+
+# Kinds of options understood by the fast parse path
+_FAST_STORE, _FAST_LIST, _FAST_FLAG, _FAST_HELP = range(4)
+
+_FastTable = namedtuple("_FastTable", ["key", "cls", "options", "actions"])
+_FastTable.__doc__ = """A precomputed option table for parsing without argparse.
+
+`options` maps each option string to `(action, kind, type_func)`.  `key` records the state of the
+parser the table was built from, so that it can be rebuilt if arguments are added later.
+"""
+
+
+def _fast_table_key(parser):
+    return len(parser._actions), len(parser._defaults), parser.have_extra_args, parser.have_commands
+
+
+def _compile_fast_table(parser):
+    """Build the fast parse table for `parser`, or return None if it needs full argparse."""
+    cls = parser._defaults.get("cls")
+    if (
+        not is_dataclass(cls)
+        or list(parser._defaults) != ["cls"]
+        or parser.have_extra_args
+        or parser.have_commands
+        or parser.prefix_chars != "-"
+        or parser.fromfile_prefix_chars is not None
+        or parser._has_negative_number_optionals
+        or parser._mutually_exclusive_groups
+    ):
+        return None
+
+    # Arguments added in other ways, e.g. to an argument group, are left to argparse
+    planned = {spec.name for spec in _get_plan(cls)}
+    options = {}
+    actions = []
+    for action in parser._actions:
+        action_cls = type(action)
+        type_func = None
+        if action_cls is not argparse._HelpAction and action.dest not in planned:
+            return None
+
+        if action_cls is argparse._HelpAction:
+            kind = _FAST_HELP
+        elif action_cls in (argparse._StoreTrueAction, argparse._StoreFalseAction):
+            kind = _FAST_FLAG
+        elif action_cls in (argparse._StoreAction, _ArrayStoreAction) and action.nargs in (
+            None,
+            "+",
+        ):
+            kind = _FAST_STORE if action.nargs is None else _FAST_LIST
+            type_func = parser._registry_get("type", action.type, action.type)
+            if not callable(type_func) or isinstance(type_func, argparse.FileType):
+                # Opening files twice on fallback would leak file handles
+                return None
+        else:
+            return None
+
+        if not action.option_strings:
+            return None
+
+        for option_string in action.option_strings:
+            options[option_string] = (action, kind, type_func)
+        if kind != _FAST_HELP:
+            actions.append((action, type_func))
+
+    return _FastTable(_fast_table_key(parser), cls, options, tuple(actions))
+
+
+def _fast_parse(table, args, layer, stats=None):
+    """Parse `args` into constructor arguments using `table`.
+
+    `layer` holds values (from the environment) to use in place of the defaults.  Conversion
+    times are recorded in `stats`, if given.
+
+    Returns None for anything which is not a plain sequence of known options and their values,
+    or which argparse would report as an error, so that the caller can fall back to argparse.
+    """
+    options = table.options
+    values = {}
+    # Earlier occurrences of repeated options, which argparse converts and checks too
+    earlier = []
+    i = 0
+    n = len(args)
+
+    while i < n:
+        arg_string = args[i]
+        entry = options.get(arg_string)
+        explicit_arg = None
+        if entry is None:
+            if not arg_string.startswith("--") or "=" not in arg_string:
+                return None
+            option_string, explicit_arg = arg_string.split("=", 1)
+            entry = options.get(option_string)
+            if entry is None:
+                return None
+
+        action, kind, type_func = entry
+        i += 1
+
+        if kind == _FAST_FLAG:
+            if explicit_arg is not None:
+                return None
+            values[action.dest] = action.const
+        elif kind == _FAST_STORE:
+            if explicit_arg is None:
+                if i == n or args[i][:1] == "-":
+                    return None
+                explicit_arg = args[i]
+                i += 1
+            if action.dest in values:
+                earlier.append(values[action.dest])
+            values[action.dest] = (action, type_func, explicit_arg)
+        elif kind == _FAST_LIST:
+            start = i
+            while i < n and args[i][:1] != "-":
+                i += 1
+            if explicit_arg is not None or i == start:
+                return None
+            if action.dest in values:
+                earlier.append(values[action.dest])
+            values[action.dest] = (action, type_func, args[start:i])
+        else:
+            return None
+
+    data = {}
+    try:
+        for action, type_func in table.actions:
+            dest = action.dest
+            value = values.get(dest, _NOT_SEEN)
+            if value is _NOT_SEEN:
+                if dest in layer:
+                    data[dest] = layer[dest]
+                    continue
+                if action.required:
+                    return None
+                value = action.default
+                if value is argparse.SUPPRESS:
+                    # Left out of the namespace, so the dataclass's default applies
+                    continue
+                if value is not None and isinstance(value, str) and type_func is not None:
+                    value = type_func(value)
+            elif type_func is not None:
+                if stats is not None:
+                    start = perf_counter()
+                value = _fast_convert(*value)
+                if value is _NOT_SEEN:
+                    return None
+                if stats is not None:
+                    name = table.cls.__qualname__ + "." + dest
+                    stats.record("convert", name, perf_counter() - start)
+            data[dest] = value
+        for value in earlier:
+            if _fast_convert(*value) is _NOT_SEEN:
+                return None
+    except (ArgumentTypeError, TypeError, ValueError, OverflowError):
+        return None
+
+    return data
+
+
+def _fast_convert(action, type_func, arg_strings):
+    """Convert the values of one occurrence of an option, or return _NOT_SEEN for bad choices."""
+    choices = action.choices
+    if isinstance(action, _ArrayStoreAction):
+        value = action.convert_many(arg_strings)
+        if choices is not None and any(v not in choices for v in value):
+            return _NOT_SEEN
+    elif isinstance(arg_strings, list):
+        value = [type_func(arg_string) for arg_string in arg_strings]
+        if choices is not None and any(v not in choices for v in value):
+            return _NOT_SEEN
+    else:
+        value = type_func(arg_strings)
+        if choices is not None and value not in choices:
+            return _NOT_SEEN
+    return value
+
+
+_NOT_SEEN = object()
+
+
+# When set, parser errors and exits raise ParseError rather than printing and exiting
+_raise_errors = ContextVar("_raise_errors", default=False)
+
+
+_COMMAND_LINE_FORMATS = ("auto", "shell", "json")
+
+# Characters which `shlex.split` treats specially, besides whitespace
+_SHELL_SPECIAL = ("'", '"', "\\", "#")
+
+# The whitespace that shlex splits at; str.split() would also split at Unicode spaces, form feeds...
+_SHELL_WHITESPACE = " \t\r\n"
+_SHELL_WHITESPACE_RE = re.compile("[{}]+".format(_SHELL_WHITESPACE))
+
+
+def _split_command_line(line, format):
+    """Return the arguments on one line of a command stream, or None if it holds no command."""
+    text = line.strip(_SHELL_WHITESPACE)
+    if not text:
+        return None
+
+    if format == "json" or (format == "auto" and text.startswith("[")):
+        import json
+
+        argv = json.loads(text)
+        if not isinstance(argv, list) or not all(isinstance(arg, str) for arg in argv):
+            raise ValueError("a JSON command line must be an array of strings")
+        return argv
+
+    if not any(char in text for char in _SHELL_SPECIAL):
+        return _SHELL_WHITESPACE_RE.split(text)
+
+    import shlex
+
+    return shlex.split(text, comments=True) or None
+
+
+def _result_items(result):
+    """Yield (name, value) pairs for the fields of a parse result."""
+    if type(result) is tuple:
+        for item in result:
+            yield from _result_items(item)
+    elif isinstance(result, tuple):
+        # A record of a parser with compact="tuple"
+        yield from zip(result._fields, result)
+    elif is_dataclass(result):
+        for dc_field in fields(result):
+            yield dc_field.name, getattr(result, dc_field.name)
+    elif isinstance(result, Namespace):
+        yield from vars(result).items()
+
+
+# The values of typed columns in rows which failed to parse
+_ARRAY_MISSING = {"q": 0, "d": float("nan")}
+
+
+class _Columns:
+    """Columns of parse results, filled in one row at a time.
+
+    With `typed_arrays`, a column is an array as long as all of its values in the rows which
+    parsed are ints, or all are floats, and becomes a list otherwise.
+    """
+
+    def __init__(self, typed_arrays):
+        self.typed_arrays = typed_arrays
+        self.columns = {}
+        self.errors = []
+
+    def add(self, result):
+        row = len(self.errors)
+        columns = self.columns
+
+        if isinstance(result, ParseError):
+            self.errors.append(result.message)
+            for column in columns.values():
+                column.append(_ARRAY_MISSING[column.typecode] if type(column) is array else None)
+            return
+
+        self.errors.append(None)
+        for name, value in _result_items(result):
+            column = columns.get(name)
+            if column is None:
+                columns[name] = self._new_column(row, value)
+            elif type(column) is array:
+                self._append_typed(name, column, value)
+            else:
+                column.append(value)
+
+        # Columns of fields which this row does not have, e.g. those of other commands
+        if any(len(column) == row for column in columns.values()):
+            for name, column in columns.items():
+                if len(column) == row:
+                    if type(column) is array:
+                        column = columns[name] = self._to_list(column)
+                    column.append(None)
+
+    def _new_column(self, row, value):
+        typecode = _ARRAY_TYPECODES.get(type(value)) if self.typed_arrays else None
+        # Only earlier rows which failed to parse can be filled in with the missing value
+        if typecode is not None and all(error is not None for error in self.errors[:row]):
+            missing = itertools.repeat(_ARRAY_MISSING[typecode], row)
+            try:
+                return array(typecode, itertools.chain(missing, (value,)))
+            except OverflowError:
+                pass
+        column = [None] * row
+        column.append(value)
+        return column
+
+    def _append_typed(self, name, column, value):
+        if _ARRAY_TYPECODES.get(type(value)) == column.typecode:
+            try:
+                column.append(value)
+                return
+            except OverflowError:
+                pass
+        column = self.columns[name] = self._to_list(column)
+        column.append(value)
+
+    def _to_list(self, column):
+        return [value if error is None else None for value, error in zip(column, self.errors)]
+
+    def result(self, error_column):
+        columns = dict(self.columns)
+        columns[error_column] = self.errors
+        return columns
+
+
+class _ParserMap(dict):
+    """Map of subcommand names to parsers, building lazily registered parsers on first access."""
+
+    def __init__(self):
+        super().__init__()
+        self._lock = threading.Lock()
+
+    def __getitem__(self, name):
+        parser = super().__getitem__(name)
+        if isinstance(parser, functools.partial):
+            with self._lock:
+                # Another thread may have built the parser while we waited
+                parser = super().__getitem__(name)
+                if isinstance(parser, functools.partial):
+                    parser = parser()
+                    super().__setitem__(name, parser)
+        return parser
+
+    def get(self, name, default=None):
+        return self[name] if name in self else default
+
+    def values(self):
+        return [self[name] for name in self]
+
+    def items(self):
+        return [(name, self[name]) for name in self]
+
+
+class _SubParsersAction(argparse._SubParsersAction):
+    """A subparsers action which can defer building a subparser until it is selected."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._name_parser_map = self.choices = _ParserMap()
+
+    def add_lazy_parser(self, name, build, help=None):
+        """Register `name` now, and create its parser with `build(parser)` when it is used."""
+        if name in self._name_parser_map:
+            raise ArgumentError(self, "conflicting subparser: %s" % name)
+
+        # Mirror add_parser, which always adds a pseudo-action for the help listing
+        self._choices_actions.append(self._ChoicesPseudoAction(name, (), help))
+        self._name_parser_map[name] = functools.partial(self._build_lazy_parser, name, build)
+
+    def _build_lazy_parser(self, name, build):
+        parser = self._parser_class(prog="%s %s" % (self._prog_prefix, name))
+        return build(parser)
+
+    def __call__(self, parser, namespace, values, option_string=None):
+        # As argparse does, except that a DataClassParser is asked for a plain namespace, which
+        # the top-level parser turns into the parse result
+        parser_name = values[0]
+        arg_strings = values[1:]
+
+        if self.dest is not argparse.SUPPRESS:
+            setattr(namespace, self.dest, parser_name)
+
+        try:
+            subparser = self._name_parser_map[parser_name]
+        except KeyError:
+            choices = ", ".join(self._name_parser_map)
+            message = "unknown parser %(parser_name)r (choices: %(choices)s)"
+            raise ArgumentError(
+                self, argparse._(message) % {"parser_name": parser_name, "choices": choices}
+            )
+
+        if isinstance(subparser, DataClassParser):
+            subnamespace, arg_strings = subparser._parse_namespace(arg_strings)
+        else:
+            subnamespace, arg_strings = subparser.parse_known_args(arg_strings, None)
+        for key, value in vars(subnamespace).items():
+            setattr(namespace, key, value)
+
+        if arg_strings:
+            vars(namespace).setdefault(argparse._UNRECOGNIZED_ARGS_ATTR, [])
+            getattr(namespace, argparse._UNRECOGNIZED_ARGS_ATTR).extend(arg_strings)
+
+
+# True while parse_sweep is parsing, so that values may hold sweeps
+_sweeping = ContextVar("_sweeping", default=False)
 
 
 class DataClassParser(ArgumentParser):
@@ -181,13 +1339,40 @@ class DataClassParser(ArgumentParser):
             commands.update(_to_name_command_dict(cmds))
         if "version" in kwargs.keys():
             version = kwargs.pop("version")
+        self.lazy_commands = kwargs.pop("lazy_commands", False)
+        self.fast_parse = kwargs.pop("fast_parse", True)
+        self.compact = kwargs.pop("compact", None)
+        if self.compact is not None and self.compact not in _COMPACT_KINDS:
+            kinds = ", ".join(_COMPACT_KINDS)
+            raise ValueError("compact must be one of {}, not {!r}".format(kinds, self.compact))
+        self._fast_table = None
+        config_files = kwargs.pop("config_files", None)
+        self.env_prefix = kwargs.pop("env_prefix", None)
+        self.stats = kwargs.pop("stats", None)
+        self.help_cache = kwargs.pop("help_cache", None)
+        self.command_index = kwargs.pop("command_index", None)
+        self._command_index = None
+        self._pending_help = []
+        entry_points = kwargs.pop("entry_points", None)
+        self._command_names = {}
+        self._env_index = {}
+        self._env_required = []
+        self._env_positionals = []
 
         super().__init__(*args, **kwargs)
 
+        self._config_keys = ()
+        if config_files:
+            from ._config import load_config_files
+
+            self._config_keys = load_config_files(config_files)
+
         self.have_extra_args=False
         if init_dataclass:
             self.add_arguments(init_dataclass)
             self.set_defaults(cls=init_dataclass)
+            self._apply_config(self, init_dataclass, None)
+            self._index_env(self, init_dataclass, self.env_prefix)
 
         if version is not None:
             self.dcp_add_argument("--version", action="version", version=version)
@@ -198,30 +1383,238 @@ class DataClassParser(ArgumentParser):
             for name, command in commands.items():
                 self.add_command(name, command)
             self.have_commands = True
-
-    def add_command(self, name: str, cls, *, help: str = None, func=None):
-        if not is_dataclass(cls):
+        if entry_points is not None:
+            self.add_entry_point_commands(entry_points)
+
+    def add_command(self, name: str, cls, *, help: str = None, func=None, lazy: bool = None):
+        """Add a subcommand whose arguments are defined by the dataclass `cls`.
+
+        If `lazy` is true (default: the parser's `lazy_commands` setting), only the command name
+        and help are registered here; the subparser and its arguments are built the first time
+        the command is selected, and None is returned instead of the subparser.
+
+        `cls` may also be a "package.module:ClassName" string, which is always lazy: the module
+        is only imported when the command is selected or its help is shown.  Without `help`, the
+        first line of the class docstring is listed in the parser's help, looked up in the
+        `command_index` file if the parser has one.
+        """
+        if isinstance(cls, str):
+            lazy = True
+        elif not is_dataclass(cls):
             raise MustBeADataclass("{} must be a dataclass")
 
+        if lazy is None:
+            lazy = self.lazy_commands
+
         if self.subparsers is None:
-            self.subparsers = self.add_subparsers()
+            self.subparsers = self.add_subparsers(action=_SubParsersAction)
 
-        if func:
-            class_name = cls.__name__ + "_"
-            cls = make_dataclass(
-                class_name, fields=[("func", typing.Callable, field(default=func))], bases=(cls,)
+        self.have_commands = True
+        self._command_names[cls] = name
+
+        if lazy:
+            self.subparsers.add_lazy_parser(
+                name, functools.partial(self._setup_command, name, cls, func), help=help
             )
+            if isinstance(cls, str) and help is None:
+                self._pending_help.append((self.subparsers._choices_actions[-1], cls))
+            return None
 
         cmd_parser = self.subparsers.add_parser(name, help=help)
+        return self._setup_command(name, cls, func, cmd_parser)
+
+    def add_entry_point_commands(self, group):
+        """Add a lazy command for each entry point in `group`, named after the entry point.
+
+        The entry points are only loaded when their command is selected.  With a
+        `command_index` file, the entry points found are cached until a package is installed or
+        removed.
+        """
+        index = self._get_command_index()
+        for name, spec in index.entry_points(group):
+            self.add_command(name, spec)
+        index.save()
+
+    def _get_command_index(self):
+        if self._command_index is None:
+            from ._plugins import open_index
+
+            self._command_index = open_index(self.command_index)
+        return self._command_index
+
+    def _resolve_command_help(self):
+        """Fill in the help of "module:ClassName" commands, for the parser's help."""
+        if not self._pending_help:
+            return
+        index = self._get_command_index()
+        for choice_action, spec in self._pending_help:
+            choice_action.help = index.command_help(spec)
+        self._pending_help = []
+        index.save()
+
+    def _setup_command(self, name, cls, func, cmd_parser):
+        cmd_parser.stats = self.stats
+        cmd_parser.help_cache = self.help_cache
+        cmd_parser.command_index = self.command_index
+        cmd_parser.compact = self.compact
+        if isinstance(cls, str):
+            from ._plugins import load
+
+            cls = load(cls)
+        if func:
+            cls = _with_func(cls, func)
+
         self._add_arguments(cls, parser=cmd_parser)
         cmd_parser.set_defaults(cmd_cls=cls)
         if func:
             cmd_parser.set_defaults(func=func)
-
-        self.have_commands = True
+        self._apply_config(cmd_parser, cls, name)
+        if self.env_prefix:
+            self._index_env(cmd_parser, cls, self.env_prefix + name.upper().replace("-", "_") + "_")
+        else:
+            self._index_env(cmd_parser, cls, None)
 
         return cmd_parser
 
+    def _apply_config(self, parser, cls, section):
+        """Use values from the config files as the defaults of the arguments for `cls`.
+
+        Top-level options are read from the top level of each file, and the options of a command
+        from a table (or INI section) named after the command.
+        """
+        if not self._config_keys:
+            return
+
+        from ._config import config_layer
+
+        layer = config_layer(self._config_keys, cls, section)
+        for action in parser._actions:
+            if action.dest not in layer:
+                continue
+
+            action.default = layer[action.dest]
+            action.required = False
+            if not action.option_strings:
+                # Let positional arguments be left out on the command line
+                if action.nargs is None:
+                    action.nargs = "?"
+                elif action.nargs == "+":
+                    action.nargs = "*"
+
+    def _index_env(self, parser, cls, prefix):
+        """Record the environment variables which can set the arguments for `cls` in `parser`.
+
+        A field uses the variable named with `opt(..., env=...)` or `arg(..., env=...)`, or, if
+        the parser has an `env_prefix`, the prefix followed by the upper-cased field name (the
+        dasherized field name, with dashes as underscores).  Commands add their name to the
+        prefix, as in `MYTOOL_FETCH_RETRIES`.
+        """
+        actions = {action.dest: action for action in parser._actions}
+
+        for spec in _get_plan(cls):
+            key = spec.env
+            if key is None and prefix:
+                key = prefix + spec.name.upper().replace(".", "_")
+            action = actions.get(spec.name)
+            if key is None or action is None:
+                continue
+
+            parser._env_index[key] = action
+            if not action.option_strings:
+                parser._env_positionals.append(action)
+                if action.nargs is None:
+                    action.nargs = "?"
+                elif action.nargs == "+":
+                    action.nargs = "*"
+                    if action.default is None:
+                        # Left out positionals must get the default, so they can be detected
+                        action.default = []
+            if action.required:
+                # Checked after parsing, once it is known whether the variable is set
+                action.required = False
+                parser._env_required.append(action)
+
+    def _env_layer(self):
+        """Return {dest: value} for the arguments set by environment variables.
+
+        A variable which cannot be converted is only reported if the command line does not
+        override it, so its value in the layer is an `_EnvError`, checked by `_finish_env`.
+        Appended and counted values add to the variable's value, so those are reported at once.
+        """
+        index = self._env_index
+        if not index:
+            return index
+
+        environ = os.environ
+        if len(index) <= len(environ):
+            found = [(key, environ[key]) for key in index if key in environ]
+        else:
+            found = [(key, value) for key, value in environ.items() if key in index]
+
+        layer = {}
+        for key, value in found:
+            action = index[key]
+            try:
+                layer[action.dest] = self._convert_env(action, value)
+            except (ArgumentError, ValueError) as e:
+                message = "{} (from environment variable {})".format(e, key)
+                if isinstance(action, (argparse._AppendAction, argparse._CountAction)):
+                    self.error(message)
+                layer[action.dest] = _EnvError(message)
+        return layer
+
+    def _convert_env(self, action, value):
+        """Convert an environment variable the same way as a command line value."""
+        if isinstance(action, _FLAG_ACTIONS):
+            return _to_bool(value)
+        if isinstance(action, argparse._CountAction):
+            return int(value)
+        if isinstance(action, argparse._StoreConstAction):
+            return action.const if _to_bool(value) else action.default
+
+        if isinstance(action, argparse._AppendAction) or action.nargs in ("+", "*") or (
+            isinstance(action.nargs, int)
+        ):
+            import shlex
+
+            arg_strings = shlex.split(value)
+            if isinstance(action, argparse._AppendAction) and action.nargs is None:
+                return [self._get_values(action, [arg_string]) for arg_string in arg_strings]
+            return self._get_values(action, arg_strings)
+
+        return self._get_values(action, [value])
+
+    def _with_env(self, namespace, layer):
+        if not layer:
+            return namespace
+        if namespace is None:
+            return Namespace(**layer)
+        for dest, value in layer.items():
+            if not hasattr(namespace, dest):
+                setattr(namespace, dest, value)
+        return namespace
+
+    def _finish_env(self, data, layer):
+        """Fill in positionals from the environment, and check required arguments."""
+        if not self._env_index:
+            return
+
+        for action in self._env_positionals:
+            if action.dest in layer and data.get(action.dest) is action.default:
+                data[action.dest] = layer[action.dest]
+
+        missing = [
+            argparse._get_action_name(action)
+            for action in self._env_required
+            if action.dest not in layer and data.get(action.dest, action.default) is action.default
+        ]
+        if missing:
+            self.error("the following arguments are required: %s" % ", ".join(missing))
+
+        for dest, value in layer.items():
+            if isinstance(value, _EnvError) and data.get(dest) is value:
+                self.error(value.message)
+
     def add_arguments(self, cls):
         if not is_dataclass(cls):
             raise MustBeADataclass("{} must be a dataclass")
@@ -229,177 +1622,432 @@ class DataClassParser(ArgumentParser):
         return self._add_arguments(cls, parser=self)
 
     def parse_known_args(self, args=None, namespace=None):
-        global _parsing_args
-
-        if _parsing_args:
-            return super().parse_known_args(args=args, namespace=namespace)
-
-        _parsing_args = True
+        """Parse arguments into dataclass instances.
+
+        Parsing does not modify the parser, so one parser can be used from many threads at the
+        same time; lazily built subcommand parsers are built under a lock.
+        """
+        env = self._env_layer()
+        stats = self.stats
+        if self.fast_parse and namespace is None:
+            table = self._get_fast_table()
+            if table is not None:
+                if stats is not None:
+                    start = perf_counter()
+                data = _fast_parse(
+                    table, sys.argv[1:] if args is None else list(args), env, stats
+                )
+                if data is not None:
+                    self._finish_env(data, env)
+                    if stats is not None:
+                        name = table.cls.__qualname__
+                        stats.record("fast_parse", name, perf_counter() - start)
+                        build = self._converter(table.cls).build
+                        return _timed(stats, "construct", name, build, data), []
+                    return self._converter(table.cls).build(data), []
+
+        if stats is not None:
+            start = perf_counter()
+        if _sweeping.get():
+            # A parse started while a sweep is parsed, e.g. by a type function, is not a sweep
+            token = _sweeping.set(False)
+            try:
+                args, argv = self._parse_namespace(args, namespace, env)
+            finally:
+                _sweeping.reset(token)
+        else:
+            args, argv = self._parse_namespace(args, namespace, env)
+        if stats is not None:
+            stats.record("argparse", self.prog, perf_counter() - start)
+            return self._construct_with_stats(args, argv)
+
+        return self._construct(args, argv)
+
+    def _parse_namespace(self, args=None, namespace=None, env=None):
+        """Parse `args` with argparse into a namespace, without creating the dataclasses.
+
+        Commands are parsed this way, and the parser of the whole command line creates the
+        parse result from the namespace.
+        """
+        if env is None:
+            env = self._env_layer()
+        args, argv = super().parse_known_args(args=args, namespace=self._with_env(namespace, env))
+        self._finish_env(vars(args), env)
+        return args, argv
+
+    def _construct_with_stats(self, args, argv):
+        start = perf_counter()
         try:
-            args, argv = super().parse_known_args(args=args, namespace=namespace)
+            return self._construct(args, argv)
         finally:
-            _parsing_args = False
+            data = vars(args)
+            cls = data.get("cmd_cls") or data.get("cls")
+            name = cls.__qualname__ if is_dataclass(cls) else self.prog
+            self.stats.record("construct", name, perf_counter() - start)
 
-        cls_is_dataclass = "cls" in args and is_dataclass(args.cls)
-        cmd_is_dataclass = "cmd_cls" in args and is_dataclass(args.cmd_cls)
+    def _construct(self, args, argv):
+        """Create the dataclass instances for a parsed namespace, and return the parse result."""
+
+        data = vars(args)
+        cls = data.get("cls")
+        cmd_cls = data.get("cmd_cls")
+        cls_is_dataclass = cls is not None and is_dataclass(cls)
+        cmd_is_dataclass = cmd_cls is not None and is_dataclass(cmd_cls)
 
         if not cls_is_dataclass and not cmd_is_dataclass:
             if self.have_commands:
                 return (args, None), argv
             return args, argv
 
-        data = {k: v for k, v in vars(args).items()}
+        if cls_is_dataclass and cmd_is_dataclass:
+            return (self._converter(cls).build(data), self._converter(cmd_cls).build(data)), argv
 
-        def get_dataclass_obj(cls, data):
-            cls_fields = [f.name for f in fields(cls)]
-            cls_data = {key: value for key, value in data.items() if key in cls_fields}
-            return cls(**cls_data), cls_fields
+        converter = self._converter(cls if cls_is_dataclass else cmd_cls)
+        obj = converter.build(data)
+        names = converter.names
+        other_data = {key: value for key, value in data.items() if key not in names}
 
-        if cls_is_dataclass and cmd_is_dataclass:
-            cls = data.pop("cls")
-            cmd_cls = data.pop("cmd_cls")
+        if not other_data and not self.have_extra_args:
+            return obj, argv
+
+        if cls_is_dataclass:
+            return (obj, Namespace(**other_data)), argv
+        return (Namespace(**other_data), obj), argv
+
+    def _converter(self, cls):
+        """Return the converter creating the parse results for `cls`, or its compact variant.
+
+        With `DataClassParser(..., compact=kind)`, results are created as the "slots", "frozen"
+        or "tuple" variant of their dataclass, whose instances take less memory; see
+        `dataclass_opt._compact`.
+        """
+        if self.compact is None:
+            return _get_converter(cls)
+        return _get_compact_converter[self.compact](cls)
+
+    def to_argv(self, result, *, skip_defaults=False):
+        """Return the arguments which this parser parses into `result`.
+
+        `result` is anything `parse_args` returns: a dataclass instance, or a (dataclass or
+        Namespace, command dataclass) tuple, in which case the command's name and arguments
+        follow those of the parser.  Serializing the fields of a dataclass is planned once per
+        class.  See `to_argv` for `skip_defaults`.
+        """
+        from ._argv import result_to_argv
+
+        return result_to_argv(self, result, skip_defaults)
+
+    def run(self, args=None, *, concurrency=None):
+        """Parse `args`, call the `func` of the selected command, and return its result.
+
+        `func` is called with the command dataclass, preceded by the top-level dataclass if the
+        parser has one.  If it is an `async def` function (or returns an awaitable), it is run on
+        a new event loop; see `arun` for `concurrency`.  If the run is interrupted, the tasks
+        still running are cancelled and awaited before `KeyboardInterrupt` propagates.
+        """
+        import inspect
+
+        func, call_args = _command_call(self.parse_args(args))
+        if func is None:
+            self.error("a command is required")
+
+        if inspect.iscoroutinefunction(func):
+            call = functools.partial(func, *call_args)
+        else:
+            result = func(*call_args)
+            if not inspect.isawaitable(result):
+                return result
+            call = functools.partial(_identity, result)
 
-            cls_obj, _ = get_dataclass_obj(cls, data)
-            cmd_obj, _ = get_dataclass_obj(cmd_cls, data)
+        from ._aio import run
 
-            return (cls_obj, cmd_obj), argv
+        return run(call, concurrency)
 
-        if cls_is_dataclass:  # and not cmd_is_dataclass
-            cls = data.pop("cls")
-            cls_obj, cls_fields = get_dataclass_obj(cls, data)
-            other_data = {key: value for key, value in data.items() if key not in cls_fields}
+    async def arun(self, args=None, *, concurrency=None):
+        """Parse `args`, and call and await the `func` of the selected command on this loop.
 
-            if not other_data and not self.have_extra_args:
-                return cls_obj, argv
+        With `concurrency`, at most that many blocks guarded by `concurrency_limit()`, or calls
+        made by `amap`, run at once within the command.  Cancelling `arun` cancels the command,
+        and `amap` cancels and awaits the calls it has started.
+        """
+        func, call_args = _command_call(self.parse_args(args))
+        if func is None:
+            self.error("a command is required")
 
-            return (cls_obj, Namespace(**other_data)), argv
+        from ._aio import dispatch
 
-        # cmd_is_dataclass
-        cmd_cls = data.pop("cmd_cls")
-        cmd_obj, cmd_cls_fields = get_dataclass_obj(cmd_cls, data)
-        other_data = {key: value for key, value in data.items() if key not in cmd_cls_fields}
+        return await dispatch(functools.partial(func, *call_args), concurrency)
 
-        if not other_data and not self.have_extra_args:
-            return cmd_obj, argv
+    def parse_sweep(self, args=None):
+        """Parse arguments whose values may be sweeps, and return a generator of parse results.
 
-        return (Namespace(**other_data), cmd_obj), argv
+        A single value may be replaced by comma-separated values (`--lr 0.1,0.01,0.001`), or, for
+        int and float arguments, by an inclusive range `start:stop[:step]`, whose step is added,
+        or with an `x` multiplied (`--batch 32:256:x2`).  One result is generated for every
+        combination of the values, as `parse_args` would return it.  The arguments are parsed,
+        and errors reported, before this returns; the results are only created as the generator
+        is advanced, so that sweeps of any size use constant memory.
+        """
+        from ._sweep import iter_points
 
-    def _add_arguments(self, cls, parser=None):
-        """Create an argument parser from a dataclass."""
-        if parser is None:
-            parser = DataClassParser()
+        token = _sweeping.set(True)
+        try:
+            namespace, argv = self._parse_namespace(args)
+        finally:
+            _sweeping.reset(token)
+        if argv:
+            self.error("unrecognized arguments: %s" % " ".join(argv))
+        return iter_points(self, vars(namespace))
 
-        for dc_field in fields(cls):
-            metadata = dc_field.metadata
-            if metadata.get("suppress"):
-                continue
+    def run_sweep(self, args=None, *, max_workers=None, window=None, executor=None):
+        """Run the command `func` for every point of a sweep in a process pool.
 
-            names = list(_get_names(dc_field))
-            is_arg = _is_arg(dc_field)
+        `args` is parsed as with `parse_sweep`, and the `func` given to `add_command` is called
+        with each command dataclass (preceded by the top-level dataclass, if the parser has one)
+        in a `concurrent.futures.ProcessPoolExecutor` of `max_workers` processes, or in
+        `executor`, if given.  At most `window` (default: twice the number of workers) calls are
+        submitted at a time, so that the points are generated only as the pool catches up.
 
-            # type
-            default_arg_type, is_optional, is_list = _get_type(dc_field.type)
-            arg_type = metadata.get("type", default_arg_type)
+        Yields (parse result, return value) pairs as the calls complete.  An exception raised by
+        `func` is raised here, after cancelling the calls which have not yet started.
+        """
+        from ._sweep import run_points
 
-            # action
-            default_action = _get_action(is_arg, arg_type)
-            action = metadata.get("action", default_action)
+        return run_points(self.parse_sweep(args), max_workers, window, executor)
 
-            if action == "append_const":
-                raise UnsupportedException("append_const is not yet supported")
+    def parse_batch(
+        self, argvs, *, columnar=True, chunk_size=None, typed_arrays=False, error_column="error"
+    ):
+        """Parse many argument lists with this parser.
+
+        With `columnar=True`, the result is a dict mapping each field (or namespace attribute) name
+        to a list of values, one per argument list, plus an `error_column` holding None or the
+        error message.  With `typed_arrays=True`, columns whose values are all ints or all floats
+        are returned as `array.array`s, with 0 or NaN in rows which failed to parse.
+
+        With `columnar=False`, the result is a list of parse results, with a `ParseError` in place
+        of each argument list which failed to parse.  Errors never raise `SystemExit`.
+
+        If `chunk_size` is given, an iterator over results for successive chunks of at most
+        `chunk_size` argument lists is returned instead, so that memory use stays bounded.
+        """
+        if chunk_size is None:
+            return self._parse_chunk(argvs, columnar, typed_arrays, error_column)
+
+        return self._parse_chunks(argvs, chunk_size, columnar, typed_arrays, error_column)
+
+    def iter_parse(self, stream, *, format="auto", encoding="utf-8"):
+        """Parse the command line on each line of `stream`, yielding the results one at a time.
+
+        `stream` may be any iterable of lines, such as a text or binary file, `sys.stdin` or a
+        pipe; bytes are decoded with `encoding`.  Lines are split as by a shell (`format="shell"`)
+        or read as JSON arrays of strings (`format="json"`); with "auto", lines starting with
+        "[" are JSON.  Blank lines, and lines holding only a comment, are skipped.
+
+        A `ParseError`, with the line number as its `line`, is yielded in place of each line
+        which cannot be split or parsed; errors never raise `SystemExit`.  Lines are only read as
+        results are taken, so memory use does not grow with the length of the stream.
+        """
+        if format not in _COMMAND_LINE_FORMATS:
+            formats = ", ".join(_COMMAND_LINE_FORMATS)
+            raise ValueError("format must be one of {}, not {!r}".format(formats, format))
+
+        for number, line in enumerate(stream, 1):
+            try:
+                if isinstance(line, bytes):
+                    line = line.decode(encoding)
+                argv = _split_command_line(line, format)
+            except ValueError as e:
+                # Invalid UTF-8, an unclosed quote or invalid JSON
+                yield ParseError(str(e), line=number)
+                continue
+            if argv is None:
+                continue
 
-            # const
-            const = metadata.get("const")
+            # Set around each line only, since the caller runs between the results
+            token = _raise_errors.set(True)
+            try:
+                result = self.parse_args(argv)
+            except ParseError as e:
+                e.argv = argv
+                e.line = number
+                result = e
+            finally:
+                _raise_errors.reset(token)
+            yield result
+
+    def _parse_chunks(self, argvs, chunk_size, columnar, typed_arrays, error_column):
+        argvs = iter(argvs)
+        while True:
+            chunk = list(itertools.islice(argvs, chunk_size))
+            if not chunk:
+                return
+            yield self._parse_chunk(chunk, columnar, typed_arrays, error_column)
+
+    def _parse_chunk(self, argvs, columnar, typed_arrays, error_column):
+        # Columns are filled in as each row is parsed, without keeping the parse results
+        results = _Columns(typed_arrays) if columnar else []
+        add = results.add if columnar else results.append
+        token = _raise_errors.set(True)
+        try:
+            for argv in argvs:
+                try:
+                    add(self.parse_args(argv))
+                except ParseError as e:
+                    e.argv = argv
+                    add(e)
+        finally:
+            _raise_errors.reset(token)
+
+        if columnar:
+            return results.result(error_column)
+        return results
+
+    def error(self, message):
+        if _raise_errors.get():
+            raise ParseError(message)
+        super().error(message)
+
+    def exit(self, status=0, message=None):
+        if _raise_errors.get():
+            raise ParseError(message or "exited with status {}".format(status), status)
+        super().exit(status, message)
+
+    def _print_message(self, message, file=None):
+        if not _raise_errors.get():
+            super()._print_message(message, file)
+
+    def _get_fast_table(self):
+        table = self._fast_table
+        if table is None or table.key != _fast_table_key(self):
+            # An empty table records that this parser needs argparse until its arguments change
+            table = _compile_fast_table(self) or _FastTable(_fast_table_key(self), None, None, None)
+            self._fast_table = table
+        return table if table.cls is not None else None
 
-            # default value
-            if dc_field.default == MISSING and dc_field.default_factory == MISSING:
-                default = None
-            elif dc_field.default != MISSING:
-                default = dc_field.default
-            else:
-                default = dc_field.default_factory()
+    def _add_arguments(self, cls, parser=None):
+        """Create an argument parser from a dataclass."""
+        if parser is None:
+            parser = DataClassParser()
 
-            use_default = arg_type != bool and action not in [
-                "store_true",
-                "store_false",
-            ]
-            pass_null_default = is_optional
-
-            # nargs
-            if is_list and action is None:
-                # Assume at least one argument; user can override with
-                # arg(..., nargs=...) or opt(..., nargs=...)
-                default_nargs = "+"
-            elif is_arg and default:
-                # argument with a default value
-                default_nargs = "?"
-            elif is_arg and default is None and is_optional:
-                # explicitly marked as optional (default value will be None)
-                default_nargs = "?"
+        stats = self.stats
+        if stats is None:
+            plan = _get_plan(cls)
+        else:
+            token = _build_stats.set(stats)
+            try:
+                plan = _timed(stats, "plan", cls.__qualname__, _get_plan, cls)
+            finally:
+                _build_stats.reset(token)
+
+        for spec in plan:
+            kwargs = spec.kwargs
+            if stats is None:
+                if spec.default_factory is not None:
+                    kwargs = dict(kwargs, default=spec.default_factory())
+                action = parser.dcp_add_argument(*spec.names, **kwargs)
             else:
-                default_nargs = None
-
-            nargs = metadata.get("nargs", default_nargs)
-
-            # choices
-            choices = metadata.get("choices")
-            metavar = metadata.get("metavar")
-            version = metadata.get("version")
-            help = metadata.get("help")
-
-            # required
-            required = (
-                dc_field.default == MISSING
-                and dc_field.default_factory == MISSING
-                and not is_optional
-                and default_arg_type != bool
-            )
+                field_name = cls.__qualname__ + "." + spec.name
+                if spec.default_factory is not None:
+                    default = _timed(stats, "default_factory", field_name, spec.default_factory)
+                    kwargs = dict(kwargs, default=default)
+                action = _timed(
+                    stats,
+                    "add_argument",
+                    field_name,
+                    parser.dcp_add_argument,
+                    *spec.names,
+                    **kwargs,
+                )
+            if spec.file_view:
+                action.file_view = True
 
-            # all arguments
-            kwargs = {}
+        return parser
 
-            if action is not None:
-                kwargs["action"] = action
+    def _read_args_from_files(self, arg_strings):
+        if type(self).convert_arg_line_to_args is not ArgumentParser.convert_arg_line_to_args:
+            # Files must be read line by line to honour the override
+            return super()._read_args_from_files(arg_strings)
 
-            if nargs is not None:
-                kwargs["nargs"] = nargs
+        from ._fromfile import read_args_from_files
 
-            if const is not None:
-                kwargs["const"] = const
+        return read_args_from_files(self, arg_strings)
 
-            if (default is not None and use_default) or (default is None and pass_null_default):
-                kwargs["default"] = default
+    def _get_values(self, action, arg_strings):
+        if self.stats is not None:
+            owner = self._defaults.get("cmd_cls") or self._defaults.get("cls")
+            name = owner.__qualname__ + "." + action.dest if is_dataclass(owner) else action.dest
+            return _timed(self.stats, "convert", name, self._convert_values, action, arg_strings)
+        return self._convert_values(action, arg_strings)
 
-            if arg_type is not None and action not in [
-                "store_const",
-                "append_const",
-                "store_true",
-                "store_false",
-                "count",
-            ]:
-                kwargs["type"] = arg_type
+    def _convert_values(self, action, arg_strings):
+        if isinstance(action, _ArrayStoreAction):
+            return self._get_array_values(action, arg_strings)
 
-            if choices is not None:
-                kwargs["choices"] = choices
+        if (
+            _sweeping.get()
+            and len(arg_strings) == 1
+            and isinstance(action, argparse._StoreAction)
+            and action.nargs in (None, argparse.OPTIONAL)
+        ):
+            from ._sweep import sweep_values
 
-            if metavar is not None:
-                kwargs["metavar"] = metavar
+            sweep = sweep_values(self, action, arg_strings[0])
+            if sweep is not None:
+                return sweep
 
-            if version is not None:
-                kwargs["version"] = version
+        # @file tokens only exist once _read_args_from_files has imported _fromfile
+        fromfile = sys.modules.get(__name__ + "._fromfile")
+        if fromfile is not None and any(
+            isinstance(arg_string, fromfile.FileArgs) for arg_string in arg_strings
+        ):
+            return fromfile.get_values(self, action, arg_strings)
 
-            if help is not None:
-                kwargs["help"] = help
+        return super()._get_values(action, arg_strings)
 
-            if not is_arg and required is not None:
-                kwargs["required"] = required
+    def _get_array_values(self, action, arg_strings):
+        """Convert the strings for an array field in one pass, as `_get_values` would."""
+        if "--" in arg_strings:
+            arg_strings.remove("--")
 
-            if not is_arg:
-                kwargs["dest"] = dc_field.name
+        fromfile = sys.modules.get(__name__ + "._fromfile")
 
-            parser.dcp_add_argument(*names, **kwargs)
+        def tokens():
+            return iter(arg_strings) if fromfile is None else fromfile.iter_tokens(arg_strings)
 
-        return parser
+        try:
+            values = action.convert_many(tokens())
+        except (ValueError, OverflowError):
+            # Find the bad value, and report it the way argparse would
+            for arg_string in tokens():
+                try:
+                    action.convert_many([arg_string])
+                except (ValueError, OverflowError):
+                    self._get_value(action, arg_string)
+                    raise ArgumentError(action, "value out of range: %r" % arg_string)
+            raise
+
+        if action.choices is not None:
+            for value in values:
+                self._check_value(action, value)
+        return values
+
+    def format_help(self):
+        self._resolve_command_help()
+        if self.help_cache is None:
+            return super().format_help()
+
+        from ._help import cached_text
+
+        return cached_text(self, "help", super().format_help)
+
+    def format_usage(self):
+        if self.help_cache is None:
+            return super().format_usage()
+
+        from ._help import cached_text
+
+        return cached_text(self, "usage", super().format_usage)
 
     def dcp_add_argument(self, *args, **kwargs):
         return super().add_argument(*args, **kwargs)
@@ -0,0 +1,107 @@
+"""Command line tools for dataclass_opt.
+
+    python -m dataclass_opt generate package.module:parser [-o parser_module.py]
+    python -m dataclass_opt completion package.module:parser --shell bash [-o script] [--prog name]
+    python -m dataclass_opt serve package.module:parser --socket PATH
+"""
+
+import importlib
+import sys
+from dataclasses import dataclass, is_dataclass
+from typing import Optional
+
+from . import DataClassParser, arg, opt
+
+
+@dataclass
+class Generate:
+    target: str = arg(
+        help="a DataClassParser, dataclass, or function returning a parser, as module:attribute"
+    )
+    output: Optional[str] = opt(help="file to write the module to (default: stdout)")
+
+
+@dataclass
+class Completion:
+    target: str = arg(
+        help="a DataClassParser, dataclass, or function returning a parser, as module:attribute"
+    )
+    shell: str = opt(default="bash", choices=["bash", "zsh", "fish"], help="shell to complete in")
+    output: Optional[str] = opt(
+        default=None, help="file to write the script to, if it changed (default: stdout)"
+    )
+    prog: Optional[str] = opt(default=None, help="command to complete (default: the parser's prog)")
+
+
+@dataclass
+class Serve:
+    target: str = arg(
+        help="a DataClassParser, dataclass, or function returning a parser, as module:attribute"
+    )
+    socket: str = opt(help="Unix domain socket to listen on")
+
+
+def load_parser(target):
+    """Import `module:attribute` and return it as a DataClassParser."""
+    module_name, _, attr = target.partition(":")
+    obj = importlib.import_module(module_name)
+    for part in attr.split(".") if attr else ():
+        obj = getattr(obj, part)
+
+    if is_dataclass(obj) and isinstance(obj, type):
+        return DataClassParser(obj)
+    if isinstance(obj, DataClassParser):
+        return obj
+    if callable(obj):
+        return obj()
+    return obj
+
+
+def generate(args):
+    from .codegen import generate_parser_module
+
+    source = generate_parser_module(load_parser(args.target), source=args.target)
+    if args.output is None:
+        sys.stdout.write(source)
+    else:
+        with open(args.output, "w") as f:
+            f.write(source)
+
+
+def completion(args):
+    from .completion import generate_completion, write_completion
+
+    parser = load_parser(args.target)
+    if args.output is None:
+        sys.stdout.write(generate_completion(parser, args.shell, args.prog))
+    else:
+        write_completion(parser, args.shell, args.output, args.prog)
+
+
+def serve(args):
+    from .server import serve
+
+    serve(args.target, args.socket)
+
+
+def build_parser():
+    parser = DataClassParser(prog="python -m dataclass_opt")
+    parser.add_command("generate", Generate, help="generate a standalone parser module")
+    parser.add_command("completion", Completion, help="generate a shell completion script")
+    parser.add_command("serve", Serve, help="run commands for clients of a Unix domain socket")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+
+    if isinstance(args, Generate):
+        generate(args)
+    elif isinstance(args, Completion):
+        completion(args)
+    elif isinstance(args, Serve):
+        serve(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""Running `async def` commands on an event loop, with a limit on their concurrency.
+
+This module is only imported when an async command is run, so that importing `dataclass_opt`
+does not import `asyncio`.
+"""
+
+import asyncio
+import inspect
+from collections import deque
+from contextvars import ContextVar
+
+# (concurrency, semaphore) of the running command, or None if it has no limit
+_limit = ContextVar("_limit", default=None)
+
+
+class _NoLimit:
+    async def __aenter__(self):
+        return None
+
+    async def __aexit__(self, *exc_info):
+        return None
+
+
+_NO_LIMIT = _NoLimit()
+
+
+def run(call, concurrency):
+    """Run `call()`, and the awaitable it returns, on a new event loop.
+
+    `asyncio.run` cancels the tasks still running when the command returns or is interrupted,
+    and waits for them to finish, before closing the loop.
+    """
+    return asyncio.run(dispatch(call, concurrency))
+
+
+async def dispatch(call, concurrency):
+    """Call `call()` with the concurrency limit set, and await its result if needed."""
+    limit = None
+    if concurrency is not None:
+        if concurrency < 1:
+            raise ValueError("concurrency must be at least 1, not {!r}".format(concurrency))
+        limit = (concurrency, asyncio.Semaphore(concurrency))
+
+    token = _limit.set(limit)
+    try:
+        result = call()
+        if inspect.isawaitable(result):
+            result = await result
+        return result
+    finally:
+        _limit.reset(token)
+
+
+def concurrency_limit():
+    """Return an async context manager holding one of the running command's concurrency slots.
+
+    Use `async with concurrency_limit(): ...` around each request of a command which fans out;
+    at most `concurrency` (given to `run` or `arun`) blocks run at once.  Without a limit, the
+    context manager does nothing.
+    """
+    limit = _limit.get()
+    return _NO_LIMIT if limit is None else limit[1]
+
+
+async def amap(func, iterable, concurrency=None):
+    """Yield `await func(item)` for each item of a (sync or async) iterable, in order.
+
+    At most `concurrency` (default: the limit given to `run` or `arun`, else 1) calls run at
+    once, and items are only taken from `iterable` as calls finish, so that it may be unbounded.
+    If a call raises, or the caller stops iterating or is cancelled, the calls still running are
+    cancelled and awaited.
+    """
+    if concurrency is None:
+        limit = _limit.get()
+        concurrency = 1 if limit is None else limit[0]
+
+    pending = deque()
+    try:
+        if hasattr(iterable, "__aiter__"):
+            async for item in iterable:
+                pending.append(asyncio.ensure_future(func(item)))
+                if len(pending) >= concurrency:
+                    yield await pending.popleft()
+        else:
+            for item in iterable:
+                pending.append(asyncio.ensure_future(func(item)))
+                if len(pending) >= concurrency:
+                    yield await pending.popleft()
+
+        while pending:
+            yield await pending.popleft()
+    finally:
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
@@ -0,0 +1,359 @@
+"""Command lines from dataclass instances, the inverse of parsing.
+
+The fields of a dataclass are looked at once, and compiled into a plan holding one small function
+per argument, so that turning an instance back into arguments costs one call per field.  This
+module is only imported when `to_argv` is first called.
+"""
+
+import argparse
+import re
+from collections import namedtuple
+from dataclasses import is_dataclass
+from enum import Enum
+from operator import attrgetter
+
+from . import MustBeADataclass, UnsupportedException, _LRUCache, _get_plan, _source_class
+
+# How argparse tells negative numbers from options
+_NEGATIVE_NUMBER = re.compile(r"^-\d+$|^-\d*\.\d+$")
+
+_Step = namedtuple(
+    "_Step", ["dest", "get", "option", "emit", "default", "const", "nargs", "omissible"]
+)
+_Step.__doc__ = """How to write one argument.
+
+`emit(step, value, context, argv)` appends the arguments for `value` to `argv`; `option` is None
+for positionals.  A positional which is `omissible` may be left out when its value is `default`.
+"""
+
+_Plan = namedtuple("_Plan", ["options", "positionals", "negative_options"])
+
+# `special` holds the characters which make a token an option or an @file
+_Context = namedtuple(
+    "_Context", ["prefix_chars", "fromfile_prefix_chars", "special", "negative_options"]
+)
+
+
+def to_argv(obj, prefix_chars="-", fromfile_prefix_chars=None, skip_defaults=False):
+    # Compact variants are written with the plan of their dataclass
+    cls = _source_class(type(obj))
+    if not is_dataclass(cls) or isinstance(obj, type):
+        raise MustBeADataclass("{!r} must be a dataclass instance".format(obj))
+    plan = _get_argv_plan(cls)
+    return _write(plan, obj, prefix_chars, fromfile_prefix_chars, skip_defaults)
+
+
+def result_to_argv(parser, result, skip_defaults=False):
+    """Return the arguments which `parser` parses into `result`, including the command name."""
+    cls = parser._defaults.get("cls")
+    if type(result) is tuple:
+        top, command = result
+    elif cls is not None and issubclass(_source_class(type(result)), cls):
+        top, command = result, None
+    else:
+        top, command = None, result
+
+    prefix_chars = parser.prefix_chars
+    fromfile_prefix_chars = parser.fromfile_prefix_chars
+    argv = []
+    if isinstance(top, argparse.Namespace):
+        plan = _compile_action_plan(parser._actions)
+        argv += _write(plan, top, prefix_chars, fromfile_prefix_chars, skip_defaults)
+    elif top is not None:
+        argv += to_argv(top, prefix_chars, fromfile_prefix_chars, skip_defaults)
+
+    if command is not None:
+        argv.append(_command_name_of(parser, type(command)))
+        argv += to_argv(command, prefix_chars, fromfile_prefix_chars, skip_defaults)
+    return argv
+
+
+def _command_name_of(parser, cmd_cls):
+    names = parser._command_names
+    # Commands with a `func` are derived from the dataclass given to add_command
+    for klass in _source_class(cmd_cls).__mro__:
+        name = names.get(klass)
+        if name is None:
+            name = names.get("{}:{}".format(klass.__module__, klass.__qualname__))
+        if name is not None:
+            return name
+    raise ValueError("{} is not a command of this parser".format(cmd_cls.__qualname__))
+
+
+def _write(plan, obj, prefix_chars, fromfile_prefix_chars, skip_defaults):
+    fromfile_prefix_chars = fromfile_prefix_chars or ""
+    context = _Context(
+        prefix_chars,
+        fromfile_prefix_chars,
+        prefix_chars + fromfile_prefix_chars,
+        plan.negative_options,
+    )
+
+    argv = []
+    for step in plan.options:
+        value = step.get(obj)
+        if skip_defaults and _equal(value, step.default):
+            continue
+        step.emit(step, value, context, argv)
+
+    values = [step.get(obj) for step in plan.positionals]
+    count = len(values)
+    # Trailing optional positionals may be left out, but not ones followed by others
+    while count and plan.positionals[count - 1].omissible:
+        step = plan.positionals[count - 1]
+        if not _equal(values[count - 1], step.default):
+            break
+        count -= 1
+
+    tokens = []
+    for step, value in zip(plan.positionals[:count], values):
+        step.emit(step, value, context, tokens)
+    for index, token in enumerate(tokens):
+        if not _is_value(token, context):
+            # Everything after "--" is a positional, but @files are still read
+            for token in tokens[index:]:
+                if token and token[0] in fromfile_prefix_chars:
+                    raise ValueError("{!r} would be read as an @file".format(token))
+            argv.append("--")
+            break
+    argv += tokens
+    return argv
+
+
+def _equal(value, default):
+    if value is default:
+        return True
+    try:
+        return bool(value == default)
+    except (TypeError, ValueError):
+        # e.g., NumPy arrays compare element-wise
+        return False
+
+
+def _error(step, token, reason):
+    return "{!r} for {} {}".format(token, step.option or step.dest, reason)
+
+
+def _is_value(token, context):
+    """Whether argparse reads `token`, on its own, as a value rather than an option or @file."""
+    if not token or token[0] not in context.special:
+        return True
+    if token[0] in context.fromfile_prefix_chars:
+        return False
+    return not context.negative_options and _NEGATIVE_NUMBER.match(token) is not None
+
+
+def _to_string(value):
+    if isinstance(value, Enum):
+        value = value.value
+    return str(value)
+
+
+def _add_values(step, items, context, argv):
+    for item in items:
+        token = item if type(item) is str else _to_string(item)
+        if step.option is not None and not _is_value(token, context):
+            raise ValueError(_error(step, token, "cannot follow an option"))
+        argv.append(token)
+
+
+# Emitters, one per kind of argument
+
+
+def _emit_single(step, value, context, argv):
+    if value is None:
+        if step.option is not None and step.default is None:
+            return
+        raise ValueError("None for {} cannot be given as an argument".format(step.dest))
+    token = value if type(value) is str else _to_string(value)
+    option = step.option
+    if option is None:
+        argv.append(token)
+    elif not token or token[0] not in context.special or _is_value(token, context):
+        argv += (option, token)
+    elif len(option) == 2:
+        # Attached, so that it is not taken for an option or an @file
+        argv.append(option + token)
+    else:
+        argv.append(option + "=" + token)
+
+
+def _emit_optional(step, value, context, argv):
+    if value is None and step.default is None:
+        return
+    if step.option is not None and step.const is not None and _equal(value, step.const):
+        argv.append(step.option)
+    else:
+        _emit_single(step, value, context, argv)
+
+
+def _emit_many(step, value, context, argv):
+    if value is None and step.default is None:
+        return
+    if step.nargs == argparse.ONE_OR_MORE and not len(value):
+        if _equal(value, step.default):
+            return
+        raise ValueError("{} needs at least one value".format(step.option or step.dest))
+    if step.option is not None:
+        argv.append(step.option)
+    _add_values(step, value, context, argv)
+
+
+def _emit_true(step, value, context, argv):
+    if value:
+        argv.append(step.option)
+
+
+def _emit_false(step, value, context, argv):
+    if not value:
+        argv.append(step.option)
+
+
+def _emit_const(step, value, context, argv):
+    if _equal(value, step.const):
+        argv.append(step.option)
+    elif not _equal(value, step.default):
+        raise ValueError(
+            "{!r} for {} is neither its const nor its default".format(value, step.dest)
+        )
+
+
+def _emit_count(step, value, context, argv):
+    times = (value or 0) - (step.default or 0)
+    if times < 0:
+        raise ValueError("{!r} for {} is below its default".format(value, step.dest))
+    argv += [step.option] * times
+
+
+def _emit_append(step, value, context, argv):
+    # argparse appends to a copy of the default
+    default = list(step.default or ())
+    items = list(value or ())
+    if items[: len(default)] != default:
+        raise ValueError("{!r} for {} does not start with its default".format(value, step.dest))
+
+    for item in items[len(default) :]:
+        if step.nargs in (None, argparse.OPTIONAL):
+            _emit_single(step, item, context, argv)
+        else:
+            # A list of values for each option
+            argv.append(step.option)
+            _add_values(step, item, context, argv)
+
+
+def _emit_extend(step, value, context, argv):
+    default = list(step.default or ())
+    items = list(value or ())
+    if items[: len(default)] != default:
+        raise ValueError("{!r} for {} does not start with its default".format(value, step.dest))
+    if len(items) > len(default):
+        argv.append(step.option)
+        _add_values(step, items[len(default) :], context, argv)
+
+
+def _emitter(action, nargs):
+    """Return the emitter for an argument, or None if it is not a value to write."""
+    if action in ("store_true", argparse._StoreTrueAction):
+        return _emit_true
+    if action in ("store_false", argparse._StoreFalseAction):
+        return _emit_false
+    if action in ("store_const", argparse._StoreConstAction):
+        return _emit_const
+    if action in ("count", argparse._CountAction):
+        return _emit_count
+    if action in ("append", argparse._AppendAction):
+        return _emit_append
+    if action in ("extend", getattr(argparse, "_ExtendAction", None)) and nargs not in (
+        None,
+        argparse.OPTIONAL,
+    ):
+        return _emit_extend
+    if action in ("help", "version", argparse._HelpAction, argparse._VersionAction):
+        return None
+    if action in (None, "store") or (
+        isinstance(action, type) and issubclass(action, argparse._StoreAction)
+    ):
+        if nargs is None:
+            return _emit_single
+        if nargs == argparse.OPTIONAL:
+            return _emit_optional
+        if nargs in (argparse.ONE_OR_MORE, argparse.ZERO_OR_MORE) or isinstance(nargs, int):
+            return _emit_many
+    raise UnsupportedException(
+        "action={!r} with nargs={!r} cannot be written as arguments".format(action, nargs)
+    )
+
+
+def _option_name(names):
+    """Return the first long option in `names`, or the first name if there is none."""
+    for name in names:
+        if len(name) > 2 and name[1] == name[0]:
+            return name
+    return names[0]
+
+
+def _compile(arguments):
+    """Compile (dest, option strings, action, nargs, const, default) tuples into a plan."""
+    options = []
+    positionals = []
+    negative_options = False
+    for dest, option_strings, action, nargs, const, default in arguments:
+        emit = _emitter(action, nargs)
+        if emit is None:
+            continue
+        if option_strings:
+            negative_options = negative_options or any(
+                _NEGATIVE_NUMBER.match(name) for name in option_strings
+            )
+            option = _option_name(option_strings)
+            options.append(
+                _Step(dest, attrgetter(dest), option, emit, default, const, nargs, False)
+            )
+        else:
+            omissible = nargs in (argparse.OPTIONAL, argparse.ZERO_OR_MORE)
+            positionals.append(
+                _Step(dest, attrgetter(dest), None, emit, default, const, nargs, omissible)
+            )
+    return _Plan(tuple(options), tuple(positionals), negative_options)
+
+
+def _compile_argv_plan(cls):
+    """Compute how to write the fields of a dataclass as arguments."""
+    arguments = []
+    for spec in _get_plan(cls):
+        kwargs = spec.kwargs
+        option_strings = spec.names if "dest" in kwargs else ()
+        default = kwargs.get("default")
+        arguments.append(
+            (
+                spec.name,
+                option_strings,
+                kwargs.get("action"),
+                kwargs.get("nargs"),
+                kwargs.get("const"),
+                default,
+            )
+        )
+    return _compile(arguments)
+
+
+def _compile_action_plan(actions):
+    """Compute how to write the arguments added to a parser with `add_argument`."""
+    arguments = []
+    for action in actions:
+        if isinstance(action, argparse._SubParsersAction) or action.dest in ("cls", "cmd_cls"):
+            continue
+        arguments.append(
+            (
+                action.dest,
+                action.option_strings,
+                type(action),
+                action.nargs,
+                action.const,
+                action.default,
+            )
+        )
+    return _compile(arguments)
+
+
+_get_argv_plan = _LRUCache(_compile_argv_plan)
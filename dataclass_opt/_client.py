@@ -0,0 +1,92 @@
+"""A minimal client for `dataclass_opt.server`.
+
+    python -I path/to/dataclass_opt/_client.py SOCKET [ARGS...]
+
+The client imports nothing but a few standard library modules, so that it starts about as fast as
+the interpreter itself; run it by path, as above, rather than with -m, which would import
+dataclass_opt.  It passes its arguments, working directory and environment, and its standard
+input, output and error themselves, to the server listening on SOCKET.  The command's output goes
+straight to the client's terminal or pipes, and the client exits with the command's status.
+"""
+
+import json
+import os
+import socket
+import struct
+import sys
+from array import array
+
+# The length of the JSON request, and the exit status sent back
+_LENGTH = struct.Struct("!I")
+_STATUS = struct.Struct("!i")
+
+# The client's stdin, stdout and stderr
+_STDIO = (0, 1, 2)
+
+
+def send_request(sock, argv, cwd, env, fds):
+    """Send the request, with the file descriptors `fds` attached."""
+    data = json.dumps({"argv": argv, "cwd": cwd, "env": env}).encode("ascii")
+    message = _LENGTH.pack(len(data)) + data
+    sent = sock.sendmsg([message], [(socket.SOL_SOCKET, socket.SCM_RIGHTS, array("i", fds))])
+    if sent < len(message):
+        sock.sendall(message[sent:])
+
+
+def receive_request(sock):
+    """Return (request dict, file descriptors) sent with `send_request`."""
+    fds = array("i")
+    data, ancdata, _, _ = sock.recvmsg(1 << 16, socket.CMSG_SPACE(len(_STDIO) * fds.itemsize))
+    for level, kind, cmsg_data in ancdata:
+        if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+            fds.frombytes(cmsg_data[: len(cmsg_data) - len(cmsg_data) % fds.itemsize])
+
+    data += _receive_exactly(sock, _LENGTH.size - len(data))
+    (length,) = _LENGTH.unpack_from(data)
+    data += _receive_exactly(sock, _LENGTH.size + length - len(data))
+    return json.loads(data[_LENGTH.size :].decode("ascii")), list(fds)
+
+
+def send_status(sock, status):
+    sock.sendall(_STATUS.pack(status))
+
+
+def _receive_exactly(sock, size):
+    chunks = []
+    while size > 0:
+        chunk = sock.recv(size)
+        if not chunk:
+            raise EOFError("the connection was closed")
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+
+def run_client(path, argv):
+    """Run `argv` on the server listening at `path`, and return the exit status."""
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+        send_request(sock, argv, os.getcwd(), dict(os.environ), _STDIO)
+        (status,) = _STATUS.unpack(_receive_exactly(sock, _STATUS.size))
+        return status
+    finally:
+        sock.close()
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv:
+        sys.stderr.write("usage: {} SOCKET [ARGS...]\n".format(os.path.basename(sys.argv[0])))
+        return 2
+    try:
+        return run_client(argv[0], argv[1:])
+    except (OSError, EOFError) as e:
+        sys.stderr.write("{}: cannot run the command on {}: {}\n".format(sys.argv[0], argv[0], e))
+        return 1
+    except KeyboardInterrupt:
+        return 130
+
+
+if __name__ == "__main__":
+    sys.exit(main())
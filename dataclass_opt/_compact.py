@@ -0,0 +1,231 @@
+"""Compact result types: variants of a dataclass whose instances have no `__dict__`.
+
+An instance of a plain dataclass keeps its fields in a dictionary of its own, which takes more
+memory than the fields themselves.  `DataClassParser(..., compact=...)` creates its results as one
+of these variants instead:
+
+- "slots": a dataclass with `__slots__`, as `@dataclass(slots=True)` creates in Python 3.10+;
+- "frozen": the same, but frozen;
+- "tuple": a tuple subclass with a property per field, like a `namedtuple`.
+
+The variants are generated once per dataclass, and have its name, fields and defaults.  Methods,
+properties and other class attributes are copied from the dataclass and its bases; the special
+methods are generated again.  Their instances are not instances of the original dataclass, which
+is recorded as the `__dataclass_opt_source__` attribute of the variant.  This module is only
+imported by parsers with the `compact` option.
+"""
+
+from dataclasses import MISSING, dataclass, field, fields
+from operator import itemgetter
+
+from . import _SOURCE_ATTRIBUTE, _get_compact_class
+
+# Attributes which dataclass() (or the tuple record) generates, rather than copies
+_GENERATED = frozenset(
+    [
+        "__annotations__",
+        "__dataclass_fields__",
+        "__dataclass_params__",
+        "__delattr__",
+        "__dict__",
+        "__doc__",
+        "__eq__",
+        "__ge__",
+        "__getstate__",
+        "__gt__",
+        "__hash__",
+        "__init__",
+        "__le__",
+        "__lt__",
+        "__match_args__",
+        "__module__",
+        "__qualname__",
+        "__reduce__",
+        "__repr__",
+        "__setattr__",
+        "__setstate__",
+        "__slots__",
+        "__weakref__",
+        _SOURCE_ATTRIBUTE,
+    ]
+)
+
+# The default of a record field which has a default_factory
+_FACTORY = object()
+
+
+def compact_class(cls, kind):
+    """Generate the compact variant `kind` ("slots", "frozen" or "tuple") of the dataclass `cls`."""
+    dc_fields = fields(cls)
+    names = tuple(dc_field.name for dc_field in dc_fields)
+
+    namespace = {}
+    for klass in reversed(cls.__mro__[:-1]):
+        namespace.update(vars(klass))
+    namespace = {
+        name: value
+        for name, value in namespace.items()
+        if name not in _GENERATED and name not in names
+    }
+    namespace.update(
+        {
+            "__module__": cls.__module__,
+            "__qualname__": cls.__qualname__,
+            "__doc__": cls.__doc__,
+            "__reduce__": _reducer(kind, names),
+            _SOURCE_ATTRIBUTE: cls,
+        }
+    )
+
+    if kind == "tuple":
+        return _record_class(cls, dc_fields, namespace)
+    return _slots_class(cls, dc_fields, namespace, frozen=kind == "frozen")
+
+
+def _copy_field(dc_field):
+    kwargs = {}
+    if hasattr(dc_field, "kw_only"):
+        # Python 3.10+
+        kwargs["kw_only"] = dc_field.kw_only
+    return field(
+        default=dc_field.default,
+        default_factory=dc_field.default_factory,
+        init=dc_field.init,
+        repr=dc_field.repr,
+        hash=dc_field.hash,
+        compare=dc_field.compare,
+        metadata=dc_field.metadata,
+        **kwargs
+    )
+
+
+def _slots_class(cls, dc_fields, namespace, frozen):
+    names = tuple(dc_field.name for dc_field in dc_fields)
+    params = cls.__dataclass_params__
+
+    namespace["__annotations__"] = {dc_field.name: dc_field.type for dc_field in dc_fields}
+    for dc_field in dc_fields:
+        namespace[dc_field.name] = _copy_field(dc_field)
+    generated = dataclass(
+        init=params.init,
+        repr=params.repr,
+        eq=params.eq,
+        order=params.order,
+        unsafe_hash=params.unsafe_hash,
+        frozen=params.frozen or frozen,
+    )(type(cls.__name__, (), namespace))
+
+    # A class's slots cannot be added after it is created, so create it again, as dataclass()
+    # does for slots=True.  The defaults are held by __init__, not by the class attributes which
+    # would clash with the slots.
+    body = {
+        name: value
+        for name, value in vars(generated).items()
+        if name not in names and name not in ("__dict__", "__weakref__")
+    }
+    body["__slots__"] = names
+    return type(generated)(generated.__name__, generated.__bases__, body)
+
+
+_RECORD_NEW_TEMPLATE = """\
+def __new__(_cls, {params}):
+    {factories}
+    return _tuple_new(_cls, ({names},))
+"""
+
+
+def _record_class(cls, dc_fields, namespace):
+    """Create a tuple subclass with the fields of `cls`.
+
+    The constructor takes the same arguments as the dataclass's; fields which are not arguments
+    of the dataclass's `__init__` are keyword-only, and None if they have no default.
+    """
+    names = tuple(dc_field.name for dc_field in dc_fields)
+    globals_ = {"_tuple_new": tuple.__new__, "_FACTORY": _FACTORY}
+    positional = []
+    keyword = []
+    factories = []
+
+    for dc_field in dc_fields:
+        name = dc_field.name
+        if dc_field.default_factory is not MISSING:
+            param = "{}=_FACTORY".format(name)
+            globals_["_factory_" + name] = dc_field.default_factory
+            factories.append("if {0} is _FACTORY: {0} = _factory_{0}()".format(name))
+        elif dc_field.default is not MISSING:
+            param = "{0}=_default_{0}".format(name)
+            globals_["_default_" + name] = dc_field.default
+        elif dc_field.init:
+            param = name
+        else:
+            param = "{}=None".format(name)
+
+        if dc_field.init and not getattr(dc_field, "kw_only", False):
+            positional.append(param)
+        else:
+            keyword.append(param)
+
+    params = positional + (["*"] + keyword if keyword else [])
+    source = _RECORD_NEW_TEMPLATE.format(
+        params=", ".join(params),
+        factories="\n    ".join(factories) or "pass",
+        names=", ".join(names),
+    )
+    exec(source, globals_)
+    new = globals_["__new__"]
+    new.__qualname__ = cls.__qualname__ + ".__new__"
+
+    namespace.update(
+        {
+            "__slots__": (),
+            "__new__": new,
+            "__repr__": _record_repr,
+            "_fields": names,
+            "_asdict": _record_asdict,
+            "_replace": _record_replace,
+        }
+    )
+    for i, name in enumerate(names):
+        namespace[name] = property(itemgetter(i), doc="Alias for field number {}".format(i))
+    return type(cls.__name__, (tuple,), namespace)
+
+
+def _record_repr(self):
+    return "{}({})".format(
+        type(self).__qualname__,
+        ", ".join("{}={!r}".format(name, value) for name, value in zip(self._fields, self)),
+    )
+
+
+def _record_asdict(self):
+    return dict(zip(self._fields, self))
+
+
+def _record_replace(self, **changes):
+    values = [changes.pop(name, value) for name, value in zip(self._fields, self)]
+    if changes:
+        raise TypeError("unexpected field names: {}".format(", ".join(changes)))
+    return tuple.__new__(type(self), values)
+
+
+def _reducer(kind, names):
+    """Return a `__reduce__` which pickles an instance by the dataclass it is a variant of."""
+
+    def __reduce__(self):
+        values = tuple(getattr(self, name) for name in names)
+        return _restore, (getattr(type(self), _SOURCE_ATTRIBUTE), kind, values)
+
+    return __reduce__
+
+
+def _restore(source, kind, values):
+    """Unpickle an instance of the compact variant `kind` of the dataclass `source`."""
+    compact = _get_compact_class[kind](source)
+    if kind == "tuple":
+        return tuple.__new__(compact, values)
+
+    # Bypassing __init__ (and the __setattr__ of frozen classes), as unpickling a dataclass does
+    obj = object.__new__(compact)
+    for name, value in zip(compact.__slots__, values):
+        object.__setattr__(obj, name, value)
+    return obj
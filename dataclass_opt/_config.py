@@ -0,0 +1,216 @@
+"""Default values read from TOML, JSON and INI config files.
+
+Files are parsed once per process for each (path, modification time, size), and the values are
+converted with the field types once per dataclass, so unchanged files are never parsed again.
+This module is only imported when a parser is given config files.
+"""
+
+import argparse
+import json
+import os
+import shlex
+from argparse import ArgumentTypeError
+from collections.abc import Mapping
+from configparser import ConfigParser
+
+from . import (
+    ConfigFileError,
+    UnsupportedException,
+    _get_plan,
+    _LRUCache,
+    _to_bool,
+    _to_container,
+)
+
+# Put top-level options in the [DEFAULT] section of INI files, without having configparser copy
+# them into every other (command) section.
+_INI_TOP_LEVEL = "DEFAULT"
+_INI_NO_DEFAULTS = "\0"
+
+_FLAG_ACTIONS = ("store_true", "store_false", getattr(argparse, "BooleanOptionalAction", None))
+
+# realpath -> (file key, parsed data)
+_files = {}
+
+
+def _parse_file(path):
+    extension = os.path.splitext(path)[1].lower()
+
+    if extension == ".json":
+        with open(path, "rb") as f:
+            data = json.load(f)
+    elif extension == ".toml":
+        try:
+            import tomllib
+        except ImportError:
+            try:
+                import tomli as tomllib
+            except ImportError:
+                raise UnsupportedException(
+                    "reading {} requires Python 3.11+ or the tomli package".format(path)
+                ) from None
+        with open(path, "rb") as f:
+            data = tomllib.load(f)
+    elif extension in (".ini", ".cfg", ".conf"):
+        config = ConfigParser(default_section=_INI_NO_DEFAULTS, interpolation=None)
+        with open(path) as f:
+            config.read_file(f)
+        data = {}
+        for section in config.sections():
+            values = dict(config.items(section))
+            if section == _INI_TOP_LEVEL:
+                data.update(values)
+            else:
+                data[section] = values
+    else:
+        raise ConfigFileError("{}: unknown config file format".format(path))
+
+    if not isinstance(data, Mapping):
+        raise ConfigFileError("{}: expected a table of options".format(path))
+
+    return data
+
+
+def _read(path):
+    """Return the file key and parsed contents of a config file, or None if it does not exist."""
+    path = os.path.realpath(path)
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+
+    key = (path, st.st_mtime_ns, st.st_size)
+    cached = _files.get(path)
+    if cached is None or cached[0] != key:
+        try:
+            cached = _files[path] = (key, _parse_file(path))
+        except (OSError, ValueError) as e:
+            raise ConfigFileError("{}: {}".format(path, e)) from e
+
+    return cached
+
+
+def load_config_files(paths):
+    """Read config files, and return the keys identifying their current contents."""
+    keys = []
+    for path in paths:
+        cached = _read(path)
+        if cached is not None:
+            keys.append(cached[0])
+    return tuple(keys)
+
+
+def config_layer(file_keys, cls, section):
+    """Return {dest: default} for the fields of `cls` set by the files; later files win."""
+    layer = {}
+    for file_key in file_keys:
+        layer.update(_converted(file_key, cls, section))
+    return layer
+
+
+def _converted(file_key, cls, section):
+    return _layer_cache((file_key, cls, section))
+
+
+def _convert_file(key):
+    file_key, cls, section = key
+    path = file_key[0]
+    cached = _files.get(path)
+    if cached is None or cached[0] != file_key:
+        cached = _read(path)
+    data = cached[1]
+
+    if section is not None:
+        data = data.get(section, {})
+        if not isinstance(data, Mapping):
+            raise ConfigFileError("{}: [{}] must be a table of options".format(path, section))
+
+    specs = {spec.name: spec for spec in _get_plan(cls)}
+    nested = set()
+    for name in specs:
+        parts = name.split(".")
+        nested.update(".".join(parts[:i]) for i in range(1, len(parts)))
+    layer = {}
+    for key, value in _flatten(data, nested, ""):
+        name = key.replace("-", "_")
+        spec = specs.get(name)
+        if section is None and isinstance(value, Mapping) and spec is None:
+            # A command section
+            continue
+
+        if spec is None:
+            raise ConfigFileError("{}: unknown option {!r}".format(path, key))
+
+        try:
+            layer[name] = _convert_value(spec.kwargs, value)
+        except (ArgumentTypeError, TypeError, ValueError, OverflowError) as e:
+            raise ConfigFileError("{}: invalid value for {!r}: {}".format(path, key, e)) from e
+
+    return layer
+
+
+_layer_cache = _LRUCache(_convert_file)
+
+
+def _flatten(data, nested, prefix):
+    """Yield (key, value) pairs, with the tables of nested dataclass fields as dotted keys."""
+    for key, value in data.items():
+        key = prefix + key
+        if isinstance(value, Mapping) and key.replace("-", "_") in nested:
+            yield from _flatten(value, nested, key + ".")
+        else:
+            yield key, value
+
+
+def _convert_value(kwargs, value):
+    """Convert a config file value the same way argparse converts command line values."""
+    action = kwargs.get("action")
+    nargs = kwargs.get("nargs")
+
+    if action in _FLAG_ACTIONS:
+        return _to_bool(value)
+    if action == "count":
+        return int(value)
+    if action == "store_const":
+        return kwargs.get("const") if _to_bool(value) else kwargs.get("default")
+    if action in ("help", "version"):
+        raise ValueError("cannot be set from a config file")
+
+    if action == "append" or nargs in ("+", "*") or isinstance(nargs, int):
+        if isinstance(value, str):
+            value = shlex.split(value)
+        elif not isinstance(value, list):
+            value = [value]
+        values = [_convert_scalar(kwargs, item) for item in value]
+        if kwargs.get("array_type") is not None:
+            return _to_container(kwargs["array_type"], kwargs["type"], values)
+        return values
+
+    converted = _convert_scalar(kwargs, value)
+    # argparse converts string defaults when they are used, so keep the original string if the
+    # result is also a string, rather than converting it twice
+    return value if isinstance(value, str) and isinstance(converted, str) else converted
+
+
+def _convert_scalar(kwargs, value):
+    """Convert one value with the field's type, as if it had been given on the command line.
+
+    Numbers and booleans from JSON or TOML are converted from their text, so that e.g. 2 becomes
+    2.0 for a float field, and true is refused for an int field.
+    """
+    if value is None:
+        return value
+    if isinstance(value, (Mapping, list)):
+        raise ValueError("expected a single value, not {!r}".format(value))
+
+    if not isinstance(value, str):
+        value = str(value).lower() if isinstance(value, bool) else str(value)
+    type_func = kwargs.get("type")
+    if callable(type_func):
+        value = type_func(value)
+
+    choices = kwargs.get("choices")
+    if choices is not None and value not in choices:
+        raise ValueError("{!r} is not one of {!r}".format(value, list(choices)))
+
+    return value
@@ -0,0 +1,390 @@
+"""Memory-mapped @file arguments.
+
+argparse reads an @file into one string, splits it into a list of lines, and copies the lines into
+argv, so that a list of a million paths is held three times over.  Here, a file holding only
+values, which all go to an argument taking any number of values (nargs "*" or "+"), is
+memory-mapped and kept in argv as a single `FileArgs` token, and its lines are decoded one at a
+time as the list field they belong to is filled in.  With `opt(..., file_view=True)`, the field is
+given a `MappedTokens` view of the file instead of a list.
+
+All other files, e.g. those containing options or other @files, those with at most one line, and
+those whose values go to positionals or single-valued options, are expanded in place exactly as
+argparse does.  This module is only imported when a parser with `fromfile_prefix_chars` reads an
+@file.
+"""
+
+import mmap
+import sys
+from argparse import (
+    ONE_OR_MORE,
+    ZERO_OR_MORE,
+    ArgumentError,
+    ArgumentTypeError,
+    _SubParsersAction,
+)
+from collections.abc import Sequence
+
+# Bytes decoded or counted at a time
+_CHUNK_SIZE = 1 << 20
+
+
+def _identity(value):
+    return value
+
+
+class MappedTokens(Sequence):
+    """The lines of a memory-mapped file, as a read-only sequence.
+
+    Lines are decoded (and converted, for the views given to fields) each time they are
+    accessed, so that only the file's pages, and not its contents as Python objects, are kept in
+    memory.  Iterating is sequential; the line offsets needed for indexing are built on first use.
+    """
+
+    def __init__(self, path, convert=_identity, _mapped=None):
+        self.path = path
+        self._convert = convert
+        if _mapped is None:
+            _mapped = _MappedFile(path)
+        self._mapped = _mapped
+
+    def converted(self, convert):
+        """Return a view of the same file, with `convert` applied to each line."""
+        return MappedTokens(self.path, convert, self._mapped)
+
+    def __iter__(self):
+        convert = self._convert
+        for line in self._mapped.lines():
+            yield convert(line)
+
+    def __len__(self):
+        return self._mapped.count()
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        return self._convert(self._mapped.line(index))
+
+    def __repr__(self):
+        return "{}({!r})".format(type(self).__name__, self.path)
+
+
+class _MappedFile:
+    """The shared mapping behind `MappedTokens`, split into lines like `str.splitlines`."""
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            # mmap cannot map empty files
+            self.size = size = f.seek(0, 2)
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+
+        self.end = size - 1 if size and self.map[size - 1 : size] == b"\n" else size
+        self.encoding = sys.getfilesystemencoding()
+        self.errors = sys.getfilesystemencodeerrors()
+        self._count = None
+        self._offsets = None
+
+    def _decode(self, start, stop):
+        line = self.map[start:stop]
+        if line.endswith(b"\r"):
+            line = line[:-1]
+        return line.decode(self.encoding, self.errors)
+
+    def lines(self):
+        # Only files whose lines end with "\n" or "\r\n" are mapped (see splits_like_argparse),
+        # so splitting at "\n" splits them as str.splitlines does
+        if not self.size:
+            return
+        # Decode whole lines, about _CHUNK_SIZE bytes at a time
+        start, end = 0, self.end
+        while True:
+            stop = end
+            if start + _CHUNK_SIZE < end:
+                stop = self.map.rfind(b"\n", start, start + _CHUNK_SIZE)
+                if stop < 0:
+                    stop = self.map.find(b"\n", start + _CHUNK_SIZE, end)
+                    if stop < 0:
+                        stop = end
+
+            text = self.map[start:stop].decode(self.encoding, self.errors)
+            if "\r" in text:
+                yield from (line[:-1] if line.endswith("\r") else line for line in text.split("\n"))
+            else:
+                yield from text.split("\n")
+
+            if stop == end:
+                return
+            start = stop + 1
+
+    def _count_bytes(self, sub):
+        # mmap has no count(); count chunks, overlapping so that no occurrence is cut in two
+        overlap = len(sub) - 1
+        return sum(
+            self.map[start : start + _CHUNK_SIZE + overlap].count(sub)
+            for start in range(0, self.size, _CHUNK_SIZE)
+        )
+
+    def count(self):
+        if self._count is None:
+            count = 0
+            if self.size:
+                count = 1
+                for start in range(0, self.end, _CHUNK_SIZE):
+                    count += self.map[start : min(start + _CHUNK_SIZE, self.end)].count(b"\n")
+            self._count = count
+        return self._count
+
+    def line(self, index):
+        if self._offsets is None:
+            from array import array
+
+            offsets = array("q", [0])
+            find, end = self.map.find, self.end
+            stop = find(b"\n", 0, end) if self.size else -1
+            while stop >= 0:
+                offsets.append(stop + 1)
+                stop = find(b"\n", stop + 1, end)
+            self._offsets = offsets
+
+        offsets = self._offsets
+        count = self.count()
+        if index < 0:
+            index += count
+        if not 0 <= index < count:
+            raise IndexError("line index out of range")
+        stop = offsets[index + 1] - 1 if index + 1 < count else self.end
+        return self._decode(offsets[index], stop)
+
+    def splits_like_argparse(self):
+        """Whether the lines are separated by newlines only, so that they split like argparse's.
+
+        argparse splits files with `str.splitlines`, which also breaks lines at lone carriage
+        returns, form feeds and other separators.
+        """
+        separators = ["\r", "\x0b", "\x0c", "\x1c", "\x1d", "\x1e", "\x85", "\u2028", "\u2029"]
+        for separator in separators:
+            try:
+                encoded = separator.encode(self.encoding, self.errors)
+            except UnicodeEncodeError:
+                continue
+            if self.map.find(encoded) >= 0:
+                if separator == "\r" and self._count_bytes(b"\r") == self._count_bytes(b"\r\n"):
+                    # Windows line endings, which are stripped
+                    continue
+                return False
+        return True
+
+    def holds_only_values(self, prefix_chars):
+        """Whether no line starts with one of `prefix_chars`, and so no line can be an option."""
+        for char in prefix_chars:
+            encoded = char.encode(self.encoding, self.errors)
+            if self.map[: len(encoded)] == encoded:
+                return False
+            if self.map.find(b"\n" + encoded, 0, self.end) >= 0:
+                return False
+        return True
+
+
+class FileArgs(str):
+    """An @file argument left in argv, which the field consuming it expands into its values."""
+
+    def __new__(cls, arg_string, tokens):
+        self = super().__new__(cls, arg_string)
+        self.tokens = tokens
+        return self
+
+
+def read_args_from_files(parser, arg_strings):
+    """Replace @file arguments, as `ArgumentParser._read_args_from_files` does."""
+    new_arg_strings = []
+    _expand(parser, arg_strings, _Consumer(parser), new_arg_strings)
+    return new_arg_strings
+
+
+def _expand(parser, arg_strings, consumer, new_arg_strings):
+    for arg_string in arg_strings:
+        if (
+            not arg_string
+            or arg_string[0] not in parser.fromfile_prefix_chars
+            or isinstance(arg_string, FileArgs)
+        ):
+            consumer.add(arg_string)
+            new_arg_strings.append(arg_string)
+            continue
+
+        tokens = None
+        if consumer.takes_many:
+            try:
+                tokens = MappedTokens(arg_string[1:])
+            except OSError as err:
+                parser.error(str(err))
+
+            mapped = tokens._mapped
+            if not (
+                mapped.count() > 1
+                and mapped.holds_only_values(parser.prefix_chars + parser.fromfile_prefix_chars)
+                and mapped.splits_like_argparse()
+            ):
+                tokens = None
+
+        if tokens is not None:
+            new_arg_strings.append(FileArgs(arg_string, tokens))
+        else:
+            _expand(parser, _read_lines(parser, arg_string[1:]), consumer, new_arg_strings)
+
+
+def _read_lines(parser, path):
+    """Return the arguments in the file `path`, read as argparse reads it."""
+    kwargs = {}
+    if sys.version_info >= (3, 12):
+        kwargs = {
+            "encoding": sys.getfilesystemencoding(),
+            "errors": sys.getfilesystemencodeerrors(),
+        }
+    try:
+        with open(path, **kwargs) as args_file:
+            lines = args_file.read().splitlines()
+    except OSError as err:
+        parser.error(str(err))
+
+    arg_strings = []
+    for line in lines:
+        arg_strings.extend(parser.convert_arg_line_to_args(line))
+    return arg_strings
+
+
+class _Consumer:
+    """Follows the arguments read so far, to tell which argument the next value will go to.
+
+    Only as much of argparse's parsing is followed as is needed to tell whether the next value
+    certainly goes to an argument with nargs "*" or "+": an option taking any number of values,
+    or the only positional of the parser (or of the command) when it takes any number of values.
+    When in doubt, e.g. after an abbreviated option, `takes_many` is false, so that @files are
+    expanded as argparse does.
+    """
+
+    def __init__(self, parser):
+        self._enter(parser)
+        self._options_ended = False
+
+    def _enter(self, parser):
+        self.parser = parser
+        self.positionals = [action for action in parser._actions if not action.option_strings]
+        self._to_positionals()
+
+    def _to_positionals(self):
+        # The number of values the current option still takes, or None if not known
+        self.remaining = 0
+        self.takes_many = len(self.positionals) == 1 and self.positionals[0].nargs in (
+            ZERO_OR_MORE,
+            ONE_OR_MORE,
+        )
+
+    def add(self, arg_string):
+        """Account for one argument, which is not an @file."""
+        if not self._options_ended and arg_string == "--":
+            self._options_ended = True
+            self._to_positionals()
+            return
+
+        kind, action = self._classify(arg_string)
+        if kind == "option":
+            nargs = action.nargs
+            if nargs in (ZERO_OR_MORE, ONE_OR_MORE):
+                self.remaining = 0
+                self.takes_many = True
+            elif nargs is None or isinstance(nargs, int):
+                self.remaining = 1 if nargs is None else nargs
+                self.takes_many = False
+                if not self.remaining:
+                    self._to_positionals()
+            else:
+                self.remaining = None
+                self.takes_many = False
+        elif kind == "explicit":
+            # An option with its value attached, e.g. --name=value
+            self._to_positionals()
+        elif kind == "unknown":
+            self.remaining = None
+            self.takes_many = False
+        elif self.remaining:
+            self.remaining -= 1
+            if not self.remaining:
+                self._to_positionals()
+        elif self.remaining == 0 and not self.takes_many:
+            for positional in self.positionals:
+                if isinstance(positional, _SubParsersAction) and arg_string in positional.choices:
+                    self._enter(positional.choices[arg_string])
+                    self._options_ended = False
+
+    def _classify(self, arg_string):
+        """Return ("option" or "explicit", action), ("unknown", None) or ("value", None)."""
+        parser = self.parser
+        if (
+            self._options_ended
+            or isinstance(arg_string, FileArgs)
+            or len(arg_string) < 2
+            or arg_string[0] not in parser.prefix_chars
+        ):
+            return "value", None
+
+        actions = parser._option_string_actions
+        if arg_string in actions:
+            return "option", actions[arg_string]
+        if "=" in arg_string and arg_string.split("=", 1)[0] in actions:
+            return "explicit", actions[arg_string.split("=", 1)[0]]
+        if parser._negative_number_matcher.match(arg_string):
+            if not parser._has_negative_number_optionals:
+                return "value", None
+        if " " in arg_string:
+            return "value", None
+        return "unknown", None
+
+
+def iter_tokens(arg_strings):
+    """Yield the values in `arg_strings`, expanding `FileArgs`."""
+    for arg_string in arg_strings:
+        if isinstance(arg_string, FileArgs):
+            yield from arg_string.tokens
+        else:
+            yield arg_string
+
+
+def get_values(parser, action, arg_strings):
+    """Convert arguments including `FileArgs`, as `ArgumentParser._get_values` does."""
+    if action.nargs not in (ZERO_OR_MORE, ONE_OR_MORE):
+        file_args = next(s for s in arg_strings if isinstance(s, FileArgs))
+        raise ArgumentError(action, "%s holds several values" % file_args)
+
+    if "--" in arg_strings:
+        arg_strings.remove("--")
+
+    type_func = parser._registry_get("type", action.type, action.type)
+    choices = action.choices
+
+    def convert(arg_string):
+        try:
+            value = type_func(arg_string)
+        except (ArgumentTypeError, TypeError, ValueError):
+            # Let argparse report the error
+            value = parser._get_value(action, arg_string)
+        if choices is not None:
+            parser._check_value(action, value)
+        return value
+
+    if getattr(action, "file_view", False) and len(arg_strings) == 1:
+        view = arg_strings[0].tokens.converted(convert)
+        # Report bad values now rather than when the view is used, without keeping them
+        for _ in view:
+            pass
+        return view
+
+    values = []
+    for arg_string in arg_strings:
+        if isinstance(arg_string, FileArgs):
+            if choices is None and type_func is parser._registry_get("type", None):
+                values.extend(arg_string.tokens)
+            else:
+                values.extend(map(convert, arg_string.tokens))
+        else:
+            values.append(convert(arg_string))
+    return values
@@ -0,0 +1,130 @@
+"""On-disk cache of rendered help and usage text.
+
+The text is stored under a hash of everything argparse's help formatter reads: the parser's
+settings, its argument groups and actions, and the terminal width.  Only the most recently
+written `_MAX_ENTRIES` texts are kept.  This module is only imported when a parser with a
+`help_cache` directory formats its help or usage.
+"""
+
+import argparse
+import functools
+import hashlib
+import os
+import re
+import shutil
+import sys
+
+from . import __version__
+
+_MAX_ENTRIES = 256
+
+# The addresses in default reprs such as "<function f at 0x7f...>", which differ from run to run
+_ADDRESS = re.compile(r" at 0x[0-9a-fA-F]+")
+
+
+def cached_text(parser, kind, render):
+    """Return the `kind` ("help" or "usage") text of `parser`, calling `render()` on a miss."""
+    key = hashlib.sha256(repr(_help_key(parser, kind)).encode()).hexdigest()
+    path = os.path.join(parser.help_cache, "{}-{}.txt".format(kind, key))
+
+    try:
+        with open(path, encoding="utf-8") as f:
+            return f.read()
+    except OSError:
+        pass
+
+    text = render()
+    try:
+        os.makedirs(parser.help_cache, exist_ok=True)
+        # Write to a private file, then rename, so that readers never see partial text
+        temp_path = "{}.{}.tmp".format(path, os.getpid())
+        with open(temp_path, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(temp_path, path)
+        _prune(parser.help_cache)
+    except OSError:
+        # The cache is an optimisation; the text is still correct
+        pass
+    return text
+
+
+def _prune(directory):
+    """Remove all but the `_MAX_ENTRIES` most recently written texts in `directory`."""
+    entries = []
+    for entry in os.scandir(directory):
+        if entry.name.endswith(".txt") and entry.name.startswith(("help-", "usage-")):
+            try:
+                entries.append((entry.stat().st_mtime, entry.path))
+            except OSError:
+                # Removed by another process
+                pass
+    if len(entries) <= _MAX_ENTRIES:
+        return
+
+    entries.sort()
+    for _, path in entries[:-_MAX_ENTRIES]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def _help_key(parser, kind):
+    formatter_class = parser.formatter_class
+    key = [
+        kind,
+        __version__,
+        sys.version_info[:2],
+        shutil.get_terminal_size().columns,
+        _callable_key(formatter_class),
+        parser.prog,
+        parser.usage,
+        parser.description,
+        parser.epilog,
+        parser.prefix_chars,
+    ]
+
+    for group in parser._action_groups:
+        key.append((group.title, group.description))
+        key.extend(_action_key(action) for action in group._group_actions)
+    for group in parser._mutually_exclusive_groups:
+        key.append((group.required, [action.dest for action in group._group_actions]))
+
+    return key
+
+
+def _action_key(action):
+    if isinstance(action, argparse._SubParsersAction):
+        # The choices map holds parsers (or their builders); only the names and help are shown
+        choices = [(choice.dest, choice.help, choice.metavar) for choice in action._choices_actions]
+        names = list(action.choices)
+        return ("subparsers", action.dest, action.metavar, action.help, choices, names)
+
+    type_func = action.type
+    return (
+        type(action).__name__,
+        action.option_strings,
+        action.dest,
+        action.nargs,
+        action.required,
+        action.help,
+        action.metavar,
+        _stable_repr(action.default),
+        None if action.choices is None else [_stable_repr(choice) for choice in action.choices],
+        None if type_func is None else _callable_key(type_func),
+    )
+
+
+def _callable_key(func):
+    """Identify a class or other callable, such as a formatter class or type, across runs."""
+    if isinstance(func, functools.partial):
+        keywords = sorted((name, _stable_repr(value)) for name, value in func.keywords.items())
+        return (_callable_key(func.func), [_stable_repr(arg) for arg in func.args], keywords)
+    if hasattr(func, "__qualname__"):
+        return "{}.{}".format(getattr(func, "__module__", None), func.__qualname__)
+    # An instance, e.g. argparse.FileType("r")
+    return _stable_repr(func)
+
+
+def _stable_repr(value):
+    return _ADDRESS.sub("", repr(value))
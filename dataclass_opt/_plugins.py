@@ -0,0 +1,166 @@
+"""Commands given as "package.module:ClassName" strings or entry points.
+
+The module of such a command is only imported when the command is selected, or its own help is
+shown.  The help shown for it in its parent's command list is the first line of the dataclass's
+docstring; with a command index file, that help (and the commands of each entry point group) is
+cached, so that top-level help imports nothing.
+"""
+
+import importlib
+import json
+import os
+import sys
+from dataclasses import is_dataclass
+
+from . import MustBeADataclass
+
+# Bumped when the index format changes
+_INDEX_VERSION = 1
+
+
+def load(spec):
+    """Import and return the dataclass named by "module:ClassName"."""
+    module_name, _, attr = spec.partition(":")
+    obj = importlib.import_module(module_name)
+    for part in attr.split(".") if attr else ():
+        obj = getattr(obj, part)
+    if not (is_dataclass(obj) and isinstance(obj, type)):
+        raise MustBeADataclass("{} must be a dataclass".format(spec))
+    return obj
+
+
+def docstring_help(cls):
+    """Return the first line of the docstring of `cls`, or None if it has none of its own."""
+    doc = cls.__doc__
+    # dataclass generates a docstring, such as "Fetch(url: str)", for classes without one
+    if not doc or doc.startswith(cls.__name__ + "("):
+        return None
+    return doc.strip().splitlines()[0]
+
+
+def _module_fingerprint(spec):
+    """Return [path, mtime, size] of the imported module named by `spec`, or None.
+
+    None is returned if the module is not imported, or has no source file.
+    """
+    module = sys.modules.get(spec.partition(":")[0])
+    return _file_fingerprint(getattr(module, "__file__", None))
+
+
+def _file_fingerprint(path):
+    """Return [path, mtime, size] of the file `path`, or None if it does not exist."""
+    try:
+        st = os.stat(path)
+    except (OSError, TypeError):
+        return None
+    return [path, st.st_mtime_ns, st.st_size]
+
+
+def _path_fingerprint():
+    """Return a hash of the distributions installed on the import path.
+
+    Installing, upgrading or removing a package adds or renames its .dist-info (or .egg-info)
+    directory.
+    """
+    import hashlib
+
+    digest = hashlib.sha256()
+    for entry in sys.path:
+        try:
+            names = os.listdir(entry or ".")
+        except OSError:
+            continue
+        digest.update(entry.encode("utf-8", "surrogateescape") + b"\0")
+        for name in sorted(names):
+            if name.endswith((".dist-info", ".egg-info")):
+                digest.update(name.encode("utf-8", "surrogateescape") + b"\0")
+    return digest.hexdigest()
+
+
+class CommandIndex:
+    """A JSON file caching command help and entry point groups between runs."""
+
+    def __init__(self, path):
+        self.path = path
+        self.changed = False
+        try:
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            data = None
+        if not isinstance(data, dict) or data.get("version") != _INDEX_VERSION:
+            data = {"version": _INDEX_VERSION, "help": {}, "entry_points": {}}
+        self.data = data
+
+    def command_help(self, spec):
+        # The module's path is recorded when it is loaded, so that checking it needs no imports
+        # (finding a module imports the package it is in)
+        cached = self.data["help"].get(spec)
+        if cached is not None and cached[0] is not None:
+            if _file_fingerprint(cached[0][0]) == cached[0]:
+                return cached[1]
+
+        help = docstring_help(load(spec))
+        self.data["help"][spec] = [_module_fingerprint(spec), help]
+        self.changed = True
+        return help
+
+    def entry_points(self, group):
+        fingerprint = _path_fingerprint()
+        cached = self.data["entry_points"].get(group)
+        if cached is not None and cached[0] == fingerprint:
+            return [tuple(item) for item in cached[1]]
+
+        commands = entry_point_commands(group)
+        self.data["entry_points"][group] = [fingerprint, commands]
+        self.changed = True
+        return commands
+
+    def save(self):
+        if not self.changed:
+            return
+        try:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            temp_path = "{}.{}.tmp".format(self.path, os.getpid())
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump(self.data, f)
+            os.replace(temp_path, self.path)
+            self.changed = False
+        except OSError:
+            # The index only saves time
+            pass
+
+
+class NoIndex:
+    """Command help and entry points looked up on every run."""
+
+    def command_help(self, spec):
+        return docstring_help(load(spec))
+
+    def entry_points(self, group):
+        return entry_point_commands(group)
+
+    def save(self):
+        pass
+
+
+def entry_point_commands(group):
+    """Return [(command name, "module:attr"), ...] for the entry points in `group`."""
+    try:
+        from importlib import metadata
+    except ImportError:
+        # Python < 3.8
+        import importlib_metadata as metadata
+
+    try:
+        entry_points = metadata.entry_points(group=group)
+    except TypeError:
+        # Python < 3.10
+        entry_points = metadata.entry_points().get(group, ())
+    return sorted((entry_point.name, entry_point.value) for entry_point in entry_points)
+
+
+def open_index(path):
+    return NoIndex() if path is None else CommandIndex(os.fspath(path))
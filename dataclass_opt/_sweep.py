@@ -0,0 +1,200 @@
+"""Parameter sweeps: options taking several values, and the cartesian product of their values.
+
+With `DataClassParser.parse_sweep`, the value of a single-valued argument may be a list of values,
+`0.1,0.01,0.001`, or for int and float arguments an inclusive range, `start:stop[:step]`, where
+the step is added, or with an `x` (`32:256:x2`), multiplied.  The points of the sweep are
+generated one at a time, so that only the values of each swept argument, and never the product,
+are held in memory; ranges do not even hold their values.  This module is only imported when a
+sweep is parsed.
+"""
+
+import math
+import re
+from argparse import ArgumentError, Namespace
+from dataclasses import fields
+
+from . import _command_call, _source_class
+
+# start:stop, start:stop:step, start:stop:+step, start:stop:xfactor (or *factor)
+_RANGE = re.compile(r"^([^:]+):([^:]+)(?::([x*+]?)([^:]+))?$")
+
+# Allowance for floating point error when deciding whether the stop value is reached
+_EPSILON = 1e-9
+
+_EMPTY = object()
+
+
+class Sweep:
+    """The values of one swept argument, which can be iterated over any number of times."""
+
+    def __init__(self, values):
+        self.values = values
+
+    def __iter__(self):
+        return iter(self.values)
+
+    def __len__(self):
+        return len(self.values)
+
+    def __repr__(self):
+        return "{}({!r})".format(type(self).__name__, self.values)
+
+
+class _Range:
+    """The values start, start + step, ... (or start * step, ...) up to and including stop."""
+
+    def __init__(self, start, stop, step, multiply, type_func):
+        self.start = start
+        self.stop = stop
+        self.step = step
+        self.multiply = multiply
+        self.type_func = type_func
+        if multiply:
+            # Steps of log(step) from log(start) to log(stop)
+            count = math.log(stop / start) / math.log(step)
+        else:
+            count = (stop - start) / step
+        self.count = int(math.floor(count + _EPSILON)) + 1
+
+    def __iter__(self):
+        start, step, type_func = self.start, self.step, self.type_func
+        if self.multiply:
+            value = start
+            for _ in range(self.count):
+                yield value
+                value = type_func(value * step)
+        else:
+            # Computed from the start each time, so that float errors do not accumulate
+            for i in range(self.count):
+                yield type_func(start + i * step)
+
+    def __len__(self):
+        return self.count
+
+    def __repr__(self):
+        step = ("x" if self.multiply else "") + str(self.step)
+        return "{}:{}:{}".format(self.start, self.stop, step)
+
+
+def sweep_values(parser, action, arg_string):
+    """Return a `Sweep` for `arg_string`, or None if it holds a single value."""
+    type_func = parser._registry_get("type", action.type, action.type)
+
+    if type_func in (int, float):
+        match = _RANGE.match(arg_string)
+        if match:
+            start, stop, kind, step = match.groups()
+            start = parser._get_value(action, start)
+            stop = parser._get_value(action, stop)
+            step = parser._get_value(action, step) if step is not None else type_func(1)
+            values = _range(action, arg_string, start, stop, step, kind in ("x", "*"), type_func)
+            if action.choices is not None:
+                for value in values:
+                    parser._check_value(action, value)
+            return Sweep(values)
+
+    if "," in arg_string:
+        values = []
+        for part in arg_string.split(","):
+            value = parser._get_value(action, part)
+            parser._check_value(action, value)
+            values.append(value)
+        return Sweep(values)
+
+    return None
+
+
+def _range(action, arg_string, start, stop, step, multiply, type_func):
+    if multiply:
+        valid = start > 0 and stop > 0 and step != 1 and (step > 1) == (stop >= start)
+    else:
+        valid = step != 0 and (step > 0) == (stop >= start)
+    if not valid:
+        raise ArgumentError(action, "the range %r never reaches its stop value" % arg_string)
+    return _Range(start, stop, step, multiply, type_func)
+
+
+def iter_points(parser, data):
+    """Yield a parse result for every point of the sweep in the namespace dict `data`.
+
+    The last swept argument varies fastest, as with `itertools.product`.
+    """
+    names = [name for name, value in data.items() if isinstance(value, Sweep)]
+    sweeps = [data[name] for name in names]
+
+    iterators = [iter(sweep) for sweep in sweeps]
+    current = []
+    for iterator in iterators:
+        value = next(iterator, _EMPTY)
+        if value is _EMPTY:
+            return
+        current.append(value)
+
+    while True:
+        point = dict(data)
+        point.update(zip(names, current))
+        yield parser._construct(Namespace(**point), [])[0]
+
+        # Advance like an odometer, restarting the arguments which have run out
+        i = len(iterators) - 1
+        while i >= 0:
+            value = next(iterators[i], _EMPTY)
+            if value is not _EMPTY:
+                current[i] = value
+                break
+            iterators[i] = iter(sweeps[i])
+            current[i] = next(iterators[i])
+            i -= 1
+        if i < 0:
+            return
+
+
+def _plain(obj):
+    """Return `obj` as an instance of the dataclass given to `add_command`, without `func`.
+
+    The dataclasses with a `func` field are created at run time, so cannot be pickled.
+    """
+    base = _source_class(type(obj)).__mro__[1]
+    return base(
+        **{dc_field.name: getattr(obj, dc_field.name) for dc_field in fields(base) if dc_field.init}
+    )
+
+
+def _task(result):
+    """Return (func, args) to run the command of the parse result `result` in another process."""
+    func, args = _command_call(result)
+    if func is None:
+        raise ValueError("the command has no func; add it with add_command(..., func=...)")
+    return func, args[:-1] + (_plain(args[-1]),)
+
+
+def run_points(points, max_workers, window, executor):
+    """Run the command `func` of each point in a pool, yielding (point, return value)."""
+    from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+    own_executor = executor is None
+    if own_executor:
+        executor = ProcessPoolExecutor(max_workers)
+    if window is None:
+        window = 2 * (max_workers or getattr(executor, "_max_workers", None) or 1)
+
+    pending = {}
+    try:
+        for point in points:
+            func, args = _task(point)
+            pending[executor.submit(func, *args)] = point
+            while len(pending) >= window:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield pending.pop(future), future.result()
+
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield pending.pop(future), future.result()
+    finally:
+        # On an error, or if the caller stops early, don't start what is still queued
+        for future in pending:
+            future.cancel()
+        if own_executor:
+            executor.shutdown()
@@ -0,0 +1,451 @@
+"""Ahead-of-time generation of standalone parser modules.
+
+`generate_parser_module` turns a `DataClassParser` into the source of a plain Python module which
+rebuilds the same `ArgumentParser` with direct `add_argument` calls, and builds the result
+dataclasses directly.  The generated module does not import `dataclass_opt`, and does no
+dataclass introspection when it is imported or used.
+"""
+
+import argparse
+import importlib
+import inspect
+import math
+import os
+import sys
+from dataclasses import MISSING, fields, is_dataclass
+
+from . import DataClassParser, UnsupportedException, _ArrayStoreAction, _nested_class
+
+_PARSER_DEFAULTS = {
+    "usage": None,
+    "description": None,
+    "epilog": None,
+    "formatter_class": argparse.HelpFormatter,
+    "prefix_chars": "-",
+    "fromfile_prefix_chars": None,
+    "argument_default": None,
+    "conflict_handler": "error",
+    "add_help": True,
+    "allow_abbrev": True,
+    "exit_on_error": True,
+}
+
+_LITERAL_TYPES = (type(None), bool, int, str, bytes)
+
+_MODULE_TEMPLATE = '''\
+"""Command line parser generated by dataclass_opt{source}.
+
+Do not edit; regenerate this module when the dataclasses change.
+"""
+
+import argparse
+{imports}
+
+class _Parser(argparse.ArgumentParser):
+    have_commands = {have_commands!r}
+    have_extra_args = {have_extra_args!r}
+
+    def parse_known_args(self, args=None, namespace=None):
+        args, argv = super().parse_known_args(args=args, namespace=namespace)
+        return _to_result(args, self.have_commands, self.have_extra_args), argv
+
+{classes}
+_FIELDS = {{
+{field_names}}}
+
+
+def _build(cls, data):
+    names = _FIELDS[cls]
+    return cls(**{{name: data[name] for name in names if name in data}})
+
+
+def _to_result(args, have_commands, have_extra_args):
+    cls = getattr(args, "cls", None)
+    cmd_cls = getattr(args, "cmd_cls", None)
+    cls_is_dataclass = cls in _FIELDS
+    cmd_is_dataclass = cmd_cls in _FIELDS
+
+    if not cls_is_dataclass and not cmd_is_dataclass:
+        if have_commands:
+            return args, None
+        return args
+
+    data = dict(vars(args))
+
+    if cls_is_dataclass and cmd_is_dataclass:
+        del data["cls"], data["cmd_cls"]
+        return _build(cls, data), _build(cmd_cls, data)
+
+    if cls_is_dataclass:
+        del data["cls"]
+        obj = _build(cls, data)
+    else:
+        del data["cmd_cls"]
+        obj = _build(cmd_cls, data)
+        cls = cmd_cls
+
+    other_data = {{key: value for key, value in data.items() if key not in _FIELDS[cls]}}
+    if not other_data and not have_extra_args:
+        return obj
+
+    if cls_is_dataclass:
+        return obj, argparse.Namespace(**other_data)
+    return argparse.Namespace(**other_data), obj
+
+
+def build_parser():
+{body}    return parser_0
+
+
+def parse_known_args(args=None, namespace=None):
+    return build_parser().parse_known_args(args=args, namespace=namespace)
+
+
+def parse_args(args=None, namespace=None):
+    return build_parser().parse_args(args=args, namespace=namespace)
+'''
+
+
+def generate_parser_module(parser, source=None):
+    """Return the source of a module which rebuilds `parser` without any introspection.
+
+    The module defines `build_parser()`, `parse_args()` and `parse_known_args()`, which behave
+    like the corresponding `DataClassParser` methods.  Every dataclass, type, and default used
+    by the parser must be importable (or be a literal value, or a value stored on a dataclass
+    field), and must not come from `dataclass_opt` itself, which the module does not import;
+    otherwise `UnsupportedException` is raised.  This rules out fields with `container=`.
+    """
+    if not isinstance(parser, DataClassParser):
+        raise UnsupportedException("{!r} is not a DataClassParser".format(parser))
+
+    return _Generator().module(parser, source)
+
+
+class _Generator:
+    def __init__(self):
+        self.imports = set()
+        self.classes = []
+        self.class_exprs = {}
+        self.field_names = {}
+        self.lines = []
+        self.counter = 0
+
+    def module(self, parser, source):
+        self.parser(parser, None)
+
+        return _MODULE_TEMPLATE.format(
+            source=" from {}".format(source) if source else "",
+            imports="".join("import {}\n".format(name) for name in sorted(self.imports)),
+            have_commands=parser.have_commands,
+            have_extra_args=parser.have_extra_args,
+            classes="".join(line + "\n" for line in self.classes),
+            field_names="".join(
+                "    {}: {!r},\n".format(expr, names) for expr, names in self.field_names.items()
+            ),
+            body="".join("    " + line + "\n" for line in self.lines),
+        )
+
+    def emit(self, line):
+        self.lines.append(line)
+
+    def new_name(self, prefix):
+        name = "{}_{}".format(prefix, self.counter)
+        self.counter += 1
+        return name
+
+    # Parsers
+
+    def parser(self, parser, subparsers):
+        """Emit code creating `parser`, either at the top level or from a subparsers action."""
+        name = self.new_name("parser")
+        kwargs = []
+
+        for key, default in _PARSER_DEFAULTS.items():
+            if not hasattr(parser, key):
+                continue
+            value = getattr(parser, key)
+            if value != default:
+                kwargs.append("{}={}".format(key, self.value(value)))
+
+        if subparsers is None:
+            if parser.prog != os.path.basename(sys.argv[0]):
+                kwargs.insert(0, "prog={!r}".format(parser.prog))
+            self.emit("{} = _Parser({})".format(name, ", ".join(kwargs)))
+        else:
+            subparsers_name, command = subparsers
+            if command.help is not _NO_HELP:
+                kwargs.insert(0, "help={}".format(self.value(command.help)))
+            self.emit(
+                "{} = {}.add_parser({})".format(
+                    name, subparsers_name, ", ".join([repr(command.name)] + kwargs)
+                )
+            )
+
+        if parser._mutually_exclusive_groups or len(parser._action_groups) > 2:
+            raise UnsupportedException("argument groups are not supported")
+        if getattr(parser, "_env_index", None):
+            raise UnsupportedException("environment variables are not supported")
+        if getattr(parser, "_config_keys", None):
+            # The generated parser would keep the files' current values as fixed defaults
+            raise UnsupportedException("config files are not supported")
+        if getattr(parser, "compact", None) is not None:
+            raise UnsupportedException("compact results are not supported")
+
+        owners = [cls for cls in parser._defaults.values() if is_dataclass(cls)]
+
+        for action in parser._actions:
+            if isinstance(action, argparse._HelpAction) and parser.add_help:
+                continue
+            if isinstance(action, argparse._SubParsersAction):
+                self.subparsers(name, action)
+                continue
+            self.action(name, action, owners)
+
+        if parser._defaults:
+            defaults = [
+                "{}={}".format(key, self.value(value, owners, key, "default"))
+                for key, value in parser._defaults.items()
+            ]
+            self.emit("{}.set_defaults({})".format(name, ", ".join(defaults)))
+
+        return name
+
+    def subparsers(self, parser_name, action):
+        name = self.new_name("subparsers")
+        kwargs = ["parser_class=argparse.ArgumentParser"]
+        if action.dest is not argparse.SUPPRESS:
+            kwargs.append("dest={!r}".format(action.dest))
+        if action.required:
+            kwargs.append("required=True")
+        for key in ("help", "metavar"):
+            if getattr(action, key) is not None:
+                kwargs.append("{}={}".format(key, self.value(getattr(action, key))))
+
+        self.emit("{} = {}.add_subparsers({})".format(name, parser_name, ", ".join(kwargs)))
+
+        helps = {choice.dest: choice.help for choice in action._choices_actions}
+        for command_name, parser in action._name_parser_map.items():
+            command = _Command(command_name, helps.get(command_name, _NO_HELP))
+            self.parser(parser, (name, command))
+
+    def action(self, parser_name, action, owners):
+        action_cls = type(action)
+        if issubclass(action_cls, _ArrayStoreAction):
+            raise UnsupportedException(
+                "container= fields are not supported (argument {!r})".format(action.dest)
+            )
+        registered = {
+            cls: key for key, cls in action.container._registries["action"].items() if key
+        }
+
+        args = []
+        option_strings = list(action.option_strings)
+        if isinstance(action, getattr(argparse, "BooleanOptionalAction", ())):
+            option_strings = [
+                option for option in option_strings if not option.startswith("--no-")
+            ]
+
+        if option_strings:
+            args.extend(repr(option) for option in option_strings)
+        else:
+            args.append(repr(action.dest))
+
+        if action_cls in registered:
+            if registered[action_cls] != "store":
+                args.append("action={!r}".format(registered[action_cls]))
+        else:
+            args.append("action={}".format(self.value(action_cls)))
+
+        for key, param in _init_parameters(action_cls).items():
+            if key in ("self", "option_strings") or param.kind is not param.POSITIONAL_OR_KEYWORD:
+                continue
+            if key == "dest":
+                if option_strings:
+                    args.append("dest={!r}".format(action.dest))
+                continue
+            if key == "required" and not option_strings:
+                # argparse decides this for positionals
+                continue
+
+            value = getattr(action, key)
+            if param.default is not param.empty and _same(value, param.default):
+                continue
+            args.append("{}={}".format(key, self.value(value, owners, action.dest, key)))
+
+        self.emit("{}.add_argument({})".format(parser_name, ", ".join(args)))
+
+    # Values
+
+    def value(self, value, owners=(), dest=None, key=None):
+        """Return a Python expression for `value`."""
+        expr = self.literal(value)
+        if expr is not None:
+            return expr
+
+        if is_dataclass(value) and isinstance(value, type):
+            return self.dataclass(value)
+
+        expr = self.reference(value)
+        if expr is not None:
+            return expr
+
+        if isinstance(value, argparse.FileType):
+            args = ", ".join(
+                self.value(getattr(value, attr))
+                for attr in ("_mode", "_bufsize", "_encoding", "_errors")
+            )
+            return "argparse.FileType({})".format(args)
+
+        expr = self.field_value(value, owners, dest, key)
+        if expr is not None:
+            return expr
+
+        raise UnsupportedException(
+            "cannot generate source for {!r} (argument {!r})".format(value, dest)
+        )
+
+    def literal(self, value):
+        if isinstance(value, float):
+            if math.isfinite(value):
+                return repr(value)
+            return "float({!r})".format(repr(value))
+
+        if type(value) in _LITERAL_TYPES:
+            return repr(value)
+
+        if type(value) in (list, tuple, set, frozenset):
+            items = [self.literal(item) for item in value]
+            if None in items:
+                return None
+            if type(value) is tuple:
+                return "({}{})".format(", ".join(items), "," if len(items) == 1 else "")
+            if type(value) is list:
+                return "[{}]".format(", ".join(items))
+            return "{}([{}])".format(type(value).__name__, ", ".join(items))
+
+        if type(value) is dict:
+            items = [(self.literal(k), self.literal(v)) for k, v in value.items()]
+            if any(k is None or v is None for k, v in items):
+                return None
+            return "{{{}}}".format(", ".join("{}: {}".format(k, v) for k, v in items))
+
+        if type(value) is range:
+            return "range({!r}, {!r}, {!r})".format(value.start, value.stop, value.step)
+
+        return None
+
+    def reference(self, value):
+        """Return an importable dotted name for `value`, or None."""
+        module_name = getattr(value, "__module__", None)
+        qualname = getattr(value, "__qualname__", None)
+        if not isinstance(module_name, str) or not isinstance(qualname, str):
+            return None
+        if "<" in qualname or module_name == "__main__":
+            return None
+        if module_name.partition(".")[0] == __name__.partition(".")[0]:
+            # The generated module must not depend on dataclass_opt
+            return None
+
+        try:
+            target = importlib.import_module(module_name)
+            for part in qualname.split("."):
+                target = getattr(target, part)
+        except (ImportError, AttributeError):
+            return None
+
+        if target is not value:
+            return None
+
+        if module_name == "builtins":
+            return qualname
+
+        self.imports.add(module_name)
+        return "{}.{}".format(module_name, qualname)
+
+    def dataclass(self, cls):
+        if cls in self.class_exprs:
+            return self.class_exprs[cls]
+
+        if any(_nested_class(cls, dc_field) for dc_field in fields(cls)):
+            raise UnsupportedException("nested dataclass fields are not supported")
+
+        expr = self.reference(cls)
+        if expr is None:
+            expr = self.command_func_dataclass(cls)
+
+        self.class_exprs[cls] = expr
+        self.field_names[expr] = tuple(f.name for f in fields(cls))
+        return expr
+
+    def command_func_dataclass(self, cls):
+        """Recreate the dataclass `add_command(..., func=...)` derives from a command class."""
+        bases = cls.__bases__
+        func_field = cls.__dataclass_fields__.get("func")
+        if (
+            len(bases) != 1
+            or not is_dataclass(bases[0])
+            or func_field is None
+            or cls.__name__ != bases[0].__name__ + "_"
+        ):
+            raise UnsupportedException("cannot import dataclass {!r}".format(cls))
+
+        self.imports.update(("dataclasses", "typing"))
+        name = "_{}{}".format(cls.__name__, len(self.classes))
+        self.classes.append(
+            "{} = dataclasses.make_dataclass({!r}, fields=[(\"func\", typing.Callable, "
+            "dataclasses.field(default={}))], bases=({},))\n".format(
+                name, cls.__name__, self.value(func_field.default), self.dataclass(bases[0])
+            )
+        )
+        return name
+
+    def field_value(self, value, owners, dest, key):
+        """Return an expression reading `value` from the dataclass field it came from."""
+        for owner in owners:
+            dc_field = owner.__dataclass_fields__.get(dest)
+            if dc_field is None:
+                continue
+
+            expr = "{}.__dataclass_fields__[{!r}]".format(self.dataclass(owner), dest)
+            if key in dc_field.metadata and dc_field.metadata[key] is value:
+                return "{}.metadata[{!r}]".format(expr, key)
+            if key == "default":
+                if dc_field.default is value:
+                    return "{}.default".format(expr)
+                if dc_field.default_factory is not MISSING:
+                    return "{}.default_factory()".format(expr)
+
+        return None
+
+
+class _Command:
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+
+
+_NO_HELP = object()
+
+
+def _init_parameters(action_cls):
+    """Return the parameters of an action's constructor, following `**kwargs` to base classes."""
+    parameters = {}
+    for cls in action_cls.__mro__:
+        if "__init__" not in vars(cls):
+            continue
+        var_keyword = False
+        for key, param in inspect.signature(cls.__init__).parameters.items():
+            if param.kind is param.VAR_KEYWORD:
+                var_keyword = True
+            else:
+                parameters.setdefault(key, param)
+        if not var_keyword:
+            break
+    return parameters
+
+
+def _same(value, default):
+    try:
+        return type(value) is type(default) and bool(value == default)
+    except Exception:
+        return False
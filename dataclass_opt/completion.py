@@ -0,0 +1,313 @@
+"""Static shell completion scripts.
+
+`generate_completion` writes a bash, zsh or fish script completing the options, choices and
+commands of a `DataClassParser`, so that pressing TAB never starts a Python process.  Each script
+records a fingerprint of what it completes, and `write_completion` only rewrites a script when the
+fingerprint changes, i.e. when the dataclasses or commands have changed.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import re
+
+from . import UnsupportedException
+
+SHELLS = ("bash", "zsh", "fish")
+
+_FINGERPRINT_PREFIX = "# dataclass_opt completion fingerprint: "
+
+# Bumped when the scripts change, so that existing scripts are regenerated
+_FORMAT_VERSION = 2
+
+# Words which need no quoting in any of the shells
+_SAFE_WORD = re.compile(r"^[\w@%+=:,./-]+$")
+
+
+def generate_completion(parser, shell, prog=None):
+    """Return a completion script for `parser` in `shell` ("bash", "zsh" or "fish").
+
+    `prog` is the command being completed; it defaults to the parser's `prog`.
+    """
+    if shell not in SHELLS:
+        raise UnsupportedException(
+            "shell must be one of {}, not {!r}".format(", ".join(SHELLS), shell)
+        )
+
+    prog = prog or parser.prog
+    tree = _completion_tree(parser)
+    fingerprint = _fingerprint(tree, shell, prog)
+    script = _GENERATORS[shell](tree, prog)
+    return "{}{}\n{}".format(_FINGERPRINT_PREFIX, fingerprint, script)
+
+
+def write_completion(parser, shell, path, prog=None):
+    """Write the completion script to `path`, unless it is already up to date.
+
+    Returns True if the file was written.
+    """
+    script = generate_completion(parser, shell, prog)
+    fingerprint_line = script.partition("\n")[0]
+    try:
+        with open(path) as f:
+            if f.readline().rstrip("\n") == fingerprint_line:
+                return False
+    except FileNotFoundError:
+        pass
+
+    with open(path, "w") as f:
+        f.write(script)
+    return True
+
+
+def _fingerprint(tree, shell, prog):
+    data = json.dumps([_FORMAT_VERSION, shell, prog, tree], sort_keys=True)
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+# What to complete
+
+
+def _completion_tree(parser):
+    """Return {"options": [...], "commands": {name: tree}} describing `parser`.
+
+    Each option is {"names", "help", "takes_value", "choices", "files"}; positional choices are
+    listed under "values".
+    """
+    options = []
+    values = []
+    commands = {}
+
+    for action in parser._actions:
+        if action.help == argparse.SUPPRESS:
+            continue
+
+        if isinstance(action, argparse._SubParsersAction):
+            helps = {choice.dest: choice.help for choice in action._choices_actions}
+            for name in list(action.choices):
+                subtree = _completion_tree(action.choices[name])
+                subtree["help"] = _help_text(helps.get(name))
+                commands[name] = subtree
+            continue
+
+        choices = _choices(action)
+        if not action.option_strings:
+            values.extend(choices or ())
+            continue
+
+        options.append(
+            {
+                "names": list(action.option_strings),
+                "help": _help_text(action.help, action, parser.prog),
+                "takes_value": action.nargs != 0,
+                "choices": choices,
+                "files": _completes_files(action),
+            }
+        )
+
+    return {"options": options, "values": values, "commands": commands}
+
+
+def _choices(action):
+    if action.choices is None:
+        return None
+    return [str(choice) for choice in action.choices]
+
+
+def _completes_files(action):
+    type_func = action.type
+    if isinstance(type_func, argparse.FileType):
+        return True
+    return isinstance(type_func, type) and issubclass(type_func, os.PathLike)
+
+
+def _help_text(text, action=None, prog=None):
+    if not text or text == argparse.SUPPRESS:
+        return ""
+    text = text.splitlines()[0]
+
+    # Expand format specifiers such as %(default)s as argparse's help formatter does
+    params = dict(vars(action), prog=prog) if action is not None else {}
+    if params.get("choices") is not None:
+        params["choices"] = ", ".join(map(str, params["choices"]))
+    try:
+        return (text % params).strip()
+    except (KeyError, TypeError, ValueError):
+        return re.sub(r"%\([^)]*\)\w", "", text).replace("%%", "%").strip()
+
+
+def _walk(tree, path=()):
+    """Yield (path, tree) for `tree` and all its commands, parents first."""
+    yield path, tree
+    for name, subtree in tree["commands"].items():
+        yield from _walk(subtree, path + (name,))
+
+
+# bash and zsh
+
+_BASH_TEMPLATE = """\
+{function}() {{
+    local cur prev path word i words
+    cur="${{COMP_WORDS[COMP_CWORD]}}"
+    prev="${{COMP_WORDS[COMP_CWORD-1]}}"
+
+    # Follow the commands typed so far
+    path=""
+    for ((i = 1; i < COMP_CWORD; i++)); do
+        word="${{COMP_WORDS[i]}}"
+        case "$path/$word" in
+{transitions}        esac
+    done
+
+    # Values of the previous option, or else options, commands and positional values
+    words=()
+    case "$path/$prev" in
+{option_values}        *)
+            case "$path" in
+{words}            esac ;;
+    esac
+
+    # Each word is matched and escaped whole, as it may contain spaces or quotes
+    COMPREPLY=()
+    for word in "${{words[@]}}"; do
+        if [[ "$word" == "$cur"* ]]; then
+            printf -v word "%q" "$word"
+            COMPREPLY+=("$word")
+        fi
+    done
+}}
+"""
+
+
+def _bash_function(tree, prog):
+    function = "_dataclass_opt_" + re.sub(r"\W", "_", os.path.basename(prog))
+
+    transitions = []
+    option_values = []
+    words = []
+    for path, subtree in _walk(tree):
+        key = "".join("/" + name for name in path)
+
+        for name in subtree["commands"]:
+            command_key = _sh_quote(key + "/" + name)
+            transitions.append("            {}) path={} ;;\n".format(command_key, command_key))
+
+        for option in subtree["options"]:
+            if not option["takes_value"]:
+                continue
+            patterns = "|".join(_sh_quote(key + "/" + name) for name in option["names"])
+            if option["choices"] is not None:
+                reply = "words={}".format(_sh_array(option["choices"]))
+            elif option["files"]:
+                reply = 'COMPREPLY=($(compgen -f -- "$cur")); return'
+            else:
+                # Let the shell's default completion take over
+                reply = "COMPREPLY=(); return"
+            option_values.append("        {}) {} ;;\n".format(patterns, reply))
+
+        candidates = [name for option in subtree["options"] for name in option["names"]]
+        candidates += list(subtree["commands"]) + subtree["values"]
+        words.append(
+            "                {}) words={} ;;\n".format(_sh_quote(key), _sh_array(candidates))
+        )
+
+    return function, _BASH_TEMPLATE.format(
+        function=function,
+        transitions="".join(transitions),
+        option_values="".join(option_values),
+        words="".join(words),
+    )
+
+
+def _bash(tree, prog):
+    function, body = _bash_function(tree, prog)
+    return "{}complete -o default -F {} {}\n".format(body, function, _sh_quote(prog))
+
+
+def _zsh(tree, prog):
+    # zsh runs the bash function through its bash completion compatibility layer, so the script
+    # is sourced (e.g. from .zshrc) rather than autoloaded from $fpath
+    function, body = _bash_function(tree, prog)
+    return (
+        "autoload -U +X bashcompinit && bashcompinit\n"
+        "{body}complete -o default -F {function} {prog}\n"
+    ).format(prog=_sh_quote(prog), body=body, function=function)
+
+
+def _sh_array(words):
+    return "({})".format(" ".join(_sh_quote(word) for word in words))
+
+
+def _sh_quote(text):
+    if text and _SAFE_WORD.match(text):
+        return text
+    return "'" + text.replace("'", "'\"'\"'") + "'"
+
+
+# fish
+
+
+def _fish(tree, prog):
+    name = os.path.basename(prog)
+    lines = ["complete -c {} -e".format(_fish_quote(name))]
+
+    for path, subtree in _walk(tree):
+        if path:
+            condition = " && ".join(
+                "__fish_seen_subcommand_from {}".format(_fish_quote(command)) for command in path
+            )
+        elif tree["commands"]:
+            condition = "not __fish_seen_subcommand_from {}".format(
+                " ".join(_fish_quote(command) for command in tree["commands"])
+            )
+        else:
+            condition = None
+        prefix = "complete -c {}".format(_fish_quote(name))
+        if condition:
+            prefix += " -n {}".format(_fish_quote(condition))
+
+        for command, command_tree in subtree["commands"].items():
+            line = "{} -f -a {}".format(prefix, _fish_quote(command))
+            if command_tree["help"]:
+                line += " -d {}".format(_fish_quote(command_tree["help"]))
+            lines.append(line)
+
+        if subtree["values"]:
+            lines.append("{} -f -a {}".format(prefix, _fish_words(subtree["values"])))
+
+        for option in subtree["options"]:
+            line = prefix
+            for option_name in option["names"]:
+                if option_name.startswith("--"):
+                    line += " -l {}".format(_fish_quote(option_name[2:]))
+                elif len(option_name) == 2:
+                    line += " -s {}".format(_fish_quote(option_name[1:]))
+                else:
+                    line += " -o {}".format(_fish_quote(option_name[1:]))
+            if option["takes_value"]:
+                line += " -r"
+                if option["choices"] is not None:
+                    line += " -f -a {}".format(_fish_words(option["choices"]))
+                elif option["files"]:
+                    line += " -F"
+            if option["help"]:
+                line += " -d {}".format(_fish_quote(option["help"]))
+            lines.append(line)
+
+    return "".join(line + "\n" for line in lines)
+
+
+def _fish_words(words):
+    # fish splits the argument of -a into words as it splits a command line, so each word is
+    # quoted inside it
+    return _fish_quote(" ".join(_fish_quote(word) for word in words))
+
+
+def _fish_quote(text):
+    if text and _SAFE_WORD.match(text):
+        return text
+    return "'" + text.replace("\\", "\\\\").replace("'", "\\'") + "'"
+
+
+_GENERATORS = {"bash": _bash, "zsh": _zsh, "fish": _fish}
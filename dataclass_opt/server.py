@@ -0,0 +1,272 @@
+"""A resident server which parses and runs commands for short-lived clients.
+
+Starting the interpreter, importing the command modules and building the parser can take much
+longer than a short command itself.  `serve` does all of that once, and then runs a command for
+every client which connects to its Unix domain socket; the client, `_client.py`, imports only a
+few standard library modules.
+
+    python -m dataclass_opt serve package.module:parser --socket /tmp/tool.sock
+    python -I .../dataclass_opt/_client.py /tmp/tool.sock ARGS...
+
+Each client is served by a process forked from the server, which already holds the built parser
+and the imported command modules.  It takes over the client's standard input, output and error
+(passed over the socket), working directory, environment and arguments, runs the command with
+`DataClassParser.run`, and sends back its exit status.  Clients are served in parallel, and
+cannot affect each other or the server.
+
+Before forking, the server checks whether the source files of the parser's module and of its
+dataclasses have changed; if so, it reloads those modules and builds the parser again.
+"""
+
+import importlib
+import os
+import signal
+import socket
+import sys
+import threading
+import traceback
+from dataclasses import fields, is_dataclass
+
+from . import DataClassParser, _nested_class, clear_plan_cache
+from ._client import receive_request, send_status
+from ._plugins import _module_fingerprint
+
+# How often, in seconds, the server reaps the processes of finished clients when idle
+_REAP_INTERVAL = 1.0
+
+
+def serve(target, path, load=None):
+    """Serve the parser named by "module:attribute" on the Unix domain socket `path`.
+
+    `load(target)` returns the parser; by default, the attribute may be a DataClassParser, a
+    dataclass, or a function returning a parser.  Runs until the server is interrupted or
+    terminated.
+    """
+    ParserServer(target, path, load).serve_forever()
+
+
+def _load_target(target):
+    module_name, _, attr = target.partition(":")
+    obj = importlib.import_module(module_name)
+    for part in attr.split(".") if attr else ():
+        obj = getattr(obj, part)
+
+    if is_dataclass(obj) and isinstance(obj, type):
+        return DataClassParser(obj)
+    if callable(obj) and not isinstance(obj, DataClassParser):
+        return obj()
+    return obj
+
+
+class ParserServer:
+    """Serves one parser; see the module documentation."""
+
+    def __init__(self, target, path, load=None):
+        self.target = target
+        self.path = path
+        self._load = _load_target if load is None else load
+        self.parser = None
+        self._fingerprints = {}
+        self._children = set()
+
+    def load(self):
+        """Build the parser and all of its commands, and record the modules they come from."""
+        parser = self._load(self.target)
+        modules = {self.target.partition(":")[0]}
+        _preload(parser, modules)
+        self.parser = parser
+        self._fingerprints = {name: _module_fingerprint(name) for name in modules}
+
+    def changed_modules(self):
+        """Return the names of the watched modules whose source files have changed."""
+        return [
+            name
+            for name, fingerprint in self._fingerprints.items()
+            if _module_fingerprint(name) != fingerprint
+        ]
+
+    def refresh(self):
+        """Reload changed modules and rebuild the parser; returns True if it was rebuilt."""
+        changed = self.changed_modules()
+        if not changed:
+            return False
+
+        target_module = self.target.partition(":")[0]
+        try:
+            # The parser's module last, so that it picks up the reloaded dataclasses
+            for name in sorted(changed, key=lambda name: name == target_module):
+                if name in sys.modules:
+                    importlib.reload(sys.modules[name])
+            if target_module not in changed:
+                importlib.reload(sys.modules[target_module])
+            clear_plan_cache()
+            self.load()
+        except Exception:
+            # Keep serving the old parser; the reload is tried again for the next client
+            traceback.print_exc()
+            return False
+        return True
+
+    def serve_forever(self):
+        if self.parser is None:
+            self.load()
+
+        listener = _listen(self.path)
+        previous = signal.signal(signal.SIGTERM, _terminate)
+        try:
+            listener.settimeout(_REAP_INTERVAL)
+            while True:
+                self._reap()
+                try:
+                    conn, _ = listener.accept()
+                except socket.timeout:
+                    continue
+                conn.settimeout(None)
+                self.refresh()
+                self._fork(listener, conn)
+        finally:
+            signal.signal(signal.SIGTERM, previous)
+            listener.close()
+            try:
+                os.unlink(self.path)
+            except OSError:
+                pass
+
+    def _fork(self, listener, conn):
+        pid = os.fork()
+        if pid:
+            self._children.add(pid)
+            conn.close()
+            return
+
+        # In the child
+        status = 1
+        try:
+            listener.close()
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.default_int_handler)
+            status = _handle(self.parser, conn)
+        finally:
+            os._exit(status)
+
+    def _reap(self):
+        for pid in list(self._children):
+            try:
+                done, _ = os.waitpid(pid, os.WNOHANG)
+            except ChildProcessError:
+                done = pid
+            if done:
+                self._children.discard(pid)
+
+
+def _terminate(signum, frame):
+    sys.exit(128 + signum)
+
+
+def _listen(path):
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        listener.bind(path)
+    except OSError:
+        # A socket left behind by a server which is no longer running can be replaced
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(path)
+        except OSError:
+            os.unlink(path)
+            listener.bind(path)
+        else:
+            listener.close()
+            raise OSError("a server is already listening on {}".format(path))
+        finally:
+            probe.close()
+    listener.listen(socket.SOMAXCONN)
+    return listener
+
+
+def _preload(parser, modules):
+    """Build the lazy commands of `parser`, and add the modules of its dataclasses to `modules`."""
+    for key in ("cls", "cmd_cls"):
+        cls = parser._defaults.get(key)
+        if is_dataclass(cls):
+            _add_modules(cls, modules)
+
+    if parser.subparsers is not None:
+        for name in list(parser.subparsers.choices):
+            _preload(parser.subparsers.choices[name], modules)
+
+
+def _add_modules(cls, modules):
+    for klass in cls.__mro__:
+        if is_dataclass(klass) and klass.__module__ in sys.modules:
+            modules.add(klass.__module__)
+    for dc_field in fields(cls):
+        nested_cls = _nested_class(cls, dc_field)
+        if nested_cls is not None:
+            _add_modules(nested_cls, modules)
+
+
+def _handle(parser, conn):
+    """Run the command for the client on `conn`, and return the status for the process."""
+    request, fds = receive_request(conn)
+    for target, fd in enumerate(fds[:3]):
+        os.dup2(fd, target)
+    for fd in fds:
+        os.close(fd)
+    _reopen_stdio()
+
+    os.chdir(request["cwd"])
+    os.environ.clear()
+    os.environ.update(request["env"])
+    sys.argv = [parser.prog] + request["argv"]
+
+    threading.Thread(target=_watch_client, args=(conn,), daemon=True).start()
+    try:
+        status = _exit_status(parser.run(request["argv"]))
+    except SystemExit as e:
+        status = _exit_status(e.code, exiting=True)
+    except KeyboardInterrupt:
+        status = 130
+    except BaseException:
+        traceback.print_exc()
+        status = 1
+
+    for stream in (sys.stdout, sys.stderr):
+        try:
+            stream.flush()
+        except OSError:
+            pass
+    try:
+        send_status(conn, status)
+    except OSError:
+        pass
+    return 0
+
+
+def _reopen_stdio():
+    """Point sys.stdin, sys.stdout and sys.stderr at the client's file descriptors."""
+    sys.stdin = open(0, "r", closefd=False)
+    sys.stdout = open(1, "w", buffering=1 if os.isatty(1) else -1, closefd=False)
+    sys.stderr = open(2, "w", buffering=1, errors="backslashreplace", closefd=False)
+
+
+def _watch_client(conn):
+    """Interrupt the command if the client goes away, e.g. because it was interrupted."""
+    try:
+        conn.recv(1)
+    except OSError:
+        pass
+    os.kill(os.getpid(), signal.SIGINT)
+
+
+def _exit_status(code, exiting=False):
+    """Return the status for the result of a command, or the code of `SystemExit`."""
+    if code is None:
+        return 0
+    if isinstance(code, int) and not isinstance(code, bool):
+        return code
+    if exiting:
+        # As sys.exit() does
+        print(code, file=sys.stderr)
+        return 1
+    return 0
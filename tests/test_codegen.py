@@ -0,0 +1,415 @@
+import io
+import subprocess
+import sys
+from contextlib import redirect_stderr, redirect_stdout
+from dataclasses import dataclass, fields, is_dataclass
+from pathlib import Path
+from typing import Callable, List, Optional, TextIO
+
+from pytest import mark, raises, skip
+
+import test_dataclass_opt
+from dataclass_opt import DataClassParser, FileType, UnsupportedException, arg, opt, to_argv
+from dataclass_opt.codegen import generate_parser_module
+
+
+@dataclass
+class Required:
+    string: str
+    integer: int
+
+
+@dataclass
+class Optionals:
+    bar: str
+    foo: str = opt()
+    name: Optional[str] = opt(short=None)
+    count: int = opt(default=10)
+    ratio: float = opt(default="0.5")
+
+
+@dataclass
+class Actions:
+    flag: bool = opt(short=None)
+    no_flag: bool = opt(short=None, action="store_false")
+    const: Optional[int] = opt(action="store_const", const=42)
+    verbose: int = opt(action="count", default=0)
+    append: List[int] = opt(action="append", short=None, default_factory=list)
+
+
+@dataclass
+class Nargs:
+    foo: List[str] = opt(nargs=2)
+    bar: List[str] = arg(nargs=1)
+    baz: List[str] = opt(nargs="*", default_factory=list)
+    qux: str = opt(nargs="?", const="c", default="d")
+
+
+@dataclass
+class Choices:
+    move: str = arg(choices=["rock", "paper", "scissors"])
+    door: int = arg(choices=range(1, 4))
+    accumulate: Callable = opt("--sum", action="store_const", const=sum, default=max)
+
+
+@dataclass
+class Files:
+    infile: TextIO = arg(nargs="?", type=FileType("r"), default=sys.stdin)
+
+
+@dataclass
+class Top:
+    foo: bool = opt()
+
+
+@dataclass
+class A:
+    bar: int
+
+
+@dataclass
+class B:
+    baz: Optional[str] = opt()
+
+
+def run_command(args):
+    return args
+
+
+def subparsers():
+    return DataClassParser(Top, commands=[A, B])
+
+
+def command_func():
+    parser = DataClassParser()
+    parser.add_command("a", A, help="the A command", func=run_command)
+    return parser
+
+
+def extra_args():
+    parser = DataClassParser(commands=[A, B], lazy_commands=True, version="1.0")
+    parser.add_argument("--foo", action="store_true")
+    return parser
+
+
+CASES = [
+    (lambda: DataClassParser(Required), [["abc", "10"], ["abc"], ["abc", "x"]]),
+    (
+        lambda: DataClassParser(Optionals),
+        [["BAR", "--foo", "FOO"], ["BAR", "-f", "F", "-c", "3", "--name", "n"], ["BAR"], []],
+    ),
+    (
+        lambda: DataClassParser(Actions),
+        [[], ["--flag", "--no-flag", "-c", "-vvv", "--append", "1", "--append", "2"]],
+    ),
+    (lambda: DataClassParser(Nargs), [["c", "--foo", "a", "b"], ["c", "--foo", "a", "--qux"]]),
+    (lambda: DataClassParser(Choices), [["rock", "3"], ["fire", "3"], ["--sum", "paper", "1"]]),
+    (lambda: DataClassParser(Files), [[]]),
+    (subparsers, [["a", "12"], ["--foo", "b", "--baz", "Z"], ["c"], []]),
+    (command_func, [["a", "12"], ["a"]]),
+    (extra_args, [["a", "12"], ["--foo", "b", "--baz", "Z"], ["--version"], ["--help"]]),
+]
+
+
+def load_generated(parser):
+    source = generate_parser_module(parser)
+    namespace = {}
+    exec(compile(source, "<generated>", "exec"), namespace)
+    return namespace["build_parser"]()
+
+
+def normalize(result):
+    if isinstance(result, tuple):
+        return tuple(normalize(item) for item in result)
+    if is_dataclass(result):
+        return type(result).__name__, {f.name: getattr(result, f.name) for f in fields(result)}
+    return result
+
+
+def outcome(parser, argv):
+    stdout, stderr = io.StringIO(), io.StringIO()
+    with redirect_stdout(stdout), redirect_stderr(stderr):
+        try:
+            result = ("result", normalize(parser.parse_args(argv)))
+        except SystemExit as e:
+            result = ("exit", e.code)
+    return result, stdout.getvalue(), stderr.getvalue()
+
+
+@mark.parametrize("make_parser,argvs", CASES)
+def test_generated_parser_matches(make_parser, argvs):
+    dynamic = make_parser()
+    generated = load_generated(make_parser())
+
+    for argv in argvs:
+        assert outcome(generated, argv) == outcome(dynamic, argv)
+
+
+# The dataclasses of the original tests in test_dataclass_opt, which are defined inside the test
+# functions, where the generated module could not import them
+
+
+@dataclass
+class NoFields:
+    pass
+
+
+@dataclass
+class OptionalArgs:
+    string: str = "abc"
+    integer: int = 10
+
+
+@dataclass
+class NoShort:
+    foo: str = opt(short=None)
+
+
+@dataclass
+class NoLong:
+    foo: str = opt(long=None)
+
+
+@dataclass
+class StoreConst:
+    foo: Optional[int] = opt(action="store_const", const=42)
+
+
+@dataclass
+class StoreConstDefault:
+    foo: int = opt(action="store_const", const=42, default=41)
+
+
+@dataclass
+class StoreTrueFalse:
+    foo: bool = opt(short=None)
+    bar: bool = opt(short=None, action="store_false")
+    baz: bool = opt(short=None, action="store_false")
+
+
+@dataclass
+class AppendStr:
+    foo: List[str] = opt(action="append")
+
+
+@dataclass
+class AppendInt:
+    foo: List[int] = opt(action="append")
+
+
+@dataclass
+class Count:
+    verbose: int = opt(action="count", default=0)
+
+
+@dataclass
+class NargsOptional:
+    foo: str = opt(nargs="?", const="c", default="d")
+    bar: str = arg(nargs="?", default="d")
+
+
+@dataclass
+class NargsStar:
+    foo: List[str] = opt(nargs="*")
+    bar: List[str] = opt(nargs="*")
+    baz: List[str] = arg(nargs="*")
+
+
+@dataclass
+class NargsPlus:
+    foo: List[str] = arg(nargs="+")
+    bar: List[str] = opt(nargs="+")
+
+
+@dataclass
+class Default:
+    foo: int = opt(default=42)
+
+
+@dataclass
+class DefaultConversions:
+    length: int = opt(default="10")
+    width: int = opt(default=10.5)
+
+
+@dataclass
+class Types:
+    # The file fields of the original are left out, as open files do not compare equal
+    count: int
+    distance: float
+    street: str = arg(type=ascii)
+    code_point: int = arg(type=ord)
+    datapath: Path
+
+
+@dataclass
+class RequiredOpt:
+    foo: str = opt()
+
+
+@dataclass
+class Dest:
+    integers: List[int] = arg(metavar="int", nargs="+", help="Any integer")
+    accumulate: Callable = opt(
+        "--sum",
+        action="store_const",
+        const=sum,
+        default=max,
+        help="sum the integers (default: find the max)",
+    )
+
+
+@dataclass
+class OptionValues:
+    x: bool = opt()
+    y: bool = opt()
+    z: str = opt()
+
+
+@dataclass
+class InvalidArgs:
+    foo: int = opt()
+    bar: Optional[str] = arg(nargs="?")
+
+
+def commands_with_option():
+    parser = DataClassParser(commands=[A, B])
+    parser.add_argument("--foo", action="store_true")
+    return parser
+
+
+BASELINE_CASES = [
+    (lambda: DataClassParser(NoFields), [[], ["--name", "Jim"]]),
+    (lambda: DataClassParser(OptionalArgs), [[], ["foo"]]),
+    (lambda: DataClassParser(NoShort), [["--foo", "FOO"], ["-f", "FOO"]]),
+    (lambda: DataClassParser(NoLong), [["-f", "FOO"], ["--foo", "FOO"]]),
+    (lambda: DataClassParser(StoreConst), [["--foo"], ["-f"], []]),
+    (lambda: DataClassParser(StoreConstDefault), [["--foo"], ["-f"], []]),
+    (lambda: DataClassParser(StoreTrueFalse), [["--foo", "--bar"]]),
+    (lambda: DataClassParser(AppendStr), [["--foo", "1", "--foo", "2"]]),
+    (lambda: DataClassParser(AppendInt), [["--foo", "1", "--foo", "2"]]),
+    (lambda: DataClassParser(Count), [["-vvv"], []]),
+    (lambda: DataClassParser(NoFields, version="1.0"), [["--version"]]),
+    (lambda: DataClassParser(NargsOptional), [["XX", "--foo", "YY"], ["XX", "--foo"], []]),
+    (lambda: DataClassParser(NargsStar), [["a", "b", "--foo", "x", "y", "--bar", "1", "2"]]),
+    (lambda: DataClassParser(NargsPlus), [["a", "b", "c", "--bar", "dee", "eee"], []]),
+    (lambda: DataClassParser(Default), [["--foo", "2"], []]),
+    (lambda: DataClassParser(DefaultConversions), [[]]),
+    (lambda: DataClassParser(Types), [["42", "6.28", "Main St.", "\u00e5", "/tmp"], ["x"]]),
+    (lambda: DataClassParser(Choices), [["rock", "4"], ["paper", "2"]]),
+    (lambda: DataClassParser(RequiredOpt), [["--foo", "BAR"], []]),
+    (lambda: DataClassParser(Dest), [["2", "3", "4"], ["--sum", "2", "3", "4"], ["--help"]]),
+    (lambda: DataClassParser(OptionValues), [["-xyzZ"]]),
+    (
+        lambda: DataClassParser(InvalidArgs),
+        [["--foo", "spam"], ["--bar"], ["spam", "badger"], ["--foo", "1", "spam"]],
+    ),
+    (commands_with_option, [["a", "12"], ["--foo", "b", "--baz", "Z"]]),
+    (lambda: DataClassParser(commands=[A, B]), [["a", "12"], ["b", "--baz", "Z"]]),
+]
+
+if sys.version_info >= (3, 9):
+    from dataclass_opt import BooleanOptionalAction
+
+    @dataclass
+    class BooleanOptional:
+        foo: Optional[bool] = opt(action=BooleanOptionalAction)
+
+    BASELINE_CASES.append((lambda: DataClassParser(BooleanOptional), [["--foo"], ["--no-foo"], []]))
+
+
+@mark.parametrize("make_parser,argvs", BASELINE_CASES)
+def test_generated_parser_matches_baseline(make_parser, argvs):
+    dynamic = make_parser()
+    generated = load_generated(make_parser())
+
+    for argv in argvs:
+        assert outcome(generated, argv) == outcome(dynamic, argv)
+
+
+# The module-level dataclasses of the main test suite, which later tests added
+SUITE_DATACLASSES = sorted(
+    {
+        value
+        for value in vars(test_dataclass_opt).values()
+        if isinstance(value, type)
+        and is_dataclass(value)
+        and value.__module__ == test_dataclass_opt.__name__
+    },
+    key=lambda cls: cls.__qualname__,
+)
+
+
+@mark.parametrize("cls", SUITE_DATACLASSES, ids=lambda cls: cls.__qualname__)
+def test_generated_parser_matches_suite(cls):
+    try:
+        generated = load_generated(DataClassParser(cls))
+    except UnsupportedException as e:
+        skip(str(e))
+    dynamic = DataClassParser(cls)
+
+    argvs = [[], ["--help"], ["--no-such-option"]]
+    result = outcome(dynamic, [])[0]
+    if result[0] == "result":
+        argvs.append(to_argv(dynamic.parse_args([])))
+    for argv in argvs:
+        assert outcome(generated, argv) == outcome(dynamic, argv)
+
+
+def test_unsupported_container():
+    with raises(UnsupportedException, match="container="):
+        generate_parser_module(DataClassParser(test_dataclass_opt.Vectors))
+
+
+def test_unsupported_config_files(tmp_path):
+    config_file = tmp_path / "config.json"
+    config_file.write_text('{"count": 5}')
+    parser = DataClassParser(test_dataclass_opt.Configured, config_files=[config_file])
+    with raises(UnsupportedException, match="config files"):
+        generate_parser_module(parser)
+
+
+def test_unsupported_compact():
+    for kind in ("slots", "frozen", "tuple"):
+        with raises(UnsupportedException, match="compact"):
+            generate_parser_module(DataClassParser(test_dataclass_opt.Configured, compact=kind))
+
+
+def test_generated_module_has_no_introspection():
+    source = generate_parser_module(subparsers())
+    assert "dataclass_opt" not in source.split('"""', 2)[2]
+    assert "fields(" not in source
+    assert "add_argument('--foo', '-f', action='store_true', dest='foo')" in source
+
+
+def test_unsupported_value():
+    @dataclass
+    class Local:
+        foo: int = opt()
+
+    with raises(UnsupportedException):
+        generate_parser_module(DataClassParser(Local))
+
+
+def test_generate_command(tmp_path):
+    output = tmp_path / "generated_parser.py"
+    subprocess.run(
+        [
+            sys.executable,
+            "-m",
+            "dataclass_opt",
+            "generate",
+            "test_codegen:subparsers",
+            "-o",
+            output,
+        ],
+        check=True,
+        cwd=str(tmp_path.parent),
+        env={"PYTHONPATH": ":".join(sys.path)},
+    )
+
+    namespace = {}
+    exec(output.read_text(), namespace)
+    assert normalize(namespace["parse_args"](["a", "12"])) == normalize(
+        (Top(False), A(12))
+    )
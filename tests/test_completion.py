@@ -0,0 +1,114 @@
+import subprocess
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional
+
+from pytest import mark, raises
+
+from dataclass_opt import DataClassParser, UnsupportedException, arg, opt
+from dataclass_opt.completion import generate_completion, write_completion
+
+
+@dataclass
+class Top:
+    colour: str = opt(default="red", choices=["red", "green"], help="text colour")
+    verbose: bool = opt(default=False)
+
+
+@dataclass
+class Fetch:
+    source: str = arg(choices=["origin", "upstream"])
+    output: Optional[Path] = opt(default=None)
+    depth: int = opt(default=1, help="fetch depth (default: %(default)s)")
+
+
+@dataclass
+class Push:
+    force: bool = opt(default=False)
+
+
+@dataclass
+class Quoted:
+    answer: str = opt(default="y z", choices=["y z", "it's", "yes"])
+
+
+def make_parser():
+    parser = DataClassParser(Top, prog="tool")
+    parser.add_command("fetch", Fetch, help="download objects")
+    parser.add_command("push", Push)
+    return parser
+
+
+def bash_complete(script, *words):
+    """Source a bash completion script, and return the completions for `words`."""
+    code = "{}\nCOMP_WORDS=(tool {})\nCOMP_CWORD={}\n_dataclass_opt_tool\n".format(
+        script, " ".join("'{}'".format(word) for word in words), len(words)
+    )
+    code += 'printf "%s\\n" "${COMPREPLY[@]}"\n'
+    result = subprocess.run(["bash", "-c", code], capture_output=True, text=True, check=True)
+    return result.stdout.splitlines()
+
+
+@mark.skipif(subprocess.run(["which", "bash"], capture_output=True).returncode, reason="no bash")
+def test_bash_completion():
+    script = generate_completion(make_parser(), "bash")
+
+    assert bash_complete(script, "") == [
+        "-h",
+        "--help",
+        "--colour",
+        "-c",
+        "--verbose",
+        "-v",
+        "fetch",
+        "push",
+    ]
+    assert bash_complete(script, "--c") == ["--colour"]
+    assert bash_complete(script, "--colour", "") == ["red", "green"]
+    assert bash_complete(script, "-v", "fetch", "") == [
+        "-h",
+        "--help",
+        "--output",
+        "-o",
+        "--depth",
+        "-d",
+        "origin",
+        "upstream",
+    ]
+    assert bash_complete(script, "push", "--f") == ["--force"]
+
+    # Choices with spaces and quotes are completed whole, escaped for the command line
+    script = generate_completion(DataClassParser(Quoted, prog="tool"), "bash")
+    assert bash_complete(script, "--answer", "") == ["y\\ z", "it\\'s", "yes"]
+    assert bash_complete(script, "--answer", "y") == ["y\\ z", "yes"]
+
+
+def test_other_shells():
+    parser = make_parser()
+
+    zsh = generate_completion(parser, "zsh")
+    assert "bashcompinit" in zsh and "complete -o default -F _dataclass_opt_tool tool" in zsh
+
+    fish = generate_completion(parser, "fish")
+    assert "complete -c tool -n 'not __fish_seen_subcommand_from fetch push' -f -a fetch " in fish
+    assert "-l colour -s c -r -f -a 'red green' -d 'text colour'" in fish
+    assert "-n '__fish_seen_subcommand_from fetch' -l output -s o -r -F" in fish
+    assert "-d 'fetch depth (default: 1)'" in fish
+
+    fish = generate_completion(DataClassParser(Quoted, prog="tool"), "fish")
+    assert "-f -a '\\'y z\\' \\'it\\\\\\'s\\' yes'" in fish
+
+    with raises(UnsupportedException):
+        generate_completion(parser, "tcsh")
+
+
+def test_write_completion(tmp_path):
+    path = tmp_path / "tool.bash"
+
+    assert write_completion(make_parser(), "bash", path)
+    assert not write_completion(make_parser(), "bash", path)
+
+    parser = make_parser()
+    parser.add_command("pull", Push)
+    assert write_completion(parser, "bash", path)
+    assert "pull" in path.read_text()
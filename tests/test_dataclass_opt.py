@@ -1,18 +1,31 @@
+import argparse
+import functools
+import io
+import pickle
 import sys
 import tempfile
-from dataclasses import dataclass
+from array import array
+from dataclasses import FrozenInstanceError, dataclass, field, replace
 from pathlib import Path
 from typing import Callable, List, Optional, TextIO
+from unittest.mock import patch
 
 from pytest import raises
 
+import dataclass_opt
 from dataclass_opt import (
     SUPPRESS,
+    ArgumentParser,
+    ConfigFileError,
     DataClassParser,
     FileType,
     Namespace,
+    ParseError,
+    ParserStats,
     UnsupportedException,
+    _config,
     arg,
+    clear_plan_cache,
     opt,
 )
 
@@ -583,3 +596,1163 @@ def test_subparsers3():
 
     args = parser.parse_args("b --baz Z".split())
     assert args == B("Z")
+
+
+def test_plan_cache():
+    @dataclass
+    class Test:
+        foo: List[str] = opt(default_factory=list)
+
+    clear_plan_cache()
+    parser1 = DataClassParser(Test)
+    parser2 = DataClassParser(Test)
+
+    assert dataclass_opt._get_plan(Test) is dataclass_opt._get_plan(Test)
+
+    # default_factory is still called for every parser
+    args1 = parser1.parse_args([])
+    args2 = parser2.parse_args([])
+    assert args1 == args2 == Test([])
+    assert args1.foo is not args2.foo
+
+
+def test_clear_plan_cache():
+    @dataclass
+    class Test:
+        foo: int = opt(default=1)
+
+    plan = dataclass_opt._get_plan(Test)
+    clear_plan_cache(Test)
+    assert dataclass_opt._get_plan(Test) is not plan
+
+    clear_plan_cache()
+    assert not dataclass_opt._get_plan.data
+
+
+def test_lazy_commands(capsys):
+    built = []
+
+    def make_list():
+        built.append(True)
+        return []
+
+    @dataclass
+    class A:
+        bar: int
+
+    @dataclass
+    class B:
+        baz: List[str] = opt(default_factory=make_list)
+
+    parser = DataClassParser(commands=[A, B], lazy_commands=True)
+    assert parser.parse_args("a 12".split()) == A(12)
+    assert not built
+
+    assert parser.parse_args("b --baz Z".split()) == B(["Z"])
+    assert built
+
+    with raises(SystemExit):
+        parser.parse_args(["c"])
+
+    with raises(SystemExit):
+        parser.parse_args(["--help"])
+    assert "{a,b}" in capsys.readouterr().out
+
+
+def test_lazy_add_command():
+    @dataclass
+    class A:
+        bar: int
+
+    parser = DataClassParser()
+    assert parser.add_command("a", A, help="Command A", lazy=True) is None
+    assert "Command A" in parser.format_help()
+
+    assert parser.parse_args("a 12".split()) == A(12)
+
+
+@dataclass
+class FastParse:
+    name: str = opt()
+    count: int = opt(default=1)
+    ratio: float = opt(default="0.5", short=None)
+    mode: str = opt(default="fast", choices=["fast", "slow"])
+    verbose: bool = opt(default=False)
+    quiet: bool = opt(action="store_false", default=True)
+    items: List[int] = opt(default_factory=list)
+    label: Optional[str] = opt(short=None, default=None)
+
+
+FAST_PARSE_ARGVS = [
+    ["--name", "x"],
+    ["-n", "x", "-c", "3", "--ratio", "2.5", "--mode=slow", "-v", "-q", "--items", "1", "2"],
+    ["--name=x", "--items", "1", "--items", "2", "3", "--label", ""],
+    ["--name", "x", "--name", "y", "--verbose", "--verbose"],
+    # Everything below falls back to argparse
+    [],
+    ["--name"],
+    ["--name", "x", "--count", "many"],
+    ["--name", "x", "--mode", "medium"],
+    ["--name", "x", "--items"],
+    ["--name", "x", "-vq"],
+    ["--name", "x", "--verbose=yes"],
+    ["--na", "x"],
+    ["--name", "x", "extra"],
+    ["--name", "-x"],
+    ["--name", "x", "--", "--count"],
+    ["--help"],
+    # Every occurrence of a repeated option is converted and checked
+    ["--name", "x", "--count", "many", "--count", "3"],
+    ["--name", "x", "--mode", "medium", "--mode", "slow"],
+    ["--name", "x", "--items", "a", "--items", "1"],
+]
+
+
+def parse_outcome(parser, argv, capsys):
+    try:
+        result = ("result", parser.parse_args(argv))
+    except SystemExit as e:
+        result = ("exit", e.code)
+    return result, capsys.readouterr()
+
+
+def test_fast_parse_matches_argparse(capsys):
+    fast = DataClassParser(FastParse)
+    slow = DataClassParser(FastParse, fast_parse=False)
+    assert fast._get_fast_table() is not None
+
+    for argv in FAST_PARSE_ARGVS:
+        assert parse_outcome(fast, argv, capsys) == parse_outcome(slow, argv, capsys)
+
+    # Options left out of the namespace get the dataclass's defaults
+    fast = DataClassParser(FastParse, argument_default=SUPPRESS)
+    slow = DataClassParser(FastParse, argument_default=SUPPRESS, fast_parse=False)
+    assert fast._get_fast_table() is not None
+    for argv in FAST_PARSE_ARGVS:
+        assert parse_outcome(fast, argv, capsys) == parse_outcome(slow, argv, capsys)
+    assert fast.parse_args(["--name", "x"]).verbose is False
+
+
+def test_fast_parse_bypasses_argparse():
+    parser = DataClassParser(FastParse)
+    with patch.object(ArgumentParser, "parse_known_args", side_effect=AssertionError):
+        assert parser.parse_args(["--name", "x", "--items", "1", "2"]) == FastParse(
+            "x", ratio=0.5, items=[1, 2]
+        )
+
+
+def test_fast_parse_not_eligible():
+    @dataclass
+    class Test:
+        foo: str
+        bar: int = opt(action="count", default=0)
+
+    parser = DataClassParser(Test)
+    assert parser._get_fast_table() is None
+    assert parser.parse_args(["a", "-bb"]) == Test("a", 2)
+
+    parser = DataClassParser(FastParse)
+    parser.add_argument("--extra")
+    assert parser._get_fast_table() is None
+
+
+def test_fast_parse_groups(capsys):
+    def with_group(fast_parse):
+        parser = DataClassParser(FastParse, fast_parse=fast_parse)
+        parser.add_argument_group("more").add_argument("--extra", default="e")
+        return parser
+
+    def with_exclusive(fast_parse):
+        parser = DataClassParser(FastParse, fast_parse=fast_parse)
+        group = parser.add_mutually_exclusive_group()
+        group._group_actions += [
+            action for action in parser._actions if action.dest in ("count", "mode")
+        ]
+        return parser
+
+    for make_parser in (with_group, with_exclusive):
+        assert make_parser(True)._get_fast_table() is None
+        for argv in (["--name", "x"], ["--name", "x", "--count", "2", "--mode", "slow"]):
+            fast = parse_outcome(make_parser(True), argv, capsys)
+            assert fast == parse_outcome(make_parser(False), argv, capsys)
+
+
+def test_parse_batch_columnar(capsys):
+    @dataclass
+    class Test:
+        name: str
+        count: int = opt(default=1)
+        ratio: float = opt(default=0.5)
+
+    parser = DataClassParser(Test)
+    columns = parser.parse_batch([["a", "-c", "2"], ["b", "-c", "x"], ["c", "-r", "2"], ["-h"]])
+
+    assert columns == {
+        "name": ["a", None, "c", None],
+        "count": [2, None, 1, None],
+        "ratio": [0.5, None, 2.0, None],
+        "error": [
+            None,
+            "argument --count/-c: invalid int value: 'x'",
+            None,
+            "exited with status 0",
+        ],
+    }
+    assert capsys.readouterr() == ("", "")
+
+
+def test_parse_batch_typed_arrays():
+    @dataclass
+    class Test:
+        name: str
+        count: int = opt(default=1)
+        ratio: float = opt(default=0.5)
+
+    parser = DataClassParser(Test)
+    columns = parser.parse_batch([["a", "-c", "2"], [], ["c", "-r", "2"]], typed_arrays=True)
+
+    assert columns["name"] == ["a", None, "c"]
+    assert columns["count"] == array("q", [2, 0, 1])
+    assert columns["ratio"][0] == 0.5 and columns["ratio"][2] == 2.0
+    assert columns["error"][1] == "the following arguments are required: name"
+
+
+def test_parse_batch_columns():
+    columns = dataclass_opt._Columns(typed_arrays=True)
+    error = ParseError("bad")
+    rows = [error, Namespace(a=1, b=1.5, c=1), Namespace(a=2, b=2, c=2**64), error]
+    rows += [Namespace(a=3, d=True)]
+    for row in rows:
+        columns.add(row)
+
+    assert columns.result("error") == {
+        "a": array("q", [0, 1, 2, 0, 3]),
+        "b": [None, 1.5, 2, None, None],
+        "c": [None, 1, 2**64, None, None],
+        "d": [None, None, None, None, True],
+        "error": ["bad", None, None, "bad", None],
+    }
+
+
+def test_parse_batch_chunks():
+    @dataclass
+    class A:
+        bar: int
+
+    @dataclass
+    class B:
+        baz: Optional[str] = opt()
+
+    parser = DataClassParser(commands=[A, B])
+    argvs = (argv for argv in [["a", "1"], ["b", "-b", "x"], ["c"], ["a", "4"], ["b"]])
+    chunks = parser.parse_batch(argvs, columnar=False, chunk_size=2)
+
+    first, second, third = list(chunks)
+    assert first == [A(1), B("x")]
+    assert isinstance(second[0], ParseError) and second[0].argv == ["c"]
+    assert second[1] == A(4)
+    assert third == [B(None)]
+
+    with raises(SystemExit):
+        parser.parse_args(["c"])
+
+
+def test_converter():
+    @dataclass
+    class Test:
+        foo: int = opt(default=1)
+        bar: str = opt(default="x", suppress=True)
+
+    converter = dataclass_opt._get_converter(Test)
+    assert converter.names == {"foo", "bar", "cls", "cmd_cls"}
+    assert converter.build({"foo": 2, "cls": Test, "other": 3}) == Test(2)
+    assert converter.build({"foo": 2, "bar": "y"}) == Test(2, "y")
+
+    parser = DataClassParser(Test, fast_parse=False)
+    assert parser.parse_args(["--foo", "3"]) == Test(3)
+    assert parser.parse_args([]) == Test(1)
+
+
+def test_converter_missing_attributes():
+    @dataclass
+    class Test:
+        foo: int = opt(default=1)
+        bar: bool = opt(default=False)
+
+    # Flags get argparse's argument_default, so are left out of the namespace when not given
+    parser = DataClassParser(Test, argument_default=SUPPRESS)
+    parser.add_argument("--baz")
+
+    assert parser.parse_args([]) == (Test(1, False), Namespace())
+    assert parser.parse_args(["--bar", "--baz", "z"]) == (Test(1, True), Namespace(baz="z"))
+
+
+@dataclass
+class Configured:
+    name: str = opt()
+    count: int = opt(default=1)
+    tags: List[str] = opt(default_factory=list)
+    verbose: bool = opt(default=False)
+    label: str = opt(default="x", type=ascii)
+
+
+@dataclass
+class ConfiguredCommand:
+    path: str
+    retries: int = opt(default=0)
+
+
+def test_config_files(tmp_path):
+    toml_file = tmp_path / "config.toml"
+    toml_file.write_text('name = "toml"\ncount = 2\ntags = ["a", "b"]\n')
+    json_file = tmp_path / "config.json"
+    json_file.write_text('{"count": "3", "verbose": true, "label": "y"}')
+    missing = tmp_path / "missing.ini"
+
+    parser = DataClassParser(Configured, config_files=[toml_file, json_file, missing])
+
+    # defaults < files < argv
+    assert parser.parse_args([]) == Configured("toml", 3, ["a", "b"], True, "'y'")
+    assert parser.parse_args(["-n", "argv", "-c", "4"]) == Configured(
+        "argv", 4, ["a", "b"], True, "'y'"
+    )
+    assert parser.parse_args(["--label", "z"]).label == "'z'"
+
+
+def test_config_file_commands(tmp_path):
+    ini_file = tmp_path / "config.ini"
+    ini_file.write_text(
+        "[DEFAULT]\nname = ini\ntags = a 'b c'\nverbose = yes\n\n"
+        "[configured-command]\npath = /tmp\nretries = 5\n"
+    )
+
+    parser = DataClassParser(Configured, commands=[ConfiguredCommand], config_files=[ini_file])
+    assert parser.parse_args(["configured-command"]) == (
+        Configured("ini", 1, ["a", "b c"], True, "'x'"),
+        ConfiguredCommand("/tmp", 5),
+    )
+    assert parser.parse_args(["configured-command", "/var", "-r", "1"])[1] == ConfiguredCommand(
+        "/var", 1
+    )
+
+
+def test_config_file_errors(tmp_path):
+    config_file = tmp_path / "config.json"
+
+    config_file.write_text('{"colour": "red"}')
+    with raises(ConfigFileError, match="unknown option 'colour'"):
+        DataClassParser(Configured, config_files=[config_file])
+
+    config_file.write_text('{"count": "many"}')
+    with raises(ConfigFileError, match="invalid value for 'count'"):
+        DataClassParser(Configured, config_files=[config_file])
+
+    for value in ("true", "2.5", '["1"]', '{"a": 1}'):
+        config_file.write_text('{"count": %s}' % value)
+        with raises(ConfigFileError, match="invalid value for 'count'"):
+            DataClassParser(Configured, config_files=[config_file])
+
+
+def test_config_file_types(tmp_path):
+    @dataclass
+    class Test:
+        name: str = opt(default="")
+        ratio: float = opt(default=0.5)
+        tags: List[str] = opt(default_factory=list)
+
+    config_file = tmp_path / "config.toml"
+    config_file.write_text("name = 5\nratio = 2\ntags = [1, true]\n")
+    args = DataClassParser(Test, config_files=[config_file]).parse_args([])
+    assert args == Test("5", 2.0, ["1", "true"])
+    assert type(args.ratio) is float
+
+
+def test_config_file_cache(tmp_path):
+    config_file = tmp_path / "config.json"
+    config_file.write_text('{"name": "a", "count": 2}')
+
+    with patch.object(_config, "_parse_file", wraps=_config._parse_file) as parse_file:
+        assert DataClassParser(Configured, config_files=[config_file]).parse_args([]).count == 2
+        assert DataClassParser(Configured, config_files=[config_file]).parse_args([]).count == 2
+        assert parse_file.call_count == 1
+
+        config_file.write_text('{"name": "a", "count": 30}')
+        assert DataClassParser(Configured, config_files=[config_file]).parse_args([]).count == 30
+        assert parse_file.call_count == 2
+
+
+@dataclass
+class FromEnv:
+    name: str = opt()
+    count: int = opt(default=1)
+    tags: List[str] = opt(default_factory=list)
+    verbose: bool = opt(default=False)
+    token: Optional[str] = opt("--token", "-k", default=None, env="API_TOKEN")
+
+
+def test_env_vars(monkeypatch):
+    parser = DataClassParser(FromEnv, env_prefix="TOOL_")
+
+    with raises(SystemExit):
+        parser.parse_args([])
+
+    monkeypatch.setenv("TOOL_NAME", "env")
+    monkeypatch.setenv("TOOL_COUNT", "2")
+    monkeypatch.setenv("TOOL_TAGS", "a 'b c'")
+    monkeypatch.setenv("TOOL_VERBOSE", "yes")
+    monkeypatch.setenv("API_TOKEN", "secret")
+
+    # defaults < environment < argv, on both the fast and argparse paths
+    for fast_parse in (True, False):
+        parser = DataClassParser(FromEnv, env_prefix="TOOL_", fast_parse=fast_parse)
+        assert parser.parse_args([]) == FromEnv("env", 2, ["a", "b c"], True, "secret")
+        assert parser.parse_args(["-n", "argv", "-t", "x"]) == FromEnv(
+            "argv", 2, ["x"], True, "secret"
+        )
+
+    monkeypatch.setenv("TOOL_COUNT", "many")
+    for fast_parse in (True, False):
+        parser = DataClassParser(FromEnv, env_prefix="TOOL_", fast_parse=fast_parse)
+        with raises(SystemExit):
+            parser.parse_args([])
+        # A bad variable is only an error if the command line does not override it
+        assert parser.parse_args(["-c", "3"]).count == 3
+
+
+def test_env_var_commands(monkeypatch):
+    parser = DataClassParser(env_prefix="TOOL_")
+    parser.add_command("configured-command", ConfiguredCommand)
+
+    monkeypatch.setenv("TOOL_CONFIGURED_COMMAND_PATH", "/env")
+    monkeypatch.setenv("TOOL_CONFIGURED_COMMAND_RETRIES", "3")
+    assert parser.parse_args(["configured-command"]) == ConfiguredCommand("/env", 3)
+    assert parser.parse_args(["configured-command", "/argv"]) == ConfiguredCommand("/argv", 3)
+
+
+@dataclass
+class FromFile:
+    paths: List[str] = opt()
+    sizes: List[int] = opt(default_factory=list, file_view=True)
+    name: str = opt(default="")
+
+
+def test_fromfile(tmp_path):
+    paths_file = tmp_path / "paths.txt"
+    paths_file.write_text("a\nb c\n\nd\n")
+    sizes_file = tmp_path / "sizes.txt"
+    sizes_file.write_text("1\r\n2\r\n3")
+    options_file = tmp_path / "options.txt"
+    options_file.write_text("--name\nfile\n-p\nx\n")
+
+    parser = DataClassParser(FromFile, fromfile_prefix_chars="@")
+    stock = ArgumentParser(fromfile_prefix_chars="@")
+    stock.add_argument("-p", "--paths", nargs="+")
+    stock.add_argument("-s", "--sizes", nargs="+", type=int, default=[])
+    stock.add_argument("-n", "--name", default="")
+
+    for argv in (
+        ["-p", "@" + str(paths_file)],
+        ["-p", "z", "@" + str(paths_file), "y"],
+        ["@" + str(options_file)],
+        ["@" + str(options_file), "-n", "argv"],
+    ):
+        assert vars(parser.parse_args(argv)) == vars(stock.parse_args(argv))
+
+    args = parser.parse_args(["-p", "x", "-s", "@" + str(sizes_file)])
+    assert isinstance(args.sizes, dataclass_opt.MappedTokens)
+    assert list(args.sizes) == [1, 2, 3]
+    assert len(args.sizes) == 3
+    assert args.sizes[-1] == 3
+    assert args.sizes[:2] == [1, 2]
+
+    with raises(SystemExit):
+        parser.parse_args(["-p", "x", "-n", "@" + str(paths_file)])
+    with raises(SystemExit):
+        parser.parse_args(["-p", "x", "-s", "@" + str(paths_file)])
+
+
+@dataclass
+class Copy:
+    src: str = arg()
+    dst: str = arg()
+    mode: str = opt(default="")
+
+
+def test_fromfile_expanded(tmp_path):
+    two_file = tmp_path / "two.txt"
+    two_file.write_text("a\nb\n")
+    breaks_file = tmp_path / "breaks.txt"
+    breaks_file.write_text("a\rb\x0cc\n")
+
+    parser = DataClassParser(FromFile, fromfile_prefix_chars="@")
+    copy_parser = DataClassParser(Copy, fromfile_prefix_chars="@")
+    stock = ArgumentParser(fromfile_prefix_chars="@")
+    stock.add_argument("-p", "--paths", nargs="+")
+    stock.add_argument("-s", "--sizes", nargs="+", type=int, default=[])
+    stock.add_argument("-n", "--name", default="")
+    stock_copy = ArgumentParser(fromfile_prefix_chars="@")
+    stock_copy.add_argument("src")
+    stock_copy.add_argument("dst")
+    stock_copy.add_argument("-m", "--mode", default="")
+
+    for argv in (["@" + str(two_file)], ["-m", "x", "@" + str(two_file)]):
+        assert vars(copy_parser.parse_args(argv)) == vars(stock_copy.parse_args(argv))
+    args = copy_parser.parse_args(["@" + str(two_file)])
+    assert vars(args) == {"src": "a", "dst": "b", "mode": ""}
+
+    argv = ["-p", "@" + str(breaks_file)]
+    assert vars(parser.parse_args(argv)) == vars(stock.parse_args(argv))
+    assert parser.parse_args(["-p", "@" + str(breaks_file)]).paths == ["a", "b", "c"]
+
+
+@dataclass
+class Vectors:
+    ids: List[int] = opt(container="array")
+    weights: List[float] = opt(default_factory=list, container="array")
+
+
+def test_array_container(tmp_path):
+    for fast_parse in (True, False):
+        parser = DataClassParser(Vectors, fast_parse=fast_parse)
+        args = parser.parse_args(["-i", "1", "2", "3", "-w", "0.5", "1e3"])
+        assert args.ids == array("q", [1, 2, 3]) and isinstance(args.ids, array)
+        assert args.weights == array("d", [0.5, 1000.0])
+
+        # Defaults are arrays too
+        args = parser.parse_args(["-i", "1"])
+        assert args.weights == array("d") and isinstance(args.weights, array)
+
+    ids_file = tmp_path / "ids.txt"
+    ids_file.write_text("".join("{}\n".format(i) for i in range(1000)))
+    parser = DataClassParser(Vectors, fromfile_prefix_chars="@")
+    assert parser.parse_args(["-i", "@" + str(ids_file), "1000"]).ids == array("q", range(1001))
+
+    with raises(UnsupportedException):
+
+        @dataclass
+        class NotNumbers:
+            names: List[str] = opt(container="array")
+
+        DataClassParser(NotNumbers)
+
+
+def test_array_container_errors(capsys):
+    parser = DataClassParser(Vectors)
+    for argv, message in [
+        (["-i", "1", "x"], "argument --ids/-i: invalid int value: 'x'"),
+        (["-i", str(2**70)], "argument --ids/-i: value out of range: '%d'" % 2**70),
+    ]:
+        with raises(SystemExit):
+            parser.parse_args(argv)
+        assert message in capsys.readouterr().err
+
+
+def test_numpy_container():
+    @dataclass
+    class NumpyVectors:
+        ids: List[int] = opt(container="numpy")
+
+    try:
+        import numpy
+    except ImportError:
+        with raises(UnsupportedException, match="requires NumPy"):
+            DataClassParser(NumpyVectors)
+    else:
+        ids = DataClassParser(NumpyVectors).parse_args(["-i", "1", "2"]).ids
+        assert isinstance(ids, numpy.ndarray) and ids.tolist() == [1, 2]
+
+
+def test_parser_stats():
+    stats = ParserStats()
+    clear_plan_cache()
+    parser = DataClassParser(FromEnv, stats=stats)
+    parser.add_command("configured-command", ConfiguredCommand)
+
+    phases = {phase for phase, _, _, _ in stats.summary()}
+    assert {"plan", "introspect", "get_names", "get_type", "default_factory", "add_argument"} <= (
+        phases
+    )
+    assert sorted(name for _, name, _, _ in stats.summary("introspect")) == [
+        "ConfiguredCommand",
+        "FromEnv",
+    ]
+
+    stats.clear()
+    parser.parse_args(["-n", "x", "configured-command", "/", "-r", "2"])
+    names = {(phase, name) for phase, name, _, _ in stats.summary()}
+    assert ("argparse", parser.prog) in names
+    assert ("convert", "ConfiguredCommand.retries") in names
+    assert ("construct", "ConfiguredCommand") in names
+
+    stats.clear()
+    fast = DataClassParser(FromEnv, stats=stats)
+    fast.parse_args(["-n", "x", "-c", "3"])
+    names = {(phase, name) for phase, name, _, _ in stats.summary()}
+    assert {("fast_parse", "FromEnv"), ("convert", "FromEnv.count"), ("construct", "FromEnv")} <= (
+        names
+    )
+    assert all(count == 1 and seconds >= 0 for _, _, count, seconds in stats.summary("convert"))
+
+
+@dataclass
+class Pool:
+    max_size: int = opt(default=10)
+    timeout: float = opt(default=1.0)
+
+
+@dataclass
+class Database:
+    host: str = arg()
+    pool: Pool = field(default_factory=Pool)
+    tags: List[str] = opt(default_factory=list)
+
+
+@dataclass
+class Service:
+    name: str = opt(default="svc")
+    db: Database = field(default_factory=lambda: Database("localhost", Pool(max_size=5)))
+    replica: Optional[Database] = None
+    verbose: bool = opt(default=False)
+
+
+def test_nested_dataclasses():
+    for fast_parse in (True, False):
+        parser = DataClassParser(Service, fast_parse=fast_parse)
+        assert parser.parse_args([]) == Service()
+        assert parser.parse_args(
+            ["--db-host", "db1", "--db-pool-max-size", "20", "--db-tags", "a", "b", "-v"]
+        ) == Service(db=Database("db1", Pool(max_size=20), ["a", "b"]), verbose=True)
+
+    # Every parser gets fresh defaults
+    DataClassParser(Service).parse_args([]).db.tags.append("x")
+    assert DataClassParser(Service).parse_args([]).db.tags == []
+
+    @dataclass
+    class Required:
+        db: Database
+
+    parser = DataClassParser(Required)
+    with raises(SystemExit):
+        parser.parse_args([])
+    assert parser.parse_args(["--db-host", "h"]) == Required(Database("h"))
+
+
+def test_nested_dataclass_sources(tmp_path, monkeypatch):
+    config_file = tmp_path / "config.json"
+    config_file.write_text('{"db": {"pool": {"max-size": 7}}, "db.host": "config"}')
+    monkeypatch.setenv("SVC_DB_POOL_TIMEOUT", "2.5")
+
+    parser = DataClassParser(Service, config_files=[config_file], env_prefix="SVC_")
+    assert parser.parse_args([]).db == Database("config", Pool(7, 2.5))
+
+
+def test_help_cache(tmp_path, monkeypatch):
+    monkeypatch.setenv("COLUMNS", "100")
+    parser = DataClassParser(FromEnv, help_cache=tmp_path, lazy_commands=True)
+    parser.add_command("configured-command", ConfiguredCommand, help="a command")
+    expected = DataClassParser(FromEnv).format_help()
+
+    assert parser.format_help().startswith(expected.partition("\n\n")[0])
+    assert len(list(tmp_path.iterdir())) == 1
+
+    original = argparse.HelpFormatter.format_help
+    with patch.object(
+        argparse.HelpFormatter, "format_help", autospec=True, side_effect=original
+    ) as format_help:
+        assert parser.format_help() == parser.format_help()
+        assert format_help.call_count == 0
+
+        # A different width, or a changed parser, is formatted again
+        monkeypatch.setenv("COLUMNS", "60")
+        parser.format_help()
+        monkeypatch.setenv("COLUMNS", "100")
+        parser.add_argument("--extra")
+        parser.format_help()
+        assert format_help.call_count == 2
+
+    # Usage errors use the cache too
+    monkeypatch.setattr(sys, "argv", ["prog"])
+    with raises(SystemExit):
+        parser.parse_args(["--unknown"])
+    assert any(path.name.startswith("usage-") for path in tmp_path.iterdir())
+
+
+def test_help_cache_key(tmp_path, monkeypatch):
+    from dataclass_opt import _help
+
+    monkeypatch.setenv("COLUMNS", "100")
+
+    def help_parser():
+        # A partial formatter class, and a default and type whose reprs hold their addresses
+        formatter_class = functools.partial(argparse.HelpFormatter, max_help_position=30)
+        parser = DataClassParser(help_cache=tmp_path, formatter_class=formatter_class)
+        parser.add_argument("--value", default=object(), type=lambda value: value)
+        return parser
+
+    help_parser().format_help()
+    with patch.object(argparse.HelpFormatter, "format_help") as format_help:
+        help_parser().format_help()
+        assert format_help.call_count == 0
+    assert len(list(tmp_path.iterdir())) == 1
+
+    # Only the most recent texts are kept
+    monkeypatch.setattr(_help, "_MAX_ENTRIES", 2)
+    for columns in ("60", "70", "80"):
+        monkeypatch.setenv("COLUMNS", columns)
+        help_parser().format_help()
+    assert len(list(tmp_path.iterdir())) == 2
+
+
+PLUGIN_SOURCE = '''
+from dataclasses import dataclass
+from dataclass_opt import opt
+
+
+@dataclass
+class SyncCommand:
+    """Synchronise the mirrors.
+
+    More details.
+    """
+
+    depth: int = opt(default=1)
+'''
+
+
+def test_string_commands(tmp_path, monkeypatch):
+    (tmp_path / "lazy_plugin.py").write_text(PLUGIN_SOURCE)
+    monkeypatch.syspath_prepend(str(tmp_path))
+    monkeypatch.delitem(sys.modules, "lazy_plugin", raising=False)
+    index = tmp_path / "index.json"
+
+    parser = DataClassParser(commands=["lazy_plugin:SyncCommand"], command_index=index)
+    assert "lazy_plugin" not in sys.modules
+    assert "Synchronise the mirrors." in parser.format_help()
+    assert "lazy_plugin" in sys.modules
+    assert index.exists()
+
+    # The index keeps help from importing the command again
+    del sys.modules["lazy_plugin"]
+    parser = DataClassParser(command_index=index)
+    parser.add_command("sync", "lazy_plugin:SyncCommand")
+    assert "Synchronise the mirrors." in parser.format_help()
+    assert "lazy_plugin" not in sys.modules
+
+    args = parser.parse_args(["sync", "-d", "3"])
+    assert type(args).__name__ == "SyncCommand" and args.depth == 3
+
+
+def test_string_commands_in_package(tmp_path, monkeypatch):
+    package = tmp_path / "heavy_plugins"
+    package.mkdir()
+    (package / "__init__.py").write_text("")
+    (package / "sync.py").write_text(PLUGIN_SOURCE)
+    monkeypatch.syspath_prepend(str(tmp_path))
+    for name in ("heavy_plugins", "heavy_plugins.sync"):
+        monkeypatch.delitem(sys.modules, name, raising=False)
+    index = tmp_path / "index.json"
+
+    DataClassParser(commands=["heavy_plugins.sync:SyncCommand"], command_index=index).format_help()
+    del sys.modules["heavy_plugins"], sys.modules["heavy_plugins.sync"]
+
+    # Checking the index imports neither the module nor its package
+    parser = DataClassParser(commands=["heavy_plugins.sync:SyncCommand"], command_index=index)
+    assert "Synchronise the mirrors." in parser.format_help()
+    assert "heavy_plugins" not in sys.modules
+
+    # A changed module is imported again
+    (package / "sync.py").write_text(PLUGIN_SOURCE.replace("Synchronise", "Mirror"))
+    parser = DataClassParser(commands=["heavy_plugins.sync:SyncCommand"], command_index=index)
+    assert "Mirror the mirrors." in parser.format_help()
+
+
+def test_entry_point_commands(tmp_path, monkeypatch):
+    (tmp_path / "ep_plugin.py").write_text(PLUGIN_SOURCE)
+    dist_info = tmp_path / "ep_plugin-1.0.dist-info"
+    dist_info.mkdir()
+    (dist_info / "METADATA").write_text("Metadata-Version: 2.1\nName: ep-plugin\nVersion: 1.0\n")
+    (dist_info / "entry_points.txt").write_text(
+        "[dataclass_opt_tests.commands]\nsync = ep_plugin:SyncCommand\n"
+    )
+    monkeypatch.syspath_prepend(str(tmp_path))
+    monkeypatch.delitem(sys.modules, "ep_plugin", raising=False)
+    index = tmp_path / "index.json"
+
+    parser = DataClassParser(entry_points="dataclass_opt_tests.commands", command_index=index)
+    assert "ep_plugin" not in sys.modules
+    assert parser.parse_args(["sync"]).depth == 1
+
+    from dataclass_opt import _plugins
+
+    with patch.object(_plugins, "entry_point_commands") as entry_point_commands:
+        DataClassParser(entry_points="dataclass_opt_tests.commands", command_index=index)
+        assert entry_point_commands.call_count == 0
+
+
+def test_to_argv():
+    @dataclass
+    class Pool:
+        size: int = opt(default=3)
+
+    @dataclass
+    class Test:
+        name: str = arg()
+        files: List[str] = arg(nargs="*", default_factory=list)
+        rate: float = opt(default=0.1)
+        verbose: int = opt(action="count", default=0)
+        debug: bool = opt(default=False)
+        quiet: bool = opt(action="store_false", default=True, short="-Q")
+        tags: List[str] = opt(action="append", default_factory=lambda: ["all"], short=None)
+        pairs: List[List[int]] = opt(action="append", nargs=2, type=int, default=None, short=None)
+        token: Optional[str] = opt("--token", "-k", default=None)
+        pool: Pool = field(default_factory=Pool)
+        mode: str = opt(action="store_const", const="fast", default="slow", short=None)
+        offset: int = opt(default=0, short=None)
+
+    parser = DataClassParser(Test)
+
+    obj = Test("x")
+    assert dataclass_opt.to_argv(obj, skip_defaults=True) == ["x"]
+    assert parser.parse_args(dataclass_opt.to_argv(obj)) == obj
+
+    obj = Test(
+        "-y", ["a", "-b"], 0.5, 2, True, False, ["all", "p"], [[1, 2], [3, -4]], "-t",
+        Pool(9), "fast", -5,
+    )  # fmt: skip
+    argv = dataclass_opt.to_argv(obj)
+    assert argv == [
+        "--rate", "0.5", "--verbose", "--verbose", "--debug", "--quiet", "--tags", "p",
+        "--pairs", "1", "2", "--pairs", "3", "-4", "--token=-t", "--pool-size", "9", "--mode",
+        "--offset", "-5", "--", "-y", "a", "-b",
+    ]  # fmt: skip
+    assert parser.parse_args(argv) == obj
+    assert parser.to_argv(obj) == argv
+
+    with raises(ValueError):
+        dataclass_opt.to_argv(Test(None))
+    with raises(ValueError):
+        dataclass_opt.to_argv(Test("x", tags=["p"]))
+    with raises(ValueError):
+        dataclass_opt.to_argv(Test("x", pairs=[["-a", "b"]]))
+
+
+def test_to_argv_commands():
+    @dataclass
+    class Top:
+        level: int = opt(default=1)
+
+    @dataclass
+    class Copy:
+        source: str = arg()
+        force: bool = opt(default=False)
+
+    def copy(args):
+        pass
+
+    parser = DataClassParser(Top)
+    parser.add_command("copy", Copy, func=copy)
+    result = parser.parse_args(["--level", "2", "copy", "-f", "a"])
+    assert parser.to_argv(result) == ["--level", "2", "copy", "--force", "a"]
+    assert parser.parse_args(parser.to_argv(result)) == result
+
+    parser = DataClassParser(commands=[Copy], lazy_commands=True)
+    parser.add_argument("--dry-run", action="store_true")
+    result = parser.parse_args(["--dry-run", "copy", "a"])
+    assert parser.to_argv(result) == ["--dry-run", "copy", "a"]
+
+    with raises(ValueError):
+        parser.to_argv((Namespace(dry_run=False), Top()))
+
+
+@dataclass
+class Train:
+    lr: float = opt(default=0.1)
+    batch: int = opt(default=32)
+    name: str = opt(default="run", short=None)
+
+
+def train(args):
+    return args.lr * args.batch
+
+
+def test_parse_sweep(capsys):
+    parser = DataClassParser(Train)
+
+    points = parser.parse_sweep(["--lr", "0.1,0.01", "--batch", "32:256:x2", "--name", "x"])
+    assert not isinstance(points, list)
+    assert [(point.lr, point.batch) for point in points] == [
+        (0.1, 32), (0.1, 64), (0.1, 128), (0.1, 256),
+        (0.01, 32), (0.01, 64), (0.01, 128), (0.01, 256),
+    ]  # fmt: skip
+
+    assert [point.lr for point in parser.parse_sweep(["--lr", "0:1:0.25"])] == [
+        0, 0.25, 0.5, 0.75, 1
+    ]  # fmt: skip
+    assert [point.batch for point in parser.parse_sweep(["--batch", "3:1:-1"])] == [3, 2, 1]
+    assert list(parser.parse_sweep(["--name", "1:2"])) == [Train(name="1:2")]
+    assert list(parser.parse_sweep([])) == [Train()]
+
+    # A trillion points, generated one at a time
+    points = parser.parse_sweep(["--lr", "1:1000000:1", "--batch", "1:1000000:1"])
+    assert next(points) == Train(1, 1) and next(points) == Train(1, 2)
+
+    for argv in (["--batch", "1:4:-1"], ["--batch", "1:4:x1"], ["--batch", "1,x"]):
+        with raises(SystemExit):
+            parser.parse_sweep(argv)
+    assert "--batch" in capsys.readouterr().err
+
+
+def test_run_sweep():
+    parser = DataClassParser()
+    parser.add_command("train", Train, func=train)
+
+    results = parser.run_sweep(["train", "--lr", "0.5,1", "--batch", "1:4"], max_workers=2)
+    assert sorted(value for _, value in results) == [0.5, 1, 1, 1.5, 2, 2, 3, 4]
+
+    from concurrent.futures import ThreadPoolExecutor
+    import threading
+
+    lock = threading.Lock()
+    running = [0, 0]
+
+    def tracked(args):
+        with lock:
+            running[0] += 1
+            running[1] = max(running)
+        with lock:
+            running[0] -= 1
+        return args.batch
+
+    parser = DataClassParser()
+    parser.add_command("train", Train, func=tracked)
+    with ThreadPoolExecutor(8) as executor:
+        results = list(
+            parser.run_sweep(["train", "--batch", "1:100"], window=3, executor=executor)
+        )
+    assert sorted(value for _, value in results) == list(range(1, 101))
+    assert running[1] <= 3
+    assert all(point.batch == value for point, value in results)
+
+
+def test_run():
+    import asyncio
+
+    @dataclass
+    class Fetch:
+        count: int = opt(default=10)
+
+    async def fetch(args):
+        active = [0, 0]
+
+        async def get(i):
+            active[0] += 1
+            active[1] = max(active)
+            await asyncio.sleep(0.001)
+            active[0] -= 1
+            return i * 2
+
+        results = [result async for result in dataclass_opt.amap(get, range(args.count))]
+        async with dataclass_opt.concurrency_limit():
+            pass
+        return results, active[1]
+
+    def count(top, args):
+        return top.level, args.count
+
+    parser = DataClassParser()
+    parser.add_command("fetch", Fetch, func=fetch)
+    assert parser.run(["fetch", "-c", "5"], concurrency=2) == ([0, 2, 4, 6, 8], 2)
+    assert parser.run(["fetch"]) == (list(range(0, 20, 2)), 1)
+    assert asyncio.run(parser.arun(["fetch", "-c", "3"], concurrency=4)) == ([0, 2, 4], 3)
+
+    @dataclass
+    class Top:
+        level: int = opt(default=1)
+
+    parser = DataClassParser(Top)
+    parser.add_command("count", Fetch, func=count)
+    assert parser.run(["-l", "2", "count", "-c", "3"]) == (2, 3)
+    with raises(SystemExit):
+        parser.run(["-l", "2"])
+
+
+def test_arun_cancellation():
+    import asyncio
+
+    @dataclass
+    class Copy:
+        pass
+
+    started = []
+    cancelled = []
+
+    async def copy_one(i):
+        started.append(i)
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(i)
+            raise
+
+    async def copy(args):
+        async for _ in dataclass_opt.amap(copy_one, range(1000)):
+            pass
+
+    parser = DataClassParser()
+    parser.add_command("copy", Copy, func=copy)
+
+    async def main():
+        task = asyncio.ensure_future(parser.arun(["copy"], concurrency=3))
+        while len(started) < 3:
+            await asyncio.sleep(0)
+        task.cancel()
+        with raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(main())
+    assert sorted(started) == sorted(cancelled) == [0, 1, 2]
+
+
+POSTPONED_SOURCE = """
+from __future__ import annotations
+
+from dataclasses import FrozenInstanceError, dataclass, field, replace
+from typing import TYPE_CHECKING, List, Optional
+
+from dataclass_opt import arg, opt
+
+if TYPE_CHECKING:
+    from decimal import Decimal
+
+
+@dataclass
+class Pool:
+    size: int = opt(default=4)
+
+
+@dataclass
+class Job:
+    name: str = arg()
+    retries: int = opt(default=1)
+    ids: List[int] = opt(default_factory=list)
+    ratio: Optional[float] = opt(default=None, short=None)
+    dry_run: bool = opt(default=False)
+    price: Decimal = opt(default="0", short=None)
+    pool: Pool = field(default_factory=Pool)
+"""
+
+
+def test_postponed_annotations(tmp_path, monkeypatch):
+    (tmp_path / "postponed_jobs.py").write_text(POSTPONED_SOURCE)
+    monkeypatch.syspath_prepend(str(tmp_path))
+    monkeypatch.delitem(sys.modules, "postponed_jobs", raising=False)
+    from postponed_jobs import Job, Pool
+
+    parser = DataClassParser(Job)
+    argv = "build -r 3 --ids 1 2 --ratio 0.5 -d --price 1.5 --pool-size 8".split()
+    assert parser.parse_args(argv) == Job("build", 3, [1, 2], 0.5, True, "1.5", Pool(8))
+
+    with patch("typing.get_type_hints", wraps=__import__("typing").get_type_hints) as hints:
+        clear_plan_cache()
+        DataClassParser(Job)
+        # Once for Job, and once for Pool
+        assert hints.call_count == 2
+        DataClassParser(Job)
+        assert hints.call_count == 2
+
+
+def test_compact_results():
+    argv = ["db1", "--pool-max-size", "20", "--tags", "a", "b"]
+    for kind in ("slots", "frozen", "tuple"):
+        parser = DataClassParser(Database, compact=kind)
+        result = parser.parse_args(argv)
+        assert not hasattr(result, "__dict__") and not hasattr(result.pool, "__dict__")
+        assert (result.host, result.pool.max_size, result.pool.timeout) == ("db1", 20, 1.0)
+        assert repr(result).startswith("Database(host='db1', pool=Pool(max_size=20, ")
+        assert type(result) is type(parser.parse_args(["db2"]))
+        assert parser.to_argv(result, skip_defaults=True) == argv[1:] + argv[:1]
+        assert dataclass_opt.to_argv(result)[-1] == "db1"
+
+        run = DataClassParser(Train, compact=kind).parse_args(["--lr", "0.5"])
+        assert pickle.loads(pickle.dumps(run)) == run
+
+    result = DataClassParser(Database, compact="slots").parse_args(argv)
+    result.host = "db2"
+    assert replace(result, host="db3").host == "db3"
+    with raises(FrozenInstanceError):
+        DataClassParser(Database, compact="frozen").parse_args(argv).host = "db2"
+    record = DataClassParser(Database, compact="tuple").parse_args(argv)
+    assert isinstance(record, tuple) and record._fields == ("host", "pool", "tags")
+    assert record._replace(host="db2")._asdict()["host"] == "db2"
+    assert type(record)("db3").tags == []
+
+    parser = DataClassParser(compact="tuple")
+    parser.add_command("train", Train, func=train)
+    assert parser.run(["train", "--batch", "2"]) == 0.2
+    columns = DataClassParser(Train, compact="tuple").parse_batch([["--lr", "1"]], columnar=True)
+    assert columns["lr"] == [1.0]
+
+    with raises(ValueError):
+        DataClassParser(Train, compact="dict")
+
+
+def test_iter_parse():
+    parser = DataClassParser(Train)
+    text = (
+        "--lr 0.5\n\n# a comment\n"
+        '--name "a b" -b 8  # trailing\n["--name", "c d"]\n-b x\n"open\n'
+    )
+    results = list(parser.iter_parse(io.StringIO(text)))
+    assert results[:3] == [Train(lr=0.5), Train(name="a b", batch=8), Train(name="c d")]
+    assert [(e.line, e.argv) for e in results[3:]] == [(6, ["-b", "x"]), (7, None)]
+    assert "invalid int value" in results[3].message
+
+    results = list(parser.iter_parse(io.BytesIO(b"--batch 2\n\xff\n[1]\n")))
+    assert results[0] == Train(batch=2)
+    assert all(isinstance(e, ParseError) for e in results[1:])
+    assert list(parser.iter_parse(["--name '[x]'"], format="shell")) == [Train(name="[x]")]
+
+    # Only the whitespace shlex splits at separates arguments
+    for name in ("a\u00a0b", "a\x0cb"):
+        line = "--name {}\r\n".format(name)
+        assert list(parser.iter_parse([line])) == [Train(name=name)]
+        assert list(parser.iter_parse([line + "#"])) == [Train(name=name)]
+
+    # Lines are read only as results are taken
+    def lines():
+        yield "--batch 1"
+        raise AssertionError("read too far")
+
+    assert next(parser.iter_parse(lines())) == Train(batch=1)
+
+    with raises(ValueError):
+        next(parser.iter_parse([], format="csv"))
+
+
+def test_nested_parse():
+    @dataclass
+    class Inner:
+        x: int = opt(default=0)
+
+    inner = DataClassParser(Inner)
+
+    def parse_inner(value):
+        return inner.parse_args(["-x", value])
+
+    @dataclass
+    class Outer:
+        inner: Inner = opt(type=parse_inner)
+
+    @dataclass
+    class Command:
+        inner: Inner = opt(type=parse_inner, default=None)
+        lr: float = opt(default=0.1)
+
+    for fast_parse in (True, False):
+        parser = DataClassParser(Outer, fast_parse=fast_parse)
+        assert parser.parse_args(["--inner", "5"]) == Outer(Inner(5))
+
+    parser = DataClassParser(commands=[Command])
+    assert parser.parse_args(["command", "-i", "5"]) == Command(Inner(5))
+    sweep = parser.parse_sweep(["command", "-i", "5", "--lr", "0.1,0.2"])
+    assert [point.lr for point in sweep] == [0.1, 0.2]
@@ -0,0 +1,48 @@
+import subprocess
+import sys
+
+# Generous budgets, in microseconds; they only need to catch regressions such as an eager import
+# of a heavy module, not small fluctuations between machines.
+SELF_BUDGET_US = 20_000
+CUMULATIVE_BUDGET_US = 150_000
+
+LAZY_MODULES = ["asyncio", "inflection", "typing", "dataclass_opt.codegen"]
+
+
+def import_times(code):
+    """Run `code` in a fresh interpreter with -X importtime.
+
+    Returns {module: (self, cumulative)}, in microseconds.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+        check=True,
+    )
+
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:") :].split("|")
+        times[name.strip()] = (int(self_us), int(cumulative_us))
+    return times
+
+
+def test_import_time_budget():
+    times = import_times("import dataclass_opt")
+
+    self_us, cumulative_us = times["dataclass_opt"]
+    assert self_us < SELF_BUDGET_US
+    assert cumulative_us < CUMULATIVE_BUDGET_US
+
+
+def test_lazy_imports():
+    times = import_times("import dataclass_opt")
+    for name in LAZY_MODULES:
+        assert name not in times
+
+    times = import_times("import dataclass_opt; dataclass_opt.dasherize; dataclass_opt.FileType")
+    assert "inflection" in times
@@ -0,0 +1,95 @@
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+from pytest import fixture, mark
+
+import dataclass_opt
+
+CLIENT = str(Path(dataclass_opt.__file__).parent / "_client.py")
+ROOT = str(Path(dataclass_opt.__file__).parent.parent)
+
+TOOL_SOURCE = """
+import os
+import sys
+from dataclasses import dataclass
+
+from dataclass_opt import DataClassParser, arg, opt
+
+
+@dataclass
+class Greet:
+    name: str = arg()
+    loud: bool = opt(default=False)
+
+
+def greet(args):
+    greeting = "{greeting}"
+    print(greeting.upper() if args.loud else greeting, args.name, os.environ.get("PUNCTUATION"))
+    print("in", os.getcwd(), file=sys.stderr)
+    return len(args.name)
+
+
+def build():
+    parser = DataClassParser(prog="tool")
+    parser.add_command("greet", Greet, func=greet)
+    return parser
+"""
+
+
+@fixture
+def server(tmp_path):
+    (tmp_path / "tool.py").write_text(TOOL_SOURCE.format(greeting="hello"))
+    socket_path = str(tmp_path / "tool.sock")
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([str(tmp_path), ROOT]))
+    process = subprocess.Popen(
+        [sys.executable, "-m", "dataclass_opt", "serve", "tool:build", "--socket", socket_path],
+        env=env,
+    )
+    try:
+        for _ in range(100):
+            if os.path.exists(socket_path):
+                break
+            time.sleep(0.05)
+        yield tmp_path, socket_path
+    finally:
+        process.terminate()
+        process.wait(10)
+    assert not os.path.exists(socket_path)
+
+
+def run_client(socket_path, *args, **kwargs):
+    return subprocess.run(
+        [sys.executable, "-I", CLIENT, socket_path] + list(args),
+        capture_output=True,
+        text=True,
+        **kwargs
+    )
+
+
+@mark.skipif(not hasattr(os, "fork"), reason="the server forks")
+def test_server(server):
+    tmp_path, socket_path = server
+    env = dict(os.environ, PUNCTUATION="!")
+
+    result = run_client(socket_path, "greet", "-l", "world", cwd=str(tmp_path), env=env)
+    assert result.stdout == "HELLO world !\n"
+    assert result.stderr == "in {}\n".format(tmp_path)
+    assert result.returncode == 5
+
+    result = run_client(socket_path, "greet")
+    assert "the following arguments are required: name" in result.stderr
+    assert result.returncode == 2
+
+    # Edited command modules are reloaded
+    (tmp_path / "tool.py").write_text(TOOL_SOURCE.format(greeting="goodbye"))
+    result = run_client(socket_path, "greet", "all")
+    assert result.stdout == "goodbye all None\n"
+
+
+def test_client_errors(tmp_path):
+    result = run_client(str(tmp_path / "missing.sock"), "greet")
+    assert result.returncode == 1
+    assert "cannot run the command" in result.stderr
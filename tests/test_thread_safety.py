@@ -0,0 +1,104 @@
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import List, Optional
+
+from dataclass_opt import DataClassParser, Namespace, ParseError, arg, clear_plan_cache, opt
+
+THREADS = 16
+ITERATIONS = 100
+
+
+@dataclass
+class Top:
+    verbose: bool = opt()
+
+
+@dataclass
+class Fetch:
+    url: str
+    retries: int = opt(default=3)
+
+
+@dataclass
+class Store:
+    keys: List[str] = arg(nargs="+")
+    bucket: Optional[str] = opt()
+
+
+@dataclass
+class Simple:
+    name: str = opt()
+    count: int = opt(default=1)
+
+
+def run_threads(func):
+    """Run func(i) for every iteration in many threads started together, and return the results."""
+    barrier = threading.Barrier(THREADS)
+
+    def worker(thread):
+        barrier.wait()
+        return [func(thread, i) for i in range(ITERATIONS)]
+
+    with ThreadPoolExecutor(THREADS) as executor:
+        return list(executor.map(worker, range(THREADS)))
+
+
+def test_concurrent_parsers():
+    # Different kinds of parsers used at the same time must not see each other's state
+    parsers = [
+        DataClassParser(Top, commands=[Fetch, Store]),
+        DataClassParser(commands=[Fetch, Store], lazy_commands=True),
+        DataClassParser(Simple),
+        DataClassParser(Simple, fast_parse=False),
+    ]
+    parsers.append(DataClassParser(commands=[Fetch]))
+    parsers[-1].add_argument("--extra")
+
+    def parse(thread, i):
+        parser = parsers[(thread + i) % len(parsers)]
+        if parser is parsers[0]:
+            expected = (Top(True), Fetch(str(i)))
+            return parser.parse_args(["-v", "fetch", str(i)]) == expected
+        if parser is parsers[1]:
+            return parser.parse_args(["store", str(i), "-b", "x"]) == Store([str(i)], "x")
+        if parser is parsers[4]:
+            expected = (Namespace(extra=None), Fetch("u", i))
+            return parser.parse_args(["fetch", "u", "-r", str(i)]) == expected
+        return parser.parse_args(["--name", str(i), "-c", str(thread)]) == Simple(str(i), thread)
+
+    assert all(all(results) for results in run_threads(parse))
+
+
+def test_concurrent_parser_construction():
+    def build(thread, i):
+        if i % 50 == 0:
+            clear_plan_cache()
+        parser = DataClassParser(Top, commands=[Fetch, Store])
+        return parser.parse_args(["store", "k"]) == (Top(False), Store(["k"], None))
+
+    assert all(all(results) for results in run_threads(build))
+
+
+def test_concurrent_batches_and_errors():
+    parser = DataClassParser(Simple)
+
+    def parse(thread, i):
+        if thread % 2:
+            result = parser.parse_batch([["--name", "a"], ["--count", "x"]], columnar=False)
+            return result[0] == Simple("a") and isinstance(result[1], ParseError)
+        try:
+            parser.parse_args(["--count", "x"])
+        except SystemExit:
+            return True
+        return False
+
+    stderr = sys.stderr
+    try:
+        sys.stderr = open(os.devnull, "w")
+        assert all(all(results) for results in run_threads(parse))
+    finally:
+        sys.stderr.close()
+        sys.stderr = stderr